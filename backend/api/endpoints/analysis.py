@@ -1,133 +1,266 @@
 # api/endpoints/analysis.py
-from fastapi import APIRouter, UploadFile, File, Depends
+from fastapi import APIRouter, Request, Response, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
 import os
+import shutil
+from dataclasses import asdict
 from typing import Dict, Any
-from datetime import datetime
 
+from core.config.constants import JobStatus
 from core.config.settings import get_settings, Settings
 from core.config.paths import path_config
 from core.logging.logger import get_logger
 from core.request_handler import request_manager
-from domain.models.requests import AnalysisRequest, AnalysisResponse
+from core.request_context import RequestContext
+from core.job_manager import job_manager
+from core.metrics import metrics_registry
+from domain.models.requests import (
+    AnalysisRequest,
+    AnalysisResponse,
+    FileUploadResponse,
+    FollowUpRequest,
+    JobSubmitResponse,
+    JobStatusResponse,
+)
 from domain.exceptions.custom import (
     FileOperationError,
+    DataProcessingError,
+    FileTooLargeError,
     ValidationError,
+    JobNotFoundError,
+    JobNotReadyError,
+)
+from services.data.dataset_upload import DatasetUploadStream, write_upload_info
+from services.data.dataset_profiler import profile_dataset, save_profile
+from services.pipeline.analysis_pipeline import (
+    append_questions_pipeline,
+    resume_analysis_pipeline,
+    run_analysis_pipeline,
 )
-from services.analysis.code_generator import CodeGenerator
-from services.analysis.code_executor import CodeExecutor
-from services.analysis.description_generator import generate_descriptions
-from services.report.pdf_generator import generate_pdf
+from services.pipeline.report_cache import get_report_cache
+from services.pipeline.stage_ledger import StageLedger
 
 logger = get_logger(__name__)
 router = APIRouter()
 
-# 上传数据集API
-@router.post("/upload-dataset")
+# 同一请求目录同一时间只允许一个任务写入
+def _ensure_no_active_job(request_id: str) -> None:
+    """Reject a new job while another one is still writing to the same request directory"""
+    active = job_manager.active_job(request_id)
+    if active:
+        raise JobNotReadyError(f"{active.job_id} is still {active.status.value} for request {request_id}")
+
+# 上传数据集API：流式写盘，边接收边计算哈希和行数，超过大小限制立即中止
+@router.post("/upload-dataset", response_model=FileUploadResponse)
 async def upload_dataset(
-    file: UploadFile = File(...),
+    request: Request,
     settings: Settings = Depends(get_settings)
 ) -> Dict[str, Any]:
-    """Upload dataset for analysis"""
-    # 上传数据集文件，保存到后端指定目录，并设置环境变量
+    """Upload dataset for analysis (multipart form field ``file``)"""
+    # 创建新的请求目录（每次分析任务单独一个目录，便于隔离和追溯）
+    context = request_manager.create_request_context()
     try:
-        # 创建新的请求目录（每次分析任务单独一个目录，便于隔离和追溯）
-        request_dir = request_manager.create_request_directory()
-        path_config.set_request_directories(request_dir)
-        
-        # 构造数据文件的保存路径（如 .../data/xxx.csv）
-        file_path = path_config.DATA_DIR / file.filename
-        logger.info(f"Saving file to: {file_path}")
-        
-        # 保存上传的文件内容到本地
-        with open(file_path, "wb") as buffer:
-            content = await file.read()  # 读取上传的全部内容
-            buffer.write(content)
+        upload = DatasetUploadStream(
+            destination_dir=context.data_dir,
+            max_size=settings.MAX_FILE_SIZE,
+            allowed_extensions=settings.ALLOWED_EXTENSIONS,
+            chunk_size=settings.UPLOAD_CHUNK_SIZE
+        )
+        result = await upload.receive(request)
+        write_upload_info(context.upload_info_path, result)
         
-        # 设置环境变量，供后续分析流程读取数据文件
-        os.environ["DATA_FILE_PATH"] = str(file_path)
+        # 上传后立即生成数据集画像（采样读取），后续代码生成直接复用
+        context = context.with_data_path(result.path)
+        profile = await run_in_threadpool(
+            profile_dataset, context.data_path, settings.PROFILE_SAMPLE_ROWS, result.rows
+        )
+        save_profile(context, profile)
         
-        logger.info(f"Successfully uploaded dataset: {file.filename}")
-        # 返回上传成功的状态、文件名和路径
+        logger.info(f"Successfully uploaded dataset: {result.filename}")
+        # 返回上传成功的状态、请求ID、文件名、路径、大小、哈希和行数
         return {
             "status": "success", 
-            "filename": file.filename,
-            "path": str(file_path)
+            "request_id": context.request_id,
+            **asdict(result)
         }
     except Exception as e:
-        logger.error(f"Failed to upload dataset: {str(e)}")
-        # 上传失败时抛出自定义异常
+        # 上传失败时删除本次请求目录，避免残留空目录
+        shutil.rmtree(context.request_dir, ignore_errors=True)
+        logger.error(f"Failed to upload dataset: {getattr(e, 'detail', str(e))}")
+        if isinstance(e, (ValidationError, FileTooLargeError)):
+            raise
+        if isinstance(e, DataProcessingError):
+            # 无法解析的数据集属于客户端输入错误
+            raise ValidationError(f"Could not read dataset: {e.detail}")
+        # 其他异常统一抛出自定义异常
         raise FileOperationError(str(e))
 
-# 数据分析主API
-@router.post("/analyze", response_model=AnalysisResponse)
+# 报告缓存命中时，本次上传的请求目录不会再被使用，直接删除
+def _discard_cached_upload(context: RequestContext, cached_request_id: str) -> None:
+    """Delete a fresh upload whose report is served from an earlier request"""
+    # 只删除从未分析过且没有任务在运行的目录，已有分析结果的请求目录保留
+    if cached_request_id == context.request_id or context.ledger_path.exists() \
+            or job_manager.active_job(context.request_id):
+        return
+    request_manager.discard_request(context, successor=request_manager.get_request_context(cached_request_id))
+
+# 数据分析主API：将分析任务放入后台队列，立即返回任务ID
+@router.post("/analyze", response_model=JobSubmitResponse, status_code=202)
 async def analyze_data(
     request: AnalysisRequest,
+    response: Response,
     settings: Settings = Depends(get_settings)
 ) -> Dict[str, Any]:
-    """Analyze dataset with provided questions"""
-    # 根据用户上传的数据和问题，自动完成分析、可视化、解读和报告生成
+    """Queue dataset analysis with provided questions"""
+    # 根据用户上传的数据和问题，提交后台任务完成分析、可视化、解读和报告生成
     logger.info(f"Analyzing data with questions: {request.questions}")
     
-    # 检查数据文件路径是否存在，防止未上传数据直接分析
-    if not os.environ.get("DATA_FILE_PATH") or not os.path.exists(os.environ["DATA_FILE_PATH"]):
+    # 根据请求ID加载请求上下文；未提供时回退到最近一次上传（兼容旧客户端）
+    try:
+        context = request_manager.get_request_context(request.request_id)
+    except FileOperationError as e:
+        logger.error(f"No active request session: {e.detail}")
+        raise ValidationError("No dataset uploaded or request not found")
+    
+    # 检查数据文件是否存在，防止未上传数据直接分析
+    if not context.data_path or not context.data_path.exists():
         logger.error("No dataset uploaded or file not found")
         raise ValidationError("No dataset uploaded or file not found")
     
-    try:
-        # 获取当前请求目录，保证每次分析任务隔离
-        if not path_config.CURRENT_REQUEST_DIR:
-            raise ValidationError("No active request session")
-        
-        # 提取请求ID（目录名），用于后续追溯和文件定位
-        request_id = path_config.CURRENT_REQUEST_DIR.name
-        logger.info(f"Processing request ID: {request_id}")
-        
-        # 步骤1：自动生成可视化分析代码
-        generator = CodeGenerator()
-        code_result = generator.generate(request.questions)
-        if code_result["status"] != "success":
-            logger.error(f"Code generation failed: {code_result.get('message')}")
-            raise ValidationError(code_result.get("message"))
-        
-        # 步骤2：执行自动生成的分析代码，生成图表和统计结果
-        executor = CodeExecutor()
-        execution_result = executor.execute_code()
-        if execution_result["status"] != "success":
-            logger.error(f"Code execution failed: {execution_result.get('message')}")
-            raise ValidationError(execution_result.get("message"))
-        
-        # 步骤3：自动生成图表解读（AI分析）
-        description_results = generate_descriptions()
-        if not description_results:
-            logger.error("Failed to generate descriptions")
-            raise ValidationError("Failed to generate descriptions")
-        
-        # 步骤4：生成最终PDF报告，包含所有图表、统计和解读
-        pdf_path = generate_pdf(report_title=request.reportTitle)
-        if not pdf_path:
-            logger.error("Failed to generate PDF")
-            raise ValidationError("Failed to generate PDF")
-        
-        logger.info("Analysis completed successfully")
-        
-        # 返回分析结果，包含状态、请求ID、时间戳、可视化文件、解读数量、PDF路径等
-        return {
-            "status": "success",
-            "message": "Analysis completed successfully",
-            "request_id": request_id,
-            "timestamp": datetime.now(),
-            "details": {
-                "visualizations": execution_result.get("generated_files", []),  # 生成的图表文件名列表
-                "descriptions": len(description_results),                      # 生成的解读数量
-                "pdf_path": os.path.basename(pdf_path)                         # 生成的PDF文件名
+    # 相同数据集内容、问题和标题已有报告时直接返回，任务立即处于完成状态
+    report_cache = get_report_cache()
+    if report_cache is not None and not request.force_refresh:
+        cached = await run_in_threadpool(report_cache.lookup, context, request.questions, request.reportTitle)
+        if cached is not None:
+            message = f"Report served from cache (request {cached['request_id']})"
+            _discard_cached_upload(context, cached["request_id"])
+            job = job_manager.add_completed(cached["request_id"], {**cached, "message": message}, message)
+            response.status_code = 200
+            return {
+                "status": job.status,
+                "job_id": job.job_id,
+                "request_id": job.request_id,
+                "message": message
             }
-        }
-        
-    except Exception as e:
-        logger.error(f"Analysis failed: {str(e)}")
-        # 捕获所有异常并抛出自定义异常
-        raise ValidationError(str(e))
+    
+    # 新的分析会重置台账并清理输出文件，同一请求目录不能同时运行两个任务
+    # （检查与提交之间没有await，不会被其他请求插入）
+    _ensure_no_active_job(context.request_id)
+    job = job_manager.submit(
+        context.request_id,
+        run_analysis_pipeline,
+        questions=request.questions,
+        report_title=request.reportTitle,
+        context=context
+    )
+    
+    return {
+        "status": job.status,
+        "job_id": job.job_id,
+        "request_id": job.request_id,
+        "message": "Analysis job queued"
+    }
+
+# 恢复分析API：跳过已完成且文件未变化的阶段，只重做失败或缺失的部分
+@router.post("/analyze/{request_id}/resume", response_model=JobSubmitResponse, status_code=202)
+async def resume_analysis(request_id: str) -> Dict[str, Any]:
+    """Queue a job that finishes an earlier analysis of this request from its stage ledger"""
+    try:
+        context = request_manager.get_request_context(request_id)
+    except FileOperationError as e:
+        logger.error(f"No request to resume: {e.detail}")
+        raise ValidationError(f"Request not found: {request_id}")
+    
+    # 同一请求目录不能同时运行两个任务
+    _ensure_no_active_job(context.request_id)
+    if not context.ledger_path.exists():
+        raise ValidationError(f"No analysis to resume for request {request_id}")
+    
+    job = job_manager.submit(context.request_id, resume_analysis_pipeline, context=context)
+    return {
+        "status": job.status,
+        "job_id": job.job_id,
+        "request_id": job.request_id,
+        "message": "Analysis resume job queued"
+    }
+
+# 追加问题API：在已有分析的基础上只处理新问题，并按全部问题重建报告
+@router.post("/analyze/{request_id}/questions", response_model=JobSubmitResponse, status_code=202)
+async def add_questions(request_id: str, request: FollowUpRequest) -> Dict[str, Any]:
+    """Queue a job that analyses follow-up questions and rebuilds the report"""
+    try:
+        context = request_manager.get_request_context(request_id)
+    except FileOperationError as e:
+        logger.error(f"No request to add questions to: {e.detail}")
+        raise ValidationError(f"Request not found: {request_id}")
+    
+    # 同一请求目录不能同时运行两个任务
+    _ensure_no_active_job(context.request_id)
+    if not context.ledger_path.exists():
+        raise ValidationError(f"No analysis to add questions to for request {request_id}")
+    if not context.data_path or not context.data_path.exists():
+        raise ValidationError("No dataset uploaded or file not found")
+    
+    # 报告中已有的问题不重复分析
+    existing = {question.strip() for question in StageLedger.load(context).questions}
+    questions = list(dict.fromkeys(q for q in request.questions if q.strip() not in existing))
+    if not questions:
+        raise ValidationError("All questions are already part of this report")
+    
+    job = job_manager.submit(
+        context.request_id,
+        append_questions_pipeline,
+        context=context,
+        questions=questions,
+        report_title=request.reportTitle
+    )
+    return {
+        "status": job.status,
+        "job_id": job.job_id,
+        "request_id": job.request_id,
+        "message": f"Follow-up job queued for {len(questions)} question(s)"
+    }
+
+# 查询后台任务状态API
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str) -> Dict[str, Any]:
+    """Get stage and progress of an analysis job"""
+    job = job_manager.get_job(job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    return job.to_dict()
+
+# 获取后台任务结果API
+@router.get("/jobs/{job_id}/result", response_model=AnalysisResponse)
+async def get_job_result(job_id: str) -> Dict[str, Any]:
+    """Get the final analysis response of a finished job"""
+    job = job_manager.get_job(job_id)
+    if not job:
+        raise JobNotFoundError(job_id)
+    if job.status == JobStatus.FAILED:
+        raise ValidationError(job.error or "Analysis failed")
+    if not job.is_finished:
+        raise JobNotReadyError(f"{job_id} is {job.status.value} ({job.stage.value})")
+    return job.result
+
+# 健康检查API：分析任务在后台线程运行，不会阻塞此接口
+@router.get("/health")
+async def health_check() -> Dict[str, Any]:
+    """Report service liveness and background job counts"""
+    return {
+        "status": "ok",
+        "jobs": job_manager.get_counts()
+    }
+
+# 运行指标API：缓存命中率等进程内统计
+@router.get("/metrics")
+async def get_metrics() -> Dict[str, Any]:
+    """Report in-process metrics such as cache hit rates"""
+    return {
+        "jobs": job_manager.get_counts(),
+        **metrics_registry.snapshot()
+    }
 
 # 获取PDF报告API
 @router.get("/get-pdf")
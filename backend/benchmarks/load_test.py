@@ -0,0 +1,488 @@
+# benchmarks/load_test.py
+"""Concurrent load test for the FastAPI app.
+
+Fires a weighted mix of /upload-dataset, /analyze and /get-pdf requests at
+a target concurrency. Reports throughput, latency histograms, error rates,
+background job latency and event-loop lag as JSON. The LLM is the local
+fake server, so no network or quota is used.
+
+Each analyze first uploads its own copy of the dataset, so concurrent jobs
+never share a request directory. Those uploads are reported separately as
+"analyze.upload"; the "upload" figures cover only the upload operations of
+the mix.
+
+Targets (run from the backend directory):
+
+    # create_application() in this process, over an ASGI transport
+    python -m benchmarks.load_test --concurrency 8 --duration 60
+
+    # uvicorn with 4 worker processes, started and stopped by the harness
+    python -m benchmarks.load_test --uvicorn-workers 4 --concurrency 16 --duration 60
+
+    # an already running deployment
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --mix upload=1,pdf=4
+
+In-process runs measure the lag of the event loop that serves the app. In
+the other modes, that loop belongs to the server, so the lag is measured on
+the client loop, and /health latency is reported as the server-side signal.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from benchmarks.pipeline_benchmark import build_questions, load_example_questions, percentile
+from benchmarks.synthetic_dataset import PRESETS, DatasetSpec, generate_dataset
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+LOAD_TEST_VERSION = 1
+OPERATIONS = ("upload", "analyze", "pdf")
+# 分析操作内部先上传自己的数据集，这些上传单独统计，不计入upload操作
+ANALYZE_UPLOAD = "analyze.upload"
+
+# 延迟直方图的桶上界（秒），1ms到约65s按2倍递增
+HISTOGRAM_BUCKETS = [0.001 * 2 ** i for i in range(17)]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Operation weights from ``upload=1,analyze=2,pdf=5``"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}', expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("At least one operation needs a positive weight")
+    return mix
+
+
+def histogram(latencies: List[float]) -> Dict[str, int]:
+    """Non-cumulative bucket counts keyed by upper bound in seconds"""
+    counts = Counter()
+    for latency in latencies:
+        for bound in HISTOGRAM_BUCKETS:
+            if latency <= bound:
+                counts[f"le_{bound:g}"] += 1
+                break
+        else:
+            counts["le_inf"] += 1
+    return {f"le_{bound:g}": counts[f"le_{bound:g}"] for bound in HISTOGRAM_BUCKETS} | {"le_inf": counts["le_inf"]}
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Any]:
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": round(max(latencies), 4) if latencies else None,
+    }
+
+
+class OperationStats:
+    """Latencies and outcomes of one kind of request"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.errors = 0
+
+    def record(self, latency: float, status: str, ok: bool) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        if not ok:
+            self.errors += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "throughput_rps": round(count / elapsed, 3) if elapsed else None,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "statuses": dict(self.statuses),
+            "latency": latency_summary(self.latencies),
+            "histogram": histogram(self.latencies),
+        }
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from short sleeps"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - start - self.interval))
+
+    def summary(self) -> Dict[str, Any]:
+        return {"interval": self.interval, "samples": len(self.samples), **latency_summary(self.samples)}
+
+
+# 压测器：固定数量的并发“用户”按权重循环发送请求，直到时长或请求数用尽
+class LoadTest:
+    """Closed-loop load generator against one deployment"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        prefix: str,
+        dataset: Path,
+        questions: List[str],
+        mix: Dict[str, float],
+        concurrency: int,
+        duration: Optional[float],
+        total_requests: Optional[int],
+        wait_jobs: bool,
+        poll_interval: float,
+        job_timeout: float,
+        seed: int = 0
+    ):
+        self.client = client
+        self.prefix = prefix.rstrip("/")
+        self.dataset = dataset
+        self.questions = questions
+        self.operations = [name for name in OPERATIONS if mix.get(name, 0) > 0]
+        self.weights = [mix[name] for name in self.operations]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.total_requests = total_requests
+        self.wait_jobs = wait_jobs
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._rng = random.Random(seed)
+
+        self.stats = {name: OperationStats() for name in OPERATIONS + (ANALYZE_UPLOAD, "job_status", "health")}
+        self.job_latencies: List[float] = []
+        self.jobs = Counter()
+        self.request_ids: Set[str] = set()
+        self.completed_requests: List[str] = []
+        self._issued = 0
+        self._deadline = 0.0
+
+    async def _timed(self, operation: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, f"{self.prefix}{path}", **kwargs)
+        except httpx.HTTPError as e:
+            self.stats[operation].record(time.perf_counter() - start, type(e).__name__, ok=False)
+            return None
+        self.stats[operation].record(time.perf_counter() - start, str(response.status_code), ok=response.is_success)
+        return response
+
+    async def upload(self, operation: str = "upload") -> Optional[str]:
+        with open(self.dataset, "rb") as f:
+            response = await self._timed(
+                operation, "POST", "/upload-dataset",
+                files={"file": (self.dataset.name, f, "text/csv")}
+            )
+        if response is None or not response.is_success:
+            return None
+        request_id = response.json()["request_id"]
+        self.request_ids.add(request_id)
+        return request_id
+
+    async def _wait_for_job(self, job_id: str, request_id: str, submitted: float) -> None:
+        # 多进程部署时任务状态只存在于提交它的进程，轮询到其他进程会得到404，继续轮询
+        while time.perf_counter() - submitted < self.job_timeout:
+            await asyncio.sleep(self.poll_interval)
+            response = await self._timed("job_status", "GET", f"/jobs/{job_id}")
+            if response is None or response.status_code == 404:
+                if response is not None:
+                    self.jobs["lookup_misses"] += 1
+                continue
+            if not response.is_success:
+                continue
+            status = response.json()["status"]
+            if status in ("completed", "failed"):
+                self.jobs[status] += 1
+                self.job_latencies.append(time.perf_counter() - submitted)
+                if status == "completed":
+                    self.completed_requests.append(request_id)
+                return
+        self.jobs["timed_out"] += 1
+
+    async def analyze(self) -> None:
+        # 每个分析任务使用自己的上传目录，避免并发任务互相覆盖输出
+        request_id = await self.upload(ANALYZE_UPLOAD)
+        if request_id is None:
+            return
+        submitted = time.perf_counter()
+        response = await self._timed("analyze", "POST", "/analyze", json={
+            "questions": self.questions,
+            "reportTitle": "Load Test Report",
+            "request_id": request_id,
+        })
+        if response is None or not response.is_success:
+            return
+        self.jobs["submitted"] += 1
+        if self.wait_jobs:
+            await self._wait_for_job(response.json()["job_id"], request_id, submitted)
+
+    async def pdf(self) -> None:
+        request_id = self._rng.choice(self.completed_requests) if self.completed_requests else None
+        path = f"/get-pdf/{request_id}" if request_id else "/get-pdf"
+        response = await self._timed("pdf", "GET", path)
+        if response is not None:
+            await response.aclose()
+
+    def _next_operation(self) -> Optional[str]:
+        if self.total_requests is not None and self._issued >= self.total_requests:
+            return None
+        if self.duration is not None and time.perf_counter() >= self._deadline:
+            return None
+        self._issued += 1
+        return self._rng.choices(self.operations, self.weights)[0]
+
+    async def _user(self) -> None:
+        while (operation := self._next_operation()) is not None:
+            await getattr(self, operation)()
+
+    async def _health_probe(self, interval: float = 0.5) -> None:
+        while True:
+            await self._timed("health", "GET", "/health")
+            await asyncio.sleep(interval)
+
+    async def warm_up(self) -> None:
+        """Produce one finished report so /get-pdf has something to serve"""
+        wait_jobs, self.wait_jobs = self.wait_jobs, True
+        await self.analyze()
+        self.wait_jobs = wait_jobs
+        # 预热请求不计入结果
+        self.stats = {name: OperationStats() for name in self.stats}
+        self.job_latencies.clear()
+        self.jobs.clear()
+
+    async def run(self) -> Dict[str, Any]:
+        if "pdf" in self.operations:
+            await self.warm_up()
+        monitor = LoopLagMonitor()
+        background = [asyncio.create_task(monitor.run()), asyncio.create_task(self._health_probe())]
+        start = time.perf_counter()
+        self._deadline = start + (self.duration or 0)
+        await asyncio.gather(*(self._user() for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - start
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+        # 总请求数包含分析操作内部的上传，不含任务轮询和健康探测
+        issued = [self.stats[name] for name in OPERATIONS + (ANALYZE_UPLOAD,)]
+        total = sum(len(stats.latencies) for stats in issued)
+        errors = sum(stats.errors for stats in issued)
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "concurrency": self.concurrency,
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 3) if elapsed else None,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "operations": {name: self.stats[name].summary(elapsed) for name in self.stats},
+            "jobs": {
+                **dict(self.jobs),
+                "completed_per_minute": round(60 * self.jobs["completed"] / elapsed, 3) if elapsed else None,
+                "latency": latency_summary(self.job_latencies),
+                "histogram": histogram(self.job_latencies),
+            },
+            "event_loop_lag": monitor.summary(),
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(workers: int, env: Dict[str, str], prefix: str, startup_timeout: float = 60.0) -> Tuple[subprocess.Popen, str]:
+    """Run ``main:app`` under uvicorn with ``workers`` processes and wait until it is healthy"""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **env},
+    )
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{url}{prefix}/health", timeout=1.0).is_success:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("uvicorn did not become healthy in time")
+
+
+async def _run_load_test(args: argparse.Namespace, dataset: Path, questions: List[str]) -> Tuple[Dict[str, Any], Set[str]]:
+    headers = {"X-API-Key": args.api_key} if args.api_key else {}
+    timeout = httpx.Timeout(args.request_timeout)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, headers=headers, timeout=timeout,
+                                   limits=httpx.Limits(max_connections=args.concurrency * 2))
+    else:
+        from main import create_application
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_application()),
+                                   base_url="http://loadtest", headers=headers, timeout=timeout)
+    async with client:
+        test = LoadTest(
+            client,
+            prefix=args.prefix,
+            dataset=dataset,
+            questions=questions,
+            mix=args.mix,
+            concurrency=args.concurrency,
+            duration=None if args.requests else args.duration,
+            total_requests=args.requests,
+            wait_jobs=not args.no_wait_jobs,
+            poll_interval=args.poll_interval,
+            job_timeout=args.job_timeout,
+            seed=args.seed,
+        )
+        result = await test.run()
+        if args.url is None:
+            result["server_metrics"] = (await client.get(f"{args.prefix}/metrics")).json()
+        return result, test.request_ids
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Load test the analysis API with a fake LLM")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Base URL of a running deployment")
+    target.add_argument("--uvicorn-workers", type=int, help="Start uvicorn with this many worker processes")
+    parser.add_argument("--prefix", default="/api/v1", help="API route prefix")
+    parser.add_argument("--api-key", default=None, help="X-API-Key header for non-development deployments")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=1,analyze=1,pdf=4"),
+                        help="Operation weights, e.g. upload=1,analyze=2,pdf=5")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simultaneous virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many operations instead")
+    parser.add_argument("--questions", type=int, default=3, help="Questions per analysis job")
+    parser.add_argument("--rows", type=lambda v: int(float(v)), default=10_000, help="Rows in the uploaded dataset")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="diabetes")
+    parser.add_argument("--no-wait-jobs", action="store_true", help="Do not poll analysis jobs to completion")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--job-timeout", type=float, default=600.0)
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--llm-latency", default="lognormal:0.8,0.4",
+                        help="Fake LLM latency distribution, e.g. none, fixed:0.5, lognormal:0.8,0.4")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of fake LLM calls failing with 429/503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--with-caches", action="store_true", help="Keep the code, description and report caches enabled")
+    parser.add_argument("--keep", action="store_true", help="Keep request directories created in-process")
+    parser.add_argument("--verbose", action="store_true", help="Show application logs")
+    args = parser.parse_args(argv)
+
+    # 本进程和uvicorn子进程都使用本地假大模型服务；额度限制放开，只测服务自身的容量
+    llm_env = {
+        "LLM_BACKEND": "fake_server",
+        "LLM_SYNTHETIC_LATENCY": args.llm_latency,
+        "LLM_FAKE_ERROR_RATE": str(args.llm_error_rate),
+        "LLM_REQUESTS_PER_MINUTE": "1000000",
+        "LLM_TOKENS_PER_MINUTE": "1000000000",
+    }
+    if not args.with_caches:
+        # 每个任务的数据集和问题都相同，开启缓存时除第一个任务外都不会调用大模型
+        llm_env.update(CODE_CACHE_ENABLED="false", DESCRIPTION_CACHE_ENABLED="false", REPORT_CACHE_ENABLED="false")
+    for key, value in llm_env.items():
+        os.environ.setdefault(key, value)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    dataset = BACKEND_DIR / "cache" / "benchmark_data" / f"{args.preset}_{args.rows}_seed{args.seed}.csv"
+    if not dataset.exists():
+        # 上传接口只接受CSV，不需要Parquet副本
+        generate_dataset(DatasetSpec(PRESETS[args.preset](), seed=args.seed), dataset, rows=args.rows, parquet=False)
+    questions = build_questions(load_example_questions(), args.questions)
+
+    server = None
+    fake_server = None
+    if args.uvicorn_workers:
+        # 所有worker共享一个假大模型服务，模拟共享的服务商额度
+        from services.llm.fake_server import start_fake_server
+        from services.llm.synthetic import LatencyDistribution
+        fake_server = start_fake_server(LatencyDistribution.parse(args.llm_latency), error_rate=args.llm_error_rate, seed=args.seed)
+        server, args.url = start_uvicorn(args.uvicorn_workers, {**llm_env, "LLM_FAKE_SERVER_URL": fake_server.url}, args.prefix)
+        target = {"mode": "uvicorn", "workers": args.uvicorn_workers, "url": args.url}
+    elif args.url:
+        target = {"mode": "url", "url": args.url}
+    else:
+        target = {"mode": "in_process"}
+
+    request_ids: Set[str] = set()
+    try:
+        result, request_ids = asyncio.run(_run_load_test(args, dataset, questions))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if fake_server is not None:
+            fake_stats = fake_server.stats()
+            fake_server.shutdown()
+        if target["mode"] == "in_process":
+            from core.job_manager import job_manager
+            from services.analysis.worker_pool import shutdown_worker_pool
+            job_manager.shutdown(wait=True)
+            shutdown_worker_pool()
+
+    if target["mode"] != "url" and not args.keep:
+        from core.config.paths import path_config
+        for request_id in request_ids:
+            shutil.rmtree(path_config.RESPONSE_DIR / request_id, ignore_errors=True)
+
+    report = {
+        "benchmark": "load_test",
+        "version": LOAD_TEST_VERSION,
+        "started_at": datetime.now().isoformat(),
+        "target": target,
+        "config": {
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "questions": args.questions,
+            "rows": args.rows,
+            "llm_latency": args.llm_latency,
+            "llm_error_rate": args.llm_error_rate,
+            "caches_enabled": args.with_caches,
+        },
+        **result,
+    }
+    if fake_server is not None:
+        report["fake_llm"] = fake_stats
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
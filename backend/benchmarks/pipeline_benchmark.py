@@ -0,0 +1,391 @@
+# benchmarks/pipeline_benchmark.py
+"""End-to-end pipeline benchmark.
+
+Uploads a dataset and runs ``run_analysis_pipeline`` on it for every
+combination of dataset size, question count and pipeline mode, using the
+offline LLM backend, and writes p50/p95 timings, peak RSS and output sizes as JSON.
+
+Stage timings come from the pipeline's progress callbacks and stage ledger,
+so they measure what production runs: ``generate``, ``execute`` and
+``describe`` are the seconds from the start of the pipeline until every
+question finished that stage. In streaming
+mode the stages overlap, so the gaps between them shrink compared to staged
+mode. ``pdf`` is the report step and ``total`` the upload plus the whole pipeline.
+
+Run from the backend directory:
+
+    python -m benchmarks.pipeline_benchmark --rows 1e3 1e5 --questions 1 10 --modes streaming staged --repeats 3 --output bench.json
+
+Recorded responses are replayed from LLM_CASSETTE_DIR when present; prompts
+without a recording get synthesized responses, so any dataset size works.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from benchmarks.synthetic_dataset import PRESETS, DatasetSpec, generate_dataset
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+REPO_DIR = BACKEND_DIR.parent
+EXAMPLE_CODE = REPO_DIR / "example_output" / "request_20250202_195442_394cc86a" / "code" / "generated_analysis_code.py"
+QUESTIONS_FILE = REPO_DIR / "questions.txt"
+
+BENCHMARK_VERSION = 2
+STAGES = ("upload", "generate", "execute", "describe", "pdf")
+# 峰值内存按上传和整个流水线两段采样（流式模式下各阶段相互重叠）
+PHASES = ("upload", "pipeline")
+MODES = ("streaming", "staged")
+
+def _parse_count(value: str) -> int:
+    """Accept counts such as ``1000``, ``1e5`` or ``10_000``"""
+    return int(float(value.replace("_", "")))
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, matching the gateway metrics"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+def load_example_questions() -> List[str]:
+    """Questions of the diabetes example report, plus those in questions.txt"""
+    questions: List[str] = []
+    if EXAMPLE_CODE.exists():
+        questions += re.findall(r"^# Question \d+: (.+)$", EXAMPLE_CODE.read_text(), re.MULTILINE)
+    if QUESTIONS_FILE.exists():
+        questions += re.findall(r"^(?:Question )?\d+[:.]\s*(.+?)\s*$", QUESTIONS_FILE.read_text(), re.MULTILINE)
+    return list(dict.fromkeys(q for q in questions if q))
+
+
+def build_questions(base: List[str], count: int) -> List[str]:
+    """``count`` distinct questions, cycling through the example ones"""
+    questions = []
+    for i in range(count):
+        question = base[i % len(base)]
+        rounds = i // len(base)
+        questions.append(question if rounds == 0 else f"{question} (variant {rounds + 1})")
+    return questions
+
+
+# ---- 资源采样 ----
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _child_pids(parent: int) -> List[int]:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # 第4个字段是父进程ID（进程名中可能含空格，从最后一个括号后开始解析）
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == parent:
+                pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+def process_tree_rss() -> int:
+    """Resident memory of this process and its workers, in bytes"""
+    own = os.getpid()
+    return _rss_bytes(own) + sum(_rss_bytes(pid) for pid in _child_pids(own))
+
+
+class PeakRSSSampler:
+    """Samples the RSS of the process tree on a background thread while a stage runs"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, process_tree_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRSSSampler":
+        if sys.platform.startswith("linux"):
+            self.peak = process_tree_rss()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak = max(self.peak, process_tree_rss())
+
+
+def _dir_bytes(directory: Path) -> int:
+    if not directory.exists():
+        return 0
+    return sum(path.stat().st_size for path in directory.rglob("*") if path.is_file())
+
+
+# ---- 各阶段 ----
+
+async def _multipart_body(path: Path, boundary: str, chunk_size: int) -> AsyncIterator[bytes]:
+    yield (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{path.name}\"\r\n"
+        f"Content-Type: text/csv\r\n\r\n"
+    ).encode()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def run_upload(dataset: Path) -> Any:
+    """Stream the dataset through the upload parser, then profile it, as /upload-dataset does"""
+    from starlette.requests import Request
+
+    from core.config.settings import get_settings
+    from core.request_handler import request_manager
+    from services.data.dataset_profiler import profile_dataset, save_profile
+    from services.data.dataset_upload import DatasetUploadStream, write_upload_info
+
+    settings = get_settings()
+    context = request_manager.create_request_context()
+    boundary = "benchmarkboundary"
+    size = dataset.stat().st_size
+
+    async def upload():
+        body = _multipart_body(dataset, boundary, settings.UPLOAD_CHUNK_SIZE)
+
+        async def receive():
+            try:
+                return {"type": "http.request", "body": await body.__anext__(), "more_body": True}
+            except StopAsyncIteration:
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+        request = Request({
+            "type": "http",
+            "method": "POST",
+            "path": "/upload-dataset",
+            "headers": [(b"content-type", f"multipart/form-data; boundary={boundary}".encode())],
+        }, receive)
+        # 大数据集超出上传大小限制时放宽限制，只测量吞吐
+        stream = DatasetUploadStream(
+            destination_dir=context.data_dir,
+            max_size=max(settings.MAX_FILE_SIZE, size),
+            allowed_extensions=settings.ALLOWED_EXTENSIONS,
+            chunk_size=settings.UPLOAD_CHUNK_SIZE
+        )
+        return await stream.receive(request)
+
+    result = asyncio.run(upload())
+    write_upload_info(context.upload_info_path, result)
+    context = context.with_data_path(result.path)
+    save_profile(context, profile_dataset(context.data_path, settings.PROFILE_SAMPLE_ROWS, result.rows))
+    return context
+
+
+def _stage_finish_times(context: Any, started_at: datetime) -> Dict[str, float]:
+    """Seconds from the pipeline start until every question finished execution and description"""
+    from services.pipeline.stage_ledger import StageLedger
+
+    ledger = StageLedger.load(context)
+    finished: Dict[str, float] = {}
+    # 代码生成记录在执行后会被重写（修复后的代码），其完成时间改由进度回调得到
+    for stage in ("execute", "describe"):
+        times = [
+            datetime.fromisoformat(records[stage]["completed_at"])
+            for records in ledger.state["units"].values()
+            if stage in records
+        ]
+        if times:
+            finished[stage] = (max(times) - started_at).total_seconds()
+    return finished
+
+
+def run_pipeline_once(dataset: Path, questions: List[str], mode: str) -> Dict[str, Any]:
+    """Upload and one timed run of the analysis pipeline; returns stage timings, peak RSS and output sizes"""
+    from core.config.constants import JobStage, PipelineMode
+    from services.pipeline.analysis_pipeline import run_analysis_pipeline
+
+    timings: Dict[str, float] = {}
+    peaks: Dict[str, int] = {}
+    # 每个阶段最后一次进度事件的时间；两种模式都在代码生成完成后报告EXECUTING_CODE
+    last_event: Dict[JobStage, float] = {}
+
+    def progress(stage: JobStage, value: float, message: str) -> None:
+        last_event[stage] = time.perf_counter()
+
+    with PeakRSSSampler() as sampler:
+        start = time.perf_counter()
+        context = run_upload(dataset)
+        timings["upload"] = time.perf_counter() - start
+    peaks["upload"] = sampler.peak
+
+    with PeakRSSSampler() as sampler:
+        started_at = datetime.now()
+        start = time.perf_counter()
+        result = run_analysis_pipeline(
+            questions, "Benchmark Report", context, progress=progress, mode=PipelineMode(mode)
+        )
+        end = time.perf_counter()
+    peaks["pipeline"] = sampler.peak
+
+    if JobStage.EXECUTING_CODE in last_event:
+        timings["generate"] = last_event[JobStage.EXECUTING_CODE] - start
+    timings.update(_stage_finish_times(context, started_at))
+    timings["pdf"] = end - last_event.get(JobStage.GENERATING_PDF, end)
+    timings["total"] = timings["upload"] + end - start
+
+    units = result["details"]["units"]
+    outputs = {
+        "dataset_bytes": dataset.stat().st_size,
+        "graphs_bytes": _dir_bytes(context.graphs_dir),
+        "renditions_bytes": _dir_bytes(context.renditions_dir),
+        "stats_bytes": _dir_bytes(context.stats_dir),
+        "descriptions_bytes": _dir_bytes(context.description_dir),
+        "pdf_bytes": (context.output_dir / result["details"]["pdf_path"]).stat().st_size,
+    }
+    return {
+        "timings": timings,
+        "peak_rss": peaks,
+        "outputs": outputs,
+        "failed_units": sum(1 for unit in units if unit["status"] != "success"),
+        "request_dir": context.request_dir,
+    }
+
+
+def benchmark_config(dataset: Path, rows: int, questions: List[str], mode: str, repeats: int, keep: bool) -> Dict[str, Any]:
+    runs = []
+    for _ in range(repeats):
+        run = run_pipeline_once(dataset, questions, mode)
+        if not keep:
+            shutil.rmtree(run["request_dir"], ignore_errors=True)
+        runs.append(run)
+
+    stages = {}
+    for stage in STAGES + ("total",):
+        # 全部问题都失败的阶段没有台账记录
+        samples = [run["timings"][stage] for run in runs if stage in run["timings"]]
+        if not samples:
+            continue
+        stages[stage] = {
+            "p50": percentile(samples, 0.5),
+            "p95": percentile(samples, 0.95),
+            "min": round(min(samples), 4),
+            "max": round(max(samples), 4),
+        }
+
+    return {
+        "rows": rows,
+        "questions": len(questions),
+        "mode": mode,
+        "repeats": repeats,
+        "stages": stages,
+        "peak_rss_mb": {
+            phase: round(max(run["peak_rss"][phase] for run in runs) / (1024 * 1024), 1)
+            for phase in PHASES
+        },
+        # 各次运行的输出体积基本一致，取最后一次
+        "outputs": runs[-1]["outputs"],
+        "failed_units": max(run["failed_units"] for run in runs),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline end to end with an offline LLM")
+    parser.add_argument("--rows", nargs="+", type=_parse_count, default=[1000, 100_000], help="Dataset sizes, e.g. 1e3 1e5 1e7")
+    parser.add_argument("--questions", nargs="+", type=int, default=[1, 5], help="Question counts, e.g. 1 10 50")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="Pipeline modes to compare")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per configuration")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--data-dir", type=Path, default=BACKEND_DIR / "cache" / "benchmark_data", help="Where generated datasets are kept")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="diabetes", help="Synthetic dataset shape")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--with-caches", action="store_true", help="Keep the code, description and report caches enabled")
+    parser.add_argument("--keep", action="store_true", help="Keep the request directories of each run")
+    parser.add_argument("--verbose", action="store_true", help="Show application logs")
+    args = parser.parse_args(argv)
+
+    # 默认使用离线回放后端、放开额度限制并关闭缓存，以测量真实工作量（须在读取配置前设置）
+    os.environ.setdefault("LLM_BACKEND", "replay")
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+    os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+    if not args.with_caches:
+        os.environ.setdefault("CODE_CACHE_ENABLED", "false")
+        os.environ.setdefault("DESCRIPTION_CACHE_ENABLED", "false")
+        os.environ.setdefault("REPORT_CACHE_ENABLED", "false")
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    from core.config.settings import get_settings
+    from core.metrics import metrics_registry
+    from services.analysis.worker_pool import shutdown_worker_pool
+
+    settings = get_settings()
+    base_questions = load_example_questions()
+    report = {
+        "benchmark": "pipeline",
+        "version": BENCHMARK_VERSION,
+        "started_at": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "executor_pool_size": settings.EXECUTOR_POOL_SIZE,
+            "llm_backend": settings.LLM_BACKEND,
+            "llm_latency": settings.LLM_SYNTHETIC_LATENCY,
+            "caches_enabled": args.with_caches,
+            "dataset_preset": args.preset,
+        },
+        "runs": [],
+    }
+    try:
+        for rows in args.rows:
+            dataset = args.data_dir / f"{args.preset}_{rows}_seed{args.seed}.csv"
+            if not dataset.exists():
+                print(f"Generating {rows} row dataset at {dataset}", file=sys.stderr)
+                # 上传接口只接受CSV，不需要Parquet副本
+                generate_dataset(DatasetSpec(PRESETS[args.preset](), seed=args.seed), dataset, rows=rows, parquet=False)
+            for count in args.questions:
+                for mode in args.modes:
+                    print(f"Benchmarking {rows} rows x {count} question(s), {mode}, {args.repeats} run(s)", file=sys.stderr)
+                    report["runs"].append(benchmark_config(
+                        dataset, rows, build_questions(base_questions, count), mode, args.repeats, args.keep
+                    ))
+        report["metrics"] = {
+            name: value for name, value in metrics_registry.snapshot().items() if name.startswith("llm")
+        }
+    finally:
+        shutdown_worker_pool()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# benchmarks/synthetic_dataset.py
+"""Seeded synthetic dataset generator for scaling tests.
+
+Streams rows to disk chunk by chunk, so files from kilobytes to tens of
+gigabytes can be written without holding them in memory. Columns mix
+numeric, integer, categorical, date and boolean data with controllable
+cardinality, null rate and outlier rate. A Parquet twin with the same rows
+is written alongside (pyarrow, listed in requirements.txt, is required);
+``--no-parquet`` writes the CSV only.
+
+Run from the backend directory:
+
+    python -m benchmarks.synthetic_dataset data.csv --rows 1e6
+    python -m benchmarks.synthetic_dataset big.csv --size 10GB --preset mixed --seed 7 --no-parquet
+
+The same seed, preset and chunk size always produce identical files.
+"""
+import argparse
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+COLUMN_KINDS = ("id", "numeric", "integer", "categorical", "date", "boolean")
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+DEFAULT_CHUNK_ROWS = 200_000
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    """How one column's values are drawn"""
+    name: str
+    kind: str
+    null_rate: float = 0.0
+    outlier_rate: float = 0.0
+    # numeric/integer: 均值和标准差（integer按此生成后取整）
+    mean: float = 0.0
+    std: float = 1.0
+    low: Optional[float] = None
+    high: Optional[float] = None
+    decimals: int = 4
+    # categorical: 类别数和Zipf偏斜度（0为均匀分布）
+    cardinality: int = 10
+    skew: float = 1.0
+    # date: 起始日期和跨度天数
+    start: str = "2020-01-01"
+    span_days: int = 1825
+    # boolean: 为True的概率；as_int时写为0/1
+    true_rate: float = 0.5
+    as_int: bool = False
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    """Columns, size and seed of a synthetic dataset"""
+    columns: List[ColumnSpec]
+    seed: int = 0
+    chunk_rows: int = DEFAULT_CHUNK_ROWS
+
+
+@dataclass
+class GeneratedDataset:
+    """Files written by ``generate_dataset``"""
+    csv_path: Path
+    parquet_path: Optional[Path]
+    rows: int
+    csv_bytes: int
+    seconds: float
+    columns: Dict[str, str] = field(default_factory=dict)
+
+
+def parse_size(value: str) -> int:
+    """Byte count from strings such as ``500KB``, ``1.5GB`` or ``1048576``"""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?B?)\s*", value.upper())
+    if not match:
+        raise ValueError(f"Invalid size '{value}'")
+    number, unit = match.groups()
+    if unit and not unit.endswith("B"):
+        unit += "B"
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def mixed_columns(
+    numeric: int = 4,
+    integer: int = 2,
+    categorical: int = 3,
+    dates: int = 1,
+    booleans: int = 2,
+    cardinality: int = 20,
+    null_rate: float = 0.02,
+    outlier_rate: float = 0.01
+) -> List[ColumnSpec]:
+    """A general-purpose mix of column types, like the business datasets in questions.txt"""
+    columns = [ColumnSpec("row_id", "id")]
+    columns += [
+        ColumnSpec(f"metric_{i}", "numeric", null_rate, outlier_rate, mean=100.0 * (i + 1), std=15.0 * (i + 1))
+        for i in range(numeric)
+    ]
+    columns += [
+        ColumnSpec(f"count_{i}", "integer", null_rate, outlier_rate, mean=20.0, std=8.0, low=0)
+        for i in range(integer)
+    ]
+    columns += [
+        # 类别数逐列递增，覆盖低基数和高基数两种情况
+        ColumnSpec(f"category_{i}", "categorical", null_rate, cardinality=max(2, cardinality * (10 ** i)))
+        for i in range(categorical)
+    ]
+    columns += [ColumnSpec(f"date_{i}", "date", null_rate) for i in range(dates)]
+    columns += [ColumnSpec(f"flag_{i}", "boolean", null_rate, true_rate=0.3 + 0.4 * i / max(1, booleans)) for i in range(booleans)]
+    return columns
+
+
+def diabetes_columns() -> List[ColumnSpec]:
+    """Columns shaped like the Pima diabetes dataset of the example report"""
+    return [
+        ColumnSpec("Pregnancies", "integer", mean=3.8, std=3.4, low=0, high=17),
+        ColumnSpec("Glucose", "integer", mean=121, std=32, low=0, high=200),
+        ColumnSpec("BloodPressure", "integer", mean=69, std=19, low=0, high=122),
+        ColumnSpec("SkinThickness", "integer", mean=20, std=16, low=0, high=99),
+        ColumnSpec("Insulin", "integer", mean=80, std=115, low=0, high=846),
+        ColumnSpec("BMI", "numeric", mean=32, std=7.9, low=0, high=67, decimals=1),
+        ColumnSpec("DiabetesPedigreeFunction", "numeric", mean=0.47, std=0.33, low=0.078, high=2.42, decimals=3),
+        ColumnSpec("Age", "integer", mean=33, std=12, low=21, high=81),
+        ColumnSpec("Outcome", "boolean", true_rate=0.35, as_int=True),
+    ]
+
+
+PRESETS = {"mixed": mixed_columns, "diabetes": diabetes_columns}
+
+
+def _numeric_values(spec: ColumnSpec, rng: np.random.Generator, n: int) -> np.ndarray:
+    values = rng.normal(spec.mean, spec.std, n)
+    if spec.low is not None or spec.high is not None:
+        values = values.clip(spec.low, spec.high)
+    if spec.outlier_rate > 0:
+        # 离群值：偏离均值8到20个标准差，方向随机
+        mask = rng.random(n) < spec.outlier_rate
+        signs = rng.choice([-1.0, 1.0], mask.sum())
+        values[mask] = spec.mean + signs * spec.std * rng.uniform(8, 20, mask.sum())
+    return values
+
+
+def _category_probabilities(cardinality: int, skew: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, cardinality + 1) ** skew
+    return weights / weights.sum()
+
+
+def _generate_column(spec: ColumnSpec, rng: np.random.Generator, n: int, offset: int) -> pd.Series:
+    """One chunk of a column; ``offset`` is the index of the chunk's first row"""
+    if spec.kind == "id":
+        return pd.Series(np.arange(offset, offset + n, dtype=np.int64))
+    if spec.kind == "numeric":
+        series = pd.Series(_numeric_values(spec, rng, n).round(spec.decimals))
+    elif spec.kind == "integer":
+        series = pd.Series(_numeric_values(spec, rng, n).round().astype(np.int64), dtype="Int64")
+    elif spec.kind == "categorical":
+        codes = rng.choice(spec.cardinality, n, p=_category_probabilities(spec.cardinality, spec.skew))
+        categories = [f"{spec.name}_{i}" for i in range(spec.cardinality)]
+        series = pd.Series(pd.Categorical.from_codes(codes, categories=categories))
+    elif spec.kind == "date":
+        days = rng.integers(0, spec.span_days, n)
+        series = pd.Series(np.datetime64(spec.start, "D") + days.astype("timedelta64[D]"))
+    elif spec.kind == "boolean":
+        series = pd.Series(rng.random(n) < spec.true_rate, dtype="boolean")
+        if spec.as_int:
+            series = series.astype("Int64")
+    else:
+        raise ValueError(f"Unknown column kind '{spec.kind}', expected one of {', '.join(COLUMN_KINDS)}")
+
+    if spec.null_rate > 0:
+        series[rng.random(n) < spec.null_rate] = None
+    return series
+
+
+def generate_chunk(spec: DatasetSpec, chunk_index: int, rows: int) -> pd.DataFrame:
+    """Rows of one chunk; each chunk has its own seeded stream, so chunks are independent"""
+    rng = np.random.default_rng([spec.seed, chunk_index])
+    offset = chunk_index * spec.chunk_rows
+    return pd.DataFrame({column.name: _generate_column(column, rng, rows, offset) for column in spec.columns})
+
+
+def _require_pyarrow():
+    """The pyarrow module, or a clear error when the Parquet twin cannot be written"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(
+            "Writing a Parquet twin requires pyarrow; install it with `pip install -r requirements.txt` "
+            "or skip the twin (--no-parquet)"
+        )
+    return pyarrow
+
+
+def generate_dataset(
+    spec: DatasetSpec,
+    csv_path: Path,
+    rows: Optional[int] = None,
+    target_bytes: Optional[int] = None,
+    parquet: bool = True
+) -> GeneratedDataset:
+    """Stream a dataset to ``csv_path`` (and its Parquet twin) until ``rows`` rows or ``target_bytes`` bytes are written"""
+    if rows is None and target_bytes is None:
+        raise ValueError("Either rows or target_bytes is required")
+    csv_path = Path(csv_path)
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = csv_path.with_suffix(csv_path.suffix + ".tmp")
+    parquet_path = csv_path.with_suffix(".parquet") if parquet else None
+    parquet_writer = None
+    # 在写入任何文件之前检查依赖，避免写完CSV才发现无法生成Parquet
+    pa = _require_pyarrow() if parquet else None
+
+    start = time.perf_counter()
+    written, chunk_index = 0, 0
+    with open(tmp_path, "w", newline="") as f:
+        while True:
+            n = spec.chunk_rows if rows is None else min(spec.chunk_rows, rows - written)
+            if n <= 0:
+                break
+            frame = generate_chunk(spec, chunk_index, n)
+            frame.to_csv(f, header=chunk_index == 0, index=False, date_format="%Y-%m-%d")
+            if parquet_path is not None:
+                table = pa.Table.from_pandas(frame, schema=parquet_writer.schema if parquet_writer else None, preserve_index=False)
+                if parquet_writer is None:
+                    parquet_writer = pa.parquet.ParquetWriter(str(parquet_path), table.schema)
+                parquet_writer.write_table(table)
+            written += n
+            chunk_index += 1
+            if target_bytes is not None and f.tell() >= target_bytes:
+                break
+    if parquet_writer is not None:
+        parquet_writer.close()
+    tmp_path.replace(csv_path)
+
+    return GeneratedDataset(
+        csv_path=csv_path,
+        parquet_path=parquet_path,
+        rows=written,
+        csv_bytes=csv_path.stat().st_size,
+        seconds=time.perf_counter() - start,
+        columns={column.name: column.kind for column in spec.columns},
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> GeneratedDataset:
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic CSV and its Parquet twin in chunks")
+    parser.add_argument("output", type=Path, help="CSV path to write")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--rows", type=lambda v: int(float(v.replace("_", ""))), help="Row count, e.g. 1e6")
+    size.add_argument("--size", type=parse_size, help="Approximate CSV size, e.g. 500MB or 20GB")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="mixed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--cardinality", type=int, default=20, help="Base category count (mixed preset)")
+    parser.add_argument("--null-rate", type=float, default=0.02, help="Share of nulls per column (mixed preset)")
+    parser.add_argument("--outlier-rate", type=float, default=0.01, help="Share of outliers per numeric column (mixed preset)")
+    parser.add_argument("--no-parquet", dest="parquet", action="store_false", help="Write the CSV only, without the Parquet twin")
+    args = parser.parse_args(argv)
+
+    if args.preset == "mixed":
+        columns = mixed_columns(cardinality=args.cardinality, null_rate=args.null_rate, outlier_rate=args.outlier_rate)
+    else:
+        columns = PRESETS[args.preset]()
+    spec = DatasetSpec(columns=columns, seed=args.seed, chunk_rows=args.chunk_rows)
+    try:
+        result = generate_dataset(spec, args.output, rows=args.rows, target_bytes=args.size, parquet=args.parquet)
+    except RuntimeError as e:
+        parser.error(str(e))
+    print(
+        f"Wrote {result.rows} rows ({result.csv_bytes / (1024 * 1024):.1f}MB) to {result.csv_path} "
+        f"in {result.seconds:.1f}s" + (f", Parquet twin at {result.parquet_path}" if result.parquet_path else ""),
+        file=sys.stderr
+    )
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# core/cache.py
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from core.logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def hash_key(*parts: Any) -> str:
+    """Build a stable content-addressed key from JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# 基于SQLite的持久化LRU缓存：按最近访问时间淘汰，可选TTL，统计命中率
+class SQLiteLRUCache:
+    """Persistent key/value cache with LRU eviction, optional TTL and hit/miss counters"""
+
+    def __init__(
+        self,
+        db_path: Path,
+        max_entries: int = 1000,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value and refresh its recency, or None on a miss"""
+        value = self.get_bytes(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """Binary variant of get"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None \
+                    and now - row[1] > self.ttl_seconds:
+                # 过期条目视为未命中并删除
+                with self._conn:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+        value = row[0]
+        return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+    def set(self, key: str, value: str) -> None:
+        """Store a value and evict least recently used entries beyond the limits"""
+        self.set_bytes(key, value.encode("utf-8"))
+
+    def set_bytes(self, key: str, data: bytes) -> None:
+        """Binary variant of set"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now)
+            )
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+
+    def _evict(self) -> None:
+        """Drop the oldest entries until both limits hold (caller holds the lock)"""
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        overflow = max(count - self.max_entries, 0)
+        if overflow:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.evictions += overflow
+        if self.max_bytes is not None:
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+            while total > self.max_bytes:
+                row = self._conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed_at ASC LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    break
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+                total -= row[1]
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters and occupancy for the metrics endpoint"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": count,
+            "bytes": total,
+        }
@@ -15,6 +15,45 @@ class LogLevel(str, Enum):
     ERROR = "ERROR"
     CRITICAL = "CRITICAL"
 
+class JobStatus(str, Enum):
+    """Lifecycle states of a background analysis job"""
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class JobStage(str, Enum):
+    """Pipeline stages reported while an analysis job runs"""
+    QUEUED = "queued"
+    GENERATING_CODE = "generating_code"
+    EXECUTING_CODE = "executing_code"
+    GENERATING_DESCRIPTIONS = "generating_descriptions"
+    GENERATING_PDF = "generating_pdf"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class PipelineMode(str, Enum):
+    """How analysis questions move through the pipeline stages"""
+    STREAMING = "streaming"  # Each question runs generate -> execute -> describe on its own
+    STAGED = "staged"        # Every question finishes a stage before the next stage starts
+
+class ExecutionOutcome(str, Enum):
+    """Why a run of generated code ended"""
+    OK = "ok"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+    MEMORY_LIMIT = "memory_limit"
+    CPU_LIMIT = "cpu_limit"
+    OUTPUT_LIMIT = "output_limit"
+    CRASHED = "crashed"
+
+class LLMBackend(str, Enum):
+    """Where LLM responses come from"""
+    LIVE = "live"                # Gemini API
+    RECORD = "record"            # Gemini API, saving responses to cassettes
+    REPLAY = "replay"            # Cassettes only, no network
+    FAKE_SERVER = "fake_server"  # Local server emulating the Gemini REST API
+
 # Analysis Constants
 ANALYSIS_CONSTANTS = {
     "CORRELATION_THRESHOLDS": {
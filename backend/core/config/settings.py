@@ -28,6 +28,8 @@ class Settings(BaseSettings):
     # File Upload Settings
     MAX_FILE_SIZE: int = 50 * 1024 * 1024  # 50MB
     ALLOWED_EXTENSIONS: List[str] = [".csv"]
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024  # Bytes written to disk per chunk
+    PROFILE_SAMPLE_ROWS: int = 10000      # Rows read to profile an uploaded dataset
     
     # Model Settings
     MODEL_SETTINGS: Dict[str, Any] = {
@@ -35,6 +37,61 @@ class Settings(BaseSettings):
         "max_retries": 3,
         "timeout": 45
     }
+    PIPELINE_MODE: str = os.getenv("PIPELINE_MODE", "streaming")  # streaming (per-question dataflow) / staged (stage barriers)
+    CODEGEN_CONCURRENCY: int = 4  # Questions generated in parallel per report
+    DESCRIPTION_CONCURRENCY: int = 4  # Chart descriptions requested in parallel per report
+    DESCRIPTION_MAX_BATCH_SIZE: int = 4          # Graphs packed into one description request (1 disables batching)
+    DESCRIPTION_BATCH_TOKEN_BUDGET: int = 16000  # Estimated prompt tokens per batched request
+    DESCRIPTION_BATCH_WAIT_SECONDS: float = 1.0  # Streaming mode: how long ready graphs wait to share a request
+    STATS_PROMPT_TOKEN_BUDGET: int = 1500  # Stats tokens allowed per graph in a description prompt
+    STATS_SIGNIFICANT_DIGITS: int = 4      # Floats in prompt stats are rounded to this many digits
+    STATS_MAX_GROUP_ITEMS: int = 10        # Long group tables keep only their top entries
+    LLM_REQUESTS_PER_MINUTE: int = 15       # Provider quota shared by all LLM calls in this process
+    LLM_TOKENS_PER_MINUTE: int = 1_000_000  # Provider token quota (prompt tokens, estimated)
+    LLM_RETRY_BASE_DELAY: float = 1.0        # First retry backoff; doubles per attempt, with full jitter
+    LLM_RETRY_MAX_DELAY: float = 30.0
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5   # Consecutive failures that open the circuit breaker
+    LLM_BREAKER_RESET_SECONDS: float = 30.0  # Time the breaker stays open before a trial call
+    
+    # LLM Backend Settings (offline benchmarking and load testing)
+    LLM_BACKEND: str = os.getenv("LLM_BACKEND", "live")  # live / record / replay / fake_server
+    LLM_CASSETTE_DIR: str = os.getenv("LLM_CASSETTE_DIR", "")  # Recorded responses; defaults to cache/cassettes
+    LLM_REPLAY_ON_MISS: str = os.getenv("LLM_REPLAY_ON_MISS", "synthesize")  # error / synthesize
+    LLM_SYNTHETIC_LATENCY: str = os.getenv("LLM_SYNTHETIC_LATENCY", "recorded")  # recorded, none, fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA
+    LLM_FAKE_SERVER_URL: str = os.getenv("LLM_FAKE_SERVER_URL", "")  # Empty starts a fake server in-process
+    LLM_FAKE_ERROR_RATE: float = 0.0  # Share of fake server calls answered with 429/503
+    
+    # Code Execution Settings
+    EXECUTOR_POOL_SIZE: int = os.cpu_count() or 2  # Warm worker processes for generated code
+    EXECUTOR_MAX_JOBS_PER_WORKER: int = 20   # Recycle a worker after this many runs
+    EXECUTOR_MAX_WORKER_RSS_MB: int = 1024   # Recycle a worker whose memory grew past this
+    EXECUTOR_MAX_FIX_ATTEMPTS: int = 1       # Fix-and-rerun attempts per failed question
+    EXECUTOR_TIMEOUT_SECONDS: float = 120.0  # Wall-clock limit per run; the worker is killed after it
+    EXECUTOR_CPU_LIMIT_SECONDS: int = 90     # CPU time per run (RLIMIT_CPU)
+    EXECUTOR_MEMORY_LIMIT_MB: int = 2048     # Address space a run may add on top of the warm worker (RLIMIT_AS)
+    EXECUTOR_MAX_FILE_MB: int = 50           # Largest file a run may write (RLIMIT_FSIZE)
+    EXECUTOR_MAX_OUTPUT_CHARS: int = 64 * 1024  # Captured stdout/stderr characters kept per run
+    
+    # LLM Image Settings
+    LLM_IMAGE_MAX_PIXELS: int = 500    # Longest side of the image sent to the LLM
+    LLM_IMAGE_MAX_KB: int = 50         # Byte budget of that image
+    LLM_IMAGE_MIN_QUALITY: int = 30    # JPEG quality search range
+    LLM_IMAGE_MAX_QUALITY: int = 50    # Same cap as the original fixed quality
+    
+    # Cache Settings
+    CODE_CACHE_ENABLED: bool = True
+    CODE_CACHE_MAX_ENTRIES: int = 5000
+    RENDITION_CACHE_MAX_ENTRIES: int = 2000
+    DESCRIPTION_CACHE_ENABLED: bool = True
+    DESCRIPTION_CACHE_MAX_ENTRIES: int = 5000
+    DESCRIPTION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    REPORT_CACHE_ENABLED: bool = True           # Identical dataset + questions + title reuse the earlier report
+    REPORT_CACHE_MAX_ENTRIES: int = 1000
+    REPORT_CACHE_TTL_SECONDS: int = 24 * 3600   # 0 keeps reports until they are evicted
+    
+    # Background Job Settings
+    MAX_CONCURRENT_JOBS: int = 4  # Reports running in parallel in this process
+    MAX_STORED_JOBS: int = 100    # Finished jobs kept in memory for status polling
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,199 @@
+# core/job_manager.py
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from core.config.constants import JobStage, JobStatus
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 进度回调类型：(阶段, 进度0~1, 描述信息)
+ProgressCallback = Callable[[JobStage, float, str], None]
+
+
+@dataclass
+class Job:
+    """State of a single background analysis job"""
+    job_id: str
+    request_id: str
+    status: JobStatus = JobStatus.QUEUED
+    stage: JobStage = JobStage.QUEUED
+    progress: float = 0.0
+    message: str = "Job queued"
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (JobStatus.COMPLETED, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Snapshot of the job without the (potentially large) result payload"""
+        return {
+            "job_id": self.job_id,
+            "request_id": self.request_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# 后台任务管理器：在进程内线程池中运行耗时的分析流程，避免阻塞事件循环
+class JobManager:
+    """Runs analysis pipelines on an in-process worker pool and tracks their state"""
+    _instance: Optional['JobManager'] = None  # 单例实例
+
+    def __new__(cls):
+        # 单例实现，保证全局只有一个JobManager实例
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        """Create the worker pool and the job registry"""
+        settings = get_settings()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._max_stored_jobs = settings.MAX_STORED_JOBS
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.MAX_CONCURRENT_JOBS,
+            thread_name_prefix="analysis-job"
+        )
+        logger.info(f"Job manager started with {settings.MAX_CONCURRENT_JOBS} worker(s)")
+
+    def submit(
+        self,
+        request_id: str,
+        func: Callable[..., Dict[str, Any]],
+        *args: Any,
+        **kwargs: Any
+    ) -> Job:
+        """Queue ``func`` for background execution and return its job record.
+
+        ``func`` is called with a ``progress`` keyword argument that it can use
+        to report stage changes, and its return value becomes the job result.
+        """
+        job = Job(job_id=uuid.uuid4().hex, request_id=request_id)
+        with self._lock:
+            self._prune_finished_jobs()
+            self._jobs[job.job_id] = job
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+        logger.info(f"Queued job {job.job_id} for request {request_id}")
+        return job
+
+    def add_completed(self, request_id: str, result: Dict[str, Any], message: str) -> Job:
+        """Record a job that finished without running, e.g. a report served from cache"""
+        now = datetime.now()
+        job = Job(
+            job_id=uuid.uuid4().hex,
+            request_id=request_id,
+            status=JobStatus.COMPLETED,
+            stage=JobStage.COMPLETED,
+            progress=1.0,
+            message=message,
+            result=result,
+            started_at=now,
+            finished_at=now
+        )
+        with self._lock:
+            self._prune_finished_jobs()
+            self._jobs[job.job_id] = job
+        logger.info(f"Recorded completed job {job.job_id} for request {request_id}")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_job(self, request_id: str) -> Optional[Job]:
+        """Queued or running job of a request, if any"""
+        with self._lock:
+            return next((job for job in self._jobs.values()
+                         if job.request_id == request_id and not job.is_finished), None)
+
+    def list_jobs(self) -> List[Job]:
+        """Return all tracked jobs, newest first"""
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def get_counts(self) -> Dict[str, int]:
+        """Count tracked jobs per status"""
+        counts = {status.value: 0 for status in JobStatus}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status.value] += 1
+        return counts
+
+    def shutdown(self, wait: bool = False) -> None:
+        """Stop accepting new jobs"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _update(self, job: Job, stage: JobStage, progress: float, message: str) -> None:
+        """Progress callback handed to the running pipeline"""
+        with self._lock:
+            job.stage = stage
+            job.progress = min(max(progress, job.progress), 1.0)
+            job.message = message
+        logger.info(f"Job {job.job_id}: {stage.value} ({job.progress:.0%}) - {message}")
+
+    def _run(self, job: Job, func: Callable[..., Dict[str, Any]], args: tuple, kwargs: dict) -> None:
+        """Execute a job inside a worker thread"""
+        with self._lock:
+            job.status = JobStatus.RUNNING
+            job.started_at = datetime.now()
+
+        progress: ProgressCallback = lambda stage, value, message: self._update(job, stage, value, message)
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            with self._lock:
+                job.result = result
+                job.status = JobStatus.COMPLETED
+                job.stage = JobStage.COMPLETED
+                job.progress = 1.0
+                job.message = "Analysis completed successfully"
+            logger.info(f"Job {job.job_id} completed")
+        except Exception as e:
+            # 捕获所有异常，记录到任务状态中，供前端轮询获取
+            detail = getattr(e, "detail", None) or str(e)
+            with self._lock:
+                job.status = JobStatus.FAILED
+                job.stage = JobStage.FAILED
+                job.error = detail
+                job.message = "Analysis failed"
+            logger.error(f"Job {job.job_id} failed: {detail}")
+        finally:
+            with self._lock:
+                job.finished_at = datetime.now()
+
+    def _prune_finished_jobs(self) -> None:
+        """Drop the oldest finished jobs once the registry is full (caller holds the lock)"""
+        overflow = len(self._jobs) - self._max_stored_jobs + 1
+        if overflow <= 0:
+            return
+        finished = sorted(
+            (j for j in self._jobs.values() if j.is_finished),
+            key=lambda j: j.finished_at or j.created_at
+        )
+        for job in finished[:overflow]:
+            del self._jobs[job.job_id]
+
+
+# Create singleton instance
+# 创建全局唯一的任务管理器实例，供全局调用
+job_manager = JobManager()
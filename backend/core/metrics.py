@@ -0,0 +1,39 @@
+# core/metrics.py
+import threading
+from typing import Any, Callable, Dict
+
+from core.logging.logger import get_logger
+
+logger = get_logger(__name__)
+
+MetricsProvider = Callable[[], Dict[str, Any]]
+
+
+# 指标注册中心：各组件注册自己的统计函数，由/metrics接口统一输出
+class MetricsRegistry:
+    """Collects in-process metrics from registered providers"""
+
+    def __init__(self):
+        self._providers: Dict[str, MetricsProvider] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, provider: MetricsProvider) -> None:
+        """Register (or replace) the provider reported under ``name``"""
+        with self._lock:
+            self._providers[name] = provider
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Collect the current value of every provider"""
+        with self._lock:
+            providers = dict(self._providers)
+        snapshot = {}
+        for name, provider in providers.items():
+            try:
+                snapshot[name] = provider()
+            except Exception as e:
+                logger.error(f"Failed to collect metrics for {name}: {str(e)}")
+                snapshot[name] = {"error": str(e)}
+        return snapshot
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,95 @@
+# core/request_context.py
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Optional
+
+# 每个请求目录下的子目录
+REQUEST_SUBDIRS = ('graphs', 'renditions', 'stats', 'description', 'code', 'output', 'data')
+
+
+# 请求上下文：显式携带单次分析任务的目录和数据路径，替代全局PathConfig和环境变量
+@dataclass(frozen=True)
+class RequestContext:
+    """Paths belonging to a single analysis request, passed through every service"""
+    request_id: str
+    request_dir: Path
+    data_path: Optional[Path] = None
+
+    @property
+    def graphs_dir(self) -> Path:
+        return self.request_dir / "graphs"
+
+    @property
+    def renditions_dir(self) -> Path:
+        """Downscaled JPEG copies of the graphs, sized for LLM input"""
+        return self.request_dir / "renditions"
+
+    @property
+    def stats_dir(self) -> Path:
+        return self.request_dir / "stats"
+
+    @property
+    def code_dir(self) -> Path:
+        return self.request_dir / "code"
+
+    @property
+    def description_dir(self) -> Path:
+        return self.request_dir / "description"
+
+    @property
+    def output_dir(self) -> Path:
+        return self.request_dir / "output"
+
+    @property
+    def data_dir(self) -> Path:
+        return self.request_dir / "data"
+
+    @property
+    def upload_info_path(self) -> Path:
+        """Size, hash and row count recorded when the dataset was uploaded"""
+        return self.request_dir / "upload.json"
+
+    @property
+    def profile_path(self) -> Path:
+        """Sampled column/dtype profile used to build code generation prompts"""
+        return self.request_dir / "profile.json"
+
+    @property
+    def code_path(self) -> Path:
+        """Path of the combined generated analysis script"""
+        return self.code_dir / "generated_analysis_code.py"
+
+    @property
+    def manifest_path(self) -> Path:
+        """Outputs recorded while executing the generated code"""
+        return self.request_dir / "manifest.json"
+
+    @property
+    def units_path(self) -> Path:
+        """Index of the per-question code units"""
+        return self.code_dir / "units.json"
+
+    @property
+    def ledger_path(self) -> Path:
+        """Completed pipeline stages and the hashes of the files they produced"""
+        return self.request_dir / "ledger.json"
+
+    @classmethod
+    def from_request_dir(cls, request_dir: Path) -> 'RequestContext':
+        """Rebuild the context of an existing request directory"""
+        context = cls(request_id=request_dir.name, request_dir=request_dir)
+        data_files = sorted(p for p in context.data_dir.glob('*') if p.is_file()) \
+            if context.data_dir.exists() else []
+        if data_files:
+            context = context.with_data_path(data_files[0])
+        return context
+
+    def with_data_path(self, data_path: Path) -> 'RequestContext':
+        """Return a copy of the context pointing at the uploaded dataset"""
+        return replace(self, data_path=Path(data_path))
+
+    def create_directories(self) -> None:
+        """Create the request directory and all of its subdirectories"""
+        self.request_dir.mkdir(parents=True, exist_ok=True)
+        for subdir in REQUEST_SUBDIRS:
+            (self.request_dir / subdir).mkdir(exist_ok=True)
@@ -1,11 +1,13 @@
 # core/request_handler.py
 from pathlib import Path
+import shutil
 import uuid
 from datetime import datetime
 from typing import Optional
 
 from core.logging.logger import get_logger
 from core.config.paths import path_config
+from core.request_context import RequestContext
 from domain.exceptions.custom import FileOperationError
 
 logger = get_logger(__name__)
@@ -26,10 +28,14 @@ class RequestDirectoryManager:
         """Initialize with base response directory path"""
         # 设置基础响应目录（所有分析任务的根目录）
         self.base_response_dir = path_config.RESPONSE_DIR
-        self.current_request_dir: Optional[Path] = None  # 当前活跃的请求目录
+        self.current_request_dir: Optional[Path] = None  # 最近创建的请求目录
     
     def create_request_directory(self) -> Path:
         """Create a new unique request directory with subdirectories"""
+        return self.create_request_context().request_dir
+    
+    def create_request_context(self) -> RequestContext:
+        """Create a new unique request directory and return its context"""
         # 创建一个新的唯一请求目录，并自动创建所有子目录
         try:
             # 生成唯一目录名，包含时间戳和UUID片段，保证不重复
@@ -38,40 +44,59 @@ class RequestDirectoryManager:
             request_dir_name = f"request_{timestamp}_{unique_id}"
             
             # 创建主请求目录（如 .../response/request_20240601_123456_abcd1234）
-            request_dir = self.base_response_dir / request_dir_name
-            request_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 需要创建的所有子目录（如graphs、stats、description、code、output、data等）
-            subdirs = ['graphs', 'stats', 'description', 'code', 'output', 'data']  # Added 'data'
-            for subdir in subdirs:
-                subdir_path = request_dir / subdir
-                subdir_path.mkdir(exist_ok=True)
-                logger.info(f"Created subdirectory: {subdir_path}")
+            # 以及所有子目录（graphs、stats、description、code、output、data）
+            context = RequestContext(
+                request_id=request_dir_name,
+                request_dir=self.base_response_dir / request_dir_name
+            )
+            context.create_directories()
             
-            # 记录当前活跃的请求目录
-            self.current_request_dir = request_dir
-            logger.info(f"Created request directory: {request_dir}")
-            return request_dir
+            # 记录最近创建的请求目录，供未携带request_id的旧客户端回退使用
+            self.current_request_dir = context.request_dir
+            logger.info(f"Created request directory: {context.request_dir}")
+            return context
             
         except Exception as e:
             logger.error(f"Failed to create request directory: {str(e)}")
             # 目录创建失败时抛出自定义异常
             raise FileOperationError(str(e))
     
+    def get_request_context(self, request_id: Optional[str] = None) -> RequestContext:
+        """Load the context of an existing request, or the most recent one if no ID is given"""
+        # 根据请求ID加载已存在的请求上下文
+        if request_id is None:
+            request_dir = self.get_current_request_dir()
+        else:
+            # 只允许访问响应目录下的直接子目录，防止路径穿越
+            if Path(request_id).name != request_id:
+                raise FileOperationError(f"Invalid request ID: {request_id}")
+            request_dir = self.base_response_dir / request_id
+        
+        if not request_dir.is_dir():
+            raise FileOperationError(f"Request directory not found: {request_dir.name}")
+        return RequestContext.from_request_dir(request_dir)
+    
+    def discard_request(self, context: RequestContext, successor: Optional[RequestContext] = None) -> None:
+        """Delete a request directory that turned out to be unnecessary (e.g. its report was cached)"""
+        # 删除不再需要的请求目录；若它是最近的请求，旧客户端回退到successor
+        shutil.rmtree(context.request_dir, ignore_errors=True)
+        if self.current_request_dir == context.request_dir:
+            self.current_request_dir = successor.request_dir if successor else None
+        logger.info(f"Discarded request directory: {context.request_dir}")
+    
     def get_current_request_dir(self) -> Path:
-        """Get the path of current request directory"""
-        # 获取当前活跃的请求目录路径
+        """Get the path of the most recently created request directory"""
+        # 获取最近创建的请求目录路径
         if not self.current_request_dir:
             raise FileOperationError("No active request directory")
         return self.current_request_dir
     
-    def get_subdirectory(self, subdir_name: str) -> Path:
-        """Get path for a specific subdirectory in current request directory"""
-        # 获取当前请求目录下指定子目录的路径
-        if not self.current_request_dir:
-            raise FileOperationError("No active request directory")
+    def get_subdirectory(self, subdir_name: str, request_id: Optional[str] = None) -> Path:
+        """Get path for a specific subdirectory of a request directory"""
+        # 获取请求目录下指定子目录的路径
+        request_dir = self.get_request_context(request_id).request_dir
         
-        subdir_path = self.current_request_dir / subdir_name
+        subdir_path = request_dir / subdir_name
         if not subdir_path.exists():
             raise FileOperationError(f"Subdirectory '{subdir_name}' does not exist")
         
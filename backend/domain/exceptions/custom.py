@@ -25,6 +25,22 @@ class PDFGenerationError(BaseCustomException):
     def __init__(self, detail: str):
         super().__init__(detail=f"PDF generation failed: {detail}")
 
+class FileTooLargeError(BaseCustomException):
+    def __init__(self, detail: str):
+        super().__init__(detail=f"File too large: {detail}", status_code=413)
+
 class ValidationError(BaseCustomException):
     def __init__(self, detail: str):
-        super().__init__(detail=f"Validation error: {detail}", status_code=400)
\ No newline at end of file
+        super().__init__(detail=f"Validation error: {detail}", status_code=400)
+
+class JobNotFoundError(BaseCustomException):
+    def __init__(self, detail: str):
+        super().__init__(detail=f"Job not found: {detail}", status_code=404)
+
+class JobNotReadyError(BaseCustomException):
+    def __init__(self, detail: str):
+        super().__init__(detail=f"Job not finished: {detail}", status_code=409)
+
+class LLMServiceError(BaseCustomException):
+    def __init__(self, detail: str):
+        super().__init__(detail=f"LLM service unavailable: {detail}", status_code=503)
@@ -1,5 +1,11 @@
 # domain/models/__init__.py
-from .requests import AnalysisRequest, FileUploadResponse, AnalysisResponse
+from .requests import (
+    AnalysisRequest,
+    FileUploadResponse,
+    AnalysisResponse,
+    JobSubmitResponse,
+    JobStatusResponse
+)
 from .analysis import (
     StatisticalMeasure, 
     DataPoint, 
@@ -19,6 +25,8 @@ __all__ = [
     'AnalysisRequest',
     'FileUploadResponse',
     'AnalysisResponse',
+    'JobSubmitResponse',
+    'JobStatusResponse',
     'StatisticalMeasure',
     'DataPoint',
     'Calculation',
@@ -1,8 +1,10 @@
 # domain/models/requests.py
 from pydantic import BaseModel, Field, validator
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
+from core.config.constants import ExecutionOutcome, JobStage, JobStatus
+
 class AnalysisRequest(BaseModel):
     """Request model for data analysis"""
     questions: List[str] = Field(
@@ -14,6 +16,32 @@ class AnalysisRequest(BaseModel):
         default="Data Analysis Report",
         description="Title for the analysis report"
     )
+    request_id: Optional[str] = Field(
+        default=None,
+        description="Request ID returned by the upload endpoint; defaults to the most recent upload"
+    )
+    force_refresh: bool = Field(
+        default=False,
+        description="Run the full analysis even when an identical report is cached"
+    )
+
+    @validator('questions')
+    def validate_questions(cls, v):
+        if not all(q.strip() for q in v):
+            raise ValueError("Questions cannot be empty strings")
+        return v
+
+class FollowUpRequest(BaseModel):
+    """Request model for adding questions to an analysed dataset"""
+    questions: List[str] = Field(
+        ...,
+        description="Questions to add to the existing report",
+        min_items=1
+    )
+    reportTitle: Optional[str] = Field(
+        default=None,
+        description="New title for the rebuilt report; keeps the current title when omitted"
+    )
 
     @validator('questions')
     def validate_questions(cls, v):
@@ -24,12 +52,30 @@ class AnalysisRequest(BaseModel):
 class FileUploadResponse(BaseModel):
     """Response model for file upload"""
     status: str = Field(..., example="success")
+    request_id: str
     filename: str
     path: str
+    size_bytes: int
+    sha256: str = Field(..., description="SHA-256 of the uploaded file content")
+    rows: int = Field(..., description="Number of data rows, excluding the header")
+
+class UnitResult(BaseModel):
+    """Execution outcome of one question's code unit"""
+    index: int
+    question: Optional[str] = None
+    status: str = Field(..., example="success")
+    outcome: ExecutionOutcome = Field(
+        default=ExecutionOutcome.OK,
+        description="Why the last run ended: ok, error, or the resource limit that stopped it"
+    )
+    duration: float = Field(..., description="Wall-clock execution time in seconds, including fixes")
+    attempts: int
+    error: Optional[str] = None
 
 class AnalysisDetails(BaseModel):
     """Details of analysis results"""
     visualizations: List[str]
+    units: List[UnitResult] = Field(default_factory=list)
     descriptions: int
     pdf_path: str
 
@@ -42,4 +88,27 @@ class AnalysisResponse(BaseModel):
         description="Unique identifier for the analysis request"
     )
     details: AnalysisDetails
-    timestamp: datetime = Field(default_factory=datetime.now)
\ No newline at end of file
+    timestamp: datetime = Field(default_factory=datetime.now)
+
+class JobSubmitResponse(BaseModel):
+    """Response model returned when an analysis job is queued"""
+    status: JobStatus = Field(..., example="queued")
+    job_id: str = Field(
+        ...,
+        description="Identifier used to poll the job status and result"
+    )
+    request_id: str
+    message: str
+
+class JobStatusResponse(BaseModel):
+    """Response model describing the progress of an analysis job"""
+    job_id: str
+    request_id: str
+    status: JobStatus
+    stage: JobStage
+    progress: float = Field(..., ge=0, le=1, description="Completion ratio between 0 and 1")
+    message: str
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
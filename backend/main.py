@@ -5,6 +5,8 @@ from core.config.constants import Environment
 from core.logging.logger import get_logger, log_execution
 from api import analysis_router
 from api.middleware import setup_middleware
+from core.job_manager import job_manager
+from services.analysis.worker_pool import get_worker_pool, shutdown_worker_pool
 
 # Initialize settings and logging
 settings = get_settings()
@@ -50,6 +52,16 @@ async def startup_event():
     logger.info("Registered routes:")
     for route in routes:
         logger.info(f"  {route}")
+    
+    # Start the warm code execution workers so the first report skips interpreter startup
+    get_worker_pool()
+
+@app.on_event("shutdown")
+@log_execution
+async def shutdown_event():
+    """Stop accepting background analysis jobs and stop code workers"""
+    job_manager.shutdown(wait=False)
+    shutdown_worker_pool()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,93 @@
+# services/analysis/code_cache.py
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from core.cache import SQLiteLRUCache, hash_key
+from core.config.paths import path_config
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+from core.request_context import RequestContext
+
+logger = get_logger(__name__)
+
+# 缓存键的组成版本，修改键的计算方式时递增，使旧条目失效
+CODE_CACHE_KEY_VERSION = 2
+
+# 请求相关路径在缓存中以占位符保存，命中时替换为当前请求的路径
+PATH_PLACEHOLDERS = ("{{STATS_DIR}}", "{{GRAPHS_DIR}}", "{{DATA_PATH}}", "{{RESPONSE_DIR}}")
+
+
+def request_paths(context: RequestContext) -> Dict[str, str]:
+    """Request-specific paths that are swapped for placeholders in cached code"""
+    return {
+        "{{STATS_DIR}}": str(context.stats_dir),
+        "{{GRAPHS_DIR}}": str(context.graphs_dir),
+        "{{DATA_PATH}}": str(context.data_path),
+        "{{RESPONSE_DIR}}": str(path_config.RESPONSE_DIR),
+    }
+
+
+def normalize_question(question: str) -> str:
+    """Normalize whitespace so trivially different spellings share a cache entry"""
+    # 不忽略大小写：生成的代码会把问题原文写入统计文件和报告
+    return re.sub(r"\s+", " ", question).strip()
+
+
+# 代码生成缓存：按模型、提示模板版本、数据schema和问题内容寻址
+class CodeCache:
+    """Content-addressed cache of LLM-generated analysis code"""
+
+    def __init__(self, store: SQLiteLRUCache, model_name: str):
+        self.store = store
+        self.model_name = model_name
+
+    def make_key(
+        self,
+        template_version: str,
+        columns: List[str],
+        d_types: Dict[str, str],
+        question: str
+    ) -> str:
+        """Hash of model, prompt template version, column names/dtypes and normalized question"""
+        schema = [(column, str(d_types.get(column, ""))) for column in columns]
+        return hash_key(
+            CODE_CACHE_KEY_VERSION, self.model_name, template_version, schema, normalize_question(question)
+        )
+
+    def get(self, key: str, paths: Dict[str, str]) -> Optional[str]:
+        """Return cached code with the current request's paths substituted in"""
+        code = self.store.get(key)
+        if code is None:
+            return None
+        for placeholder in PATH_PLACEHOLDERS:
+            code = code.replace(placeholder, paths[placeholder])
+        return code
+
+    def set(self, key: str, code: str, paths: Dict[str, str]) -> None:
+        """Store code with request-specific paths replaced by placeholders"""
+        # 先替换更长的路径，避免子路径（如RESPONSE_DIR）提前匹配
+        for placeholder, value in sorted(paths.items(), key=lambda item: len(item[1]), reverse=True):
+            if value:
+                code = code.replace(value, placeholder)
+        self.store.set(key, code)
+
+    def delete(self, key: str) -> None:
+        """Drop code that failed to run, so the next request asks the LLM again"""
+        self.store.delete(key)
+
+
+@lru_cache()
+def get_code_cache() -> Optional[CodeCache]:
+    """Process-wide code cache, or None when disabled in settings"""
+    settings = get_settings()
+    if not settings.CODE_CACHE_ENABLED:
+        return None
+    store = SQLiteLRUCache(
+        path_config.CACHE_DIR / "code_cache.sqlite3",
+        max_entries=settings.CODE_CACHE_MAX_ENTRIES
+    )
+    metrics_registry.register("code_cache", store.stats)
+    logger.info(f"Code cache enabled at {store.db_path}")
+    return CodeCache(store, settings.GEMINI_MODEL_NAME)
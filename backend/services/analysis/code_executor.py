@@ -1,23 +1,41 @@
 # services/analysis/code_executor.py
 import os
-import sys
-import subprocess
+import json
 import time
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Any, List
 
-from core.config.paths import path_config
+from core.config.constants import ExecutionOutcome
+from core.config.settings import get_settings
+from core.request_context import RequestContext
 from .code_preprocessor import process_generated_code 
 from core.logging.logger import get_logger, log_execution
 from domain.exceptions.custom import CodeExecutionError, FileOperationError
+from .code_cache import get_code_cache, request_paths
 from .code_fixer import CodeFixer
+from .code_generator import UNIT_PREFIX_PATTERN, unit_header, unit_output_prefix
+from .image_renditions import get_rendition_renderer
+from .output_manifest import pair_outputs, write_manifest
+from .worker_pool import ExecutionResult, get_worker_pool
 
 logger = get_logger(__name__)
 
 # 代码执行器：用于自动执行生成的分析代码，并处理输出、异常和修复
 class CodeExecutor:
-    def __init__(self):
+    def __init__(self, context: RequestContext):
+        # 本次请求的上下文（输出目录、代码路径）
+        self.context = context
         # 初始化代码修复器（用于自动修复执行失败的代码）
-        self.code_fixer = CodeFixer()
+        self.code_fixer = CodeFixer(context)
+        # 常驻工作进程池（进程级共享）
+        self.worker_pool = get_worker_pool()
+        # 单个代码单元失败后最多修复重试的次数
+        self.max_fix_attempts = get_settings().EXECUTOR_MAX_FIX_ATTEMPTS
+        # 图表缩略图生成器（按图片哈希缓存）
+        self.renderer = get_rendition_renderer()
+        # 代码缓存（只保存执行成功的代码）
+        self.code_cache = get_code_cache()
     
     @log_execution
     def cleanup_previous_files(self):
@@ -25,19 +43,28 @@ class CodeExecutor:
         # 清理上一次生成的所有输出文件，避免干扰本次执行
         try:
             # 清理图表目录下所有png图片
-            for file in os.listdir(path_config.GRAPHS_DIR):
+            for file in os.listdir(self.context.graphs_dir):
                 if file.endswith('.png'):
-                    (path_config.GRAPHS_DIR / file).unlink()
+                    (self.context.graphs_dir / file).unlink()
                     
             # 清理描述目录下所有json文件（新版约定）
-            for file in os.listdir(path_config.DESCRIPTION_DIR):
+            for file in os.listdir(self.context.description_dir):
                 if file.endswith('.json'):
-                    (path_config.DESCRIPTION_DIR / file).unlink()
+                    (self.context.description_dir / file).unlink()
                     
             # 清理统计目录下所有 _stats.json 文件
-            for file in os.listdir(path_config.STATS_DIR):
+            for file in os.listdir(self.context.stats_dir):
                 if file.endswith('_stats.json'):
-                    (path_config.STATS_DIR / file).unlink()
+                    (self.context.stats_dir / file).unlink()
+            
+            # 清理发送给大模型的缩略图
+            if self.context.renditions_dir.exists():
+                for file in os.listdir(self.context.renditions_dir):
+                    (self.context.renditions_dir / file).unlink()
+            
+            # 删除上一次执行的输出清单
+            if self.context.manifest_path.exists():
+                self.context.manifest_path.unlink()
                     
             logger.info("Successfully cleaned up previous files")
         except Exception as e:
@@ -45,103 +72,216 @@ class CodeExecutor:
             # 文件操作异常，抛出自定义异常
             raise FileOperationError(str(e))
     
-    def _verify_outputs(self) -> bool:
-        """Verify that output files were generated"""
-        # 检查输出目录下是否生成了图表和统计文件
-        graph_files = list(path_config.GRAPHS_DIR.glob('*.png'))
-        stats_files = list(path_config.STATS_DIR.glob('*_stats.json'))
+    def _run_code(self, code_path: Path) -> ExecutionResult:
+        """Run a generated script in the warm worker pool and log its output"""
+        with open(code_path, 'r') as f:
+            code = f.read()
+        result = self.worker_pool.run(code, filename=str(code_path))
+        
+        # 记录标准输出和错误输出
+        if result.stdout:
+            logger.info(f"Code output: {result.stdout}")
+        if result.stderr:
+            logger.error(f"Code errors: {result.stderr}")
+        logger.info(f"Executed {code_path.name} in {result.duration:.2f}s (worker {result.worker_pid})")
+        return result
+    
+    def _load_units(self) -> List[Dict[str, Any]]:
+        """Load the per-question code units, falling back to the combined script"""
+        if self.context.units_path.exists():
+            with open(self.context.units_path, 'r') as f:
+                return json.load(f)
+        
+        # 旧的请求目录只有完整脚本，把它当作单个代码单元执行
+        if not self.context.code_path.exists():
+            raise CodeExecutionError(f"Code file not found: {self.context.code_path}")
+        return [{
+            "index": 0,
+            "question": None,
+            "code_file": self.context.code_path.name,
+            "graph_file": None,
+            "stats_file": None
+        }]
+    
+    def _add_rendition(self, pair: Dict[str, Any]) -> Dict[str, Any]:
+        """Render the LLM-sized copy of a graph and record it in the output pair"""
+        graph_path = Path(pair["graph_path"])
+        try:
+            output_path = self.renderer.render_file(
+                graph_path,
+                self.context.renditions_dir / f"{graph_path.stem}.jpg"
+            )
+            return {**pair, "llm_image_path": str(output_path), "llm_image_bytes": output_path.stat().st_size}
+        except Exception as e:
+            # 缩略图失败不影响执行结果，解读阶段会回退到原图
+            logger.warning(f"Failed to render LLM image for {graph_path.name}: {str(e)}")
+            return pair
+    
+    def _update_code_cache(self, unit: Dict[str, Any], code_path: Path, succeeded: bool) -> None:
+        """Cache the code of a unit that ran successfully (as fixed), or evict it if it failed"""
+        cache_key = unit.get("cache_key")
+        if self.code_cache is None or cache_key is None:
+            return
+        try:
+            if not succeeded:
+                # 缓存命中的代码执行失败时也要删除，避免后续请求反复修复
+                self.code_cache.delete(cache_key)
+                return
+            with open(code_path, 'r') as f:
+                code = f.read()
+            if unit.get("graph_file"):
+                code = code.replace(unit_header(unit["index"], unit["question"], unit["graph_file"]), "", 1)
+            self.code_cache.set(cache_key, code, request_paths(self.context))
+        except Exception as e:
+            # 缓存写入失败不影响执行结果
+            logger.warning(f"Failed to update code cache for unit {unit['index']}: {str(e)}")
+    
+    def _claim_output(self, unit: Dict[str, Any], pair: Dict[str, Any]) -> Dict[str, Any]:
+        """Move outputs written without the question's prefix under it, so other questions cannot overwrite them"""
+        # 代码未使用base_name而是写死了文件名时，执行后补上问题序号前缀
+        prefix = unit_output_prefix(unit["index"])
+        claimed = dict(pair)
+        for key in ("graph_path", "stats_path"):
+            path = Path(pair[key])
+            if path.name.startswith(prefix):
+                continue
+            target = path.with_name(prefix + UNIT_PREFIX_PATTERN.sub('', path.name))
+            os.replace(path, target)
+            logger.warning(f"Unit {unit['index']} wrote {path.name}; renamed to {target.name}")
+            claimed[key] = str(target)
+        return claimed
+    
+    def _execute_unit(self, unit: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one question's code, fixing and retrying only this unit on failure"""
+        code_path = self.context.code_dir / unit["code_file"]
+        start = time.perf_counter()
+        attempts = 1
+        error = None
+        outcome = ExecutionOutcome.OK
+        output_truncated = False
+        outputs: List[Dict[str, Any]] = []
+        
+        try:
+            result = self._run_code(code_path)
+            # 执行失败时只修复和重跑这个问题的代码；资源超限的原因一并交给修复器
+            while not result.success and attempts <= self.max_fix_attempts:
+                logger.warning(
+                    f"Unit {unit['index']} failed ({result.outcome.value}). "
+                    f"Attempting to fix code (attempt {attempts})..."
+                )
+                self.code_fixer.fix_code(code_path=code_path, error_msg=result.stderr, outcome=result.outcome)
+                result = self._run_code(code_path)
+                attempts += 1
+            
+            outcome = result.outcome
+            output_truncated = result.output_truncated
+            # 按运行时钩子记录的写入顺序配对图表和统计文件
+            outputs = pair_outputs(result.outputs)
+            if not result.success:
+                error = result.stderr[-2000:] or "Code execution failed"
+                if outcome == ExecutionOutcome.OK:
+                    outcome = ExecutionOutcome.ERROR
+            elif not outputs:
+                error = "Code finished without saving a graph and its stats file"
+                outcome = ExecutionOutcome.ERROR
+            else:
+                # 在执行线程中生成大模型用的缩略图，与其他问题的执行并行
+                outputs = [self._add_rendition(self._claim_output(unit, pair)) for pair in outputs]
+            stdout = result.stdout
+        except Exception as e:
+            error = str(e)
+            outcome = ExecutionOutcome.ERROR
+            stdout = ""
         
-        if not graph_files or not stats_files:
-            # 如果没有生成任何图表或统计文件，记录详细目录内容，便于排查
-            logger.error(f"Graphs directory contents: {list(path_config.GRAPHS_DIR.iterdir())}")
-            logger.error(f"Stats directory contents: {list(path_config.STATS_DIR.iterdir())}")
-            return False
-        return True
+        status = "success" if error is None else "failed"
+        # 修复器改写过的代码以最终版本写入缓存
+        self._update_code_cache(unit, code_path, succeeded=error is None)
+        duration = time.perf_counter() - start
+        logger.info(
+            f"Unit {unit['index']} ({unit['code_file']}) {status} [{outcome.value}] "
+            f"in {duration:.2f}s after {attempts} attempt(s)"
+        )
+        # 每个代码单元返回自己的状态、结束原因、输出文件和耗时
+        return {
+            **unit,
+            "status": status,
+            "outcome": outcome.value,
+            "attempts": attempts,
+            "duration": round(duration, 3),
+            "output": stdout,
+            "output_truncated": output_truncated,
+            "outputs": outputs,
+            "error": error
+        }
+    
+    def _preprocess_unit(self, unit: Dict[str, Any]) -> None:
+        """Apply compatibility fixes (e.g. numpy types) to one unit's code file"""
+        try:
+            process_generated_code(str(self.context.code_dir / unit["code_file"]))
+        except Exception as e:
+            logger.error(f"Failed to preprocess code: {str(e)}")
+            raise CodeExecutionError(f"Code preprocessing failed: {str(e)}")
+    
+    def execute_unit(self, unit: Dict[str, Any]) -> Dict[str, Any]:
+        """Preprocess and run a single code unit as soon as its code is ready"""
+        # 流式流水线中每个问题的代码生成后立即执行，不等待其他问题
+        self._preprocess_unit(unit)
+        return self._execute_unit(unit)
+    
+    def finalize(self, unit_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Write the output manifest once every unit has run and summarize the execution"""
+        failed = [u for u in unit_results if u["status"] != "success"]
+        if len(failed) == len(unit_results):
+            errors = "; ".join(f"unit {u['index']} ({u['outcome']}): {u['error']}" for u in failed)
+            raise CodeExecutionError(f"All code units failed: {errors}")
+        for unit in failed:
+            logger.error(f"Question {unit['index']} failed and will be skipped: {unit['error']}")
+        
+        # 记录每个问题的图表、统计文件、大小和耗时，供后续解读和报告直接使用
+        unit_results = sorted(unit_results, key=lambda u: u["index"])
+        manifest = write_manifest(self.context, unit_results)
+        graph_files = [Path(entry["graph_path"]).name for entry in manifest["entries"]]
+        
+        # 返回结果字典
+        # status: 执行状态（success或失败）
+        # output: 代码执行的标准输出内容
+        # code_file: 执行的代码文件名
+        # generated_files: 生成的图表文件名列表（按问题顺序）
+        # manifest_path: 输出清单路径
+        # units: 每个代码单元的状态、输出文件和耗时
+        return {
+            "status": "success",
+            "output": "\n".join(u["output"] for u in unit_results if u["output"]),
+            "code_file": self.context.code_path.name,
+            "generated_files": graph_files,
+            "manifest_path": str(self.context.manifest_path),
+            "units": unit_results
+        }
     
     @log_execution
     def execute_code(self) -> Dict[str, Any]:
-        """Execute the generated code with error handling and retries"""
-        # 执行自动生成的分析代码，自动处理异常和修复
+        """Execute the generated code units in parallel, retrying failed units individually"""
+        # 并行执行每个问题的代码单元，失败时只修复和重跑对应单元
         try:
-            # 生成代码的路径（如 backend/services/analysis/generated_analysis_code.py）
-            code_path = path_config.CODE_DIR / "generated_analysis_code.py"
-            
-            # 检查代码文件是否存在
-            if not code_path.exists():
-                raise CodeExecutionError(f"Code file not found: {code_path}")
+            units = self._load_units()
             
             # 执行前先清理所有旧的输出文件
             self.cleanup_previous_files()
             
             # 预处理代码（如处理numpy类型等兼容性问题）
-            try:
-                process_generated_code(str(code_path))
-                logger.info("Successfully preprocessed generated code")
-            except Exception as e:
-                logger.error(f"Failed to preprocess code: {str(e)}")
-                raise CodeExecutionError(f"Code preprocessing failed: {str(e)}")
-            
-            # 设置环境变量，保证PYTHONPATH正确
-            env = os.environ.copy()
-            env['PYTHONPATH'] = str(path_config.BASE_DIR)
-            
-            logger.info(f"Current working directory: {os.getcwd()}")
-            logger.info(f"Executing code from: {code_path}")
-            
-            try:
-                # 使用subprocess执行生成的python代码
-                result = subprocess.run(
-                    [sys.executable, str(code_path)],
-                    capture_output=True,
-                    text=True,
-                    env=env,
-                    cwd=str(path_config.BASE_DIR)
-                )
-                
-                # 记录标准输出和错误输出
-                if result.stdout:
-                    logger.info(f"Code output: {result.stdout}")
-                if result.stderr:
-                    logger.error(f"Code errors: {result.stderr}")
-                
-                # 如果执行失败，尝试自动修复代码
-                if result.returncode != 0:
-                    logger.warning("Initial execution failed. Attempting to fix code...")
-                    fix_result = self.code_fixer.fix_code()
-                    
-                    if fix_result["status"] != "success":
-                        raise CodeExecutionError("Code fixing failed")
-                    
-                    result.returncode = 0
-                    result.stdout = fix_result["output"]
-                    result.stderr = ""
-            
-            except Exception as e:
-                # 捕获执行异常，抛出自定义异常
-                raise CodeExecutionError(f"Code execution failed: {str(e)}")
-            
-            # 等待1秒，确保文件系统写入完成
-            time.sleep(1)
-            
-            # 检查是否生成了输出文件
-            if not self._verify_outputs():
-                raise CodeExecutionError("No output files were generated")
+            for unit in units:
+                self._preprocess_unit(unit)
+            logger.info("Successfully preprocessed generated code")
             
-            # 获取所有生成的图表文件名
-            graph_files = [f.name for f in path_config.GRAPHS_DIR.glob('*.png')]
+            # 代码单元分发到常驻工作进程池并行执行
+            max_workers = max(1, min(len(units), self.worker_pool.size))
+            logger.info(f"Executing {len(units)} code unit(s) on {max_workers} worker(s)")
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="code-unit") as pool:
+                unit_results = list(pool.map(self._execute_unit, units))
             
+            result = self.finalize(unit_results)
             logger.info("Code execution completed successfully")
-            # 返回结果字典
-            # status: 执行状态（success或失败）
-            # output: 代码执行的标准输出内容
-            # code_file: 执行的代码文件名
-            # generated_files: 生成的图表文件名列表
-            return {
-                "status": "success",
-                "output": result.stdout,
-                "code_file": code_path.name,
-                "generated_files": graph_files
-            }
+            return result
 
         except Exception as e:
             logger.error(f"Code execution failed: {str(e)}")
@@ -3,27 +3,44 @@ import os
 import re
 import time
 from pathlib import Path
-from typing import Dict, Any, List
-from langchain_google_genai import ChatGoogleGenerativeAI
+from typing import Dict, Any, List, Optional
 from langchain_core.prompts import ChatPromptTemplate
 
-from core.config.settings import get_settings
-from core.config.paths import path_config
+from core.config.constants import ExecutionOutcome
+from core.request_context import RequestContext
 from core.logging.logger import get_logger, log_execution
 from domain.exceptions.custom import CodeExecutionError, CodeGenerationError
+from services.llm.gateway import get_llm_gateway
 
 logger = get_logger(__name__)
 
+# 代码因资源限制被终止时，提示大模型降低计算量而不只是修复语法错误
+LIMIT_FIX_HINTS = {
+    ExecutionOutcome.TIMEOUT: (
+        "The code was killed because it exceeded the wall-clock time limit. "
+        "Reduce the work: aggregate before plotting, sample large data, avoid row-wise loops and apply."
+    ),
+    ExecutionOutcome.CPU_LIMIT: (
+        "The code was stopped because it exceeded the CPU time limit. "
+        "Use vectorized pandas operations, aggregate before plotting and sample large data."
+    ),
+    ExecutionOutcome.MEMORY_LIMIT: (
+        "The code ran out of memory. Avoid cartesian merges and pivoting high-cardinality columns, "
+        "select only needed columns and aggregate or sample before plotting."
+    ),
+    ExecutionOutcome.OUTPUT_LIMIT: (
+        "The code tried to write a file larger than allowed. "
+        "Keep stats JSON small (summaries, top categories only) and save plots at a moderate dpi."
+    ),
+}
+
 # 代码修复器：用于自动修复执行失败的分析代码
 class CodeFixer:
-    def __init__(self):
-        # 初始化大模型
-        settings = get_settings()
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL_NAME,
-            convert_system_message_to_human=True,
-            **settings.MODEL_SETTINGS
-        )
+    def __init__(self, context: RequestContext):
+        # 本次请求的上下文（输出目录、代码路径）
+        self.context = context
+        # 进程级共享的大模型网关
+        self.gateway = get_llm_gateway()
         # 设置修复代码的提示模板
         self._setup_prompt()
     
@@ -33,8 +50,8 @@ class CodeFixer:
         self.fix_prompt = ChatPromptTemplate.from_messages([
             ("system", f"""You are a Python code correction expert. Fix the code based on the error message.
             Use these EXACT paths for saving files:
-            Graphs: {path_config.GRAPHS_DIR}
-            Stats: {path_config.STATS_DIR}
+            Graphs: {self.context.graphs_dir}
+            Stats: {self.context.stats_dir}
             
             Rules:
             1. Return ONLY the corrected code
@@ -59,8 +76,6 @@ class CodeFixer:
             
             Please provide the corrected code.""")
         ])
-        # 组合提示模板和大模型
-        self.chain = self.fix_prompt | self.llm
 
     def _clean_code_formatting(self, code: str) -> str:
         """Clean formatting from generated code"""
@@ -81,8 +96,8 @@ class CodeFixer:
             if line.startswith('# Output:'):
                 filename = line.split('Output:')[1].strip()
                 expected_files.append({
-                    'graph': str(path_config.GRAPHS_DIR / filename),
-                    'stats': str(path_config.STATS_DIR / f"{Path(filename).stem}_stats.json")
+                    'graph': str(self.context.graphs_dir / filename),
+                    'stats': str(self.context.stats_dir / f"{Path(filename).stem}_stats.json")
                 })
         return expected_files
 
@@ -97,26 +112,34 @@ class CodeFixer:
                 missing_files.append(file_pair['stats'])
         return len(missing_files) == 0, missing_files
 
-    def _cleanup_partial_files(self):
-        """Clean up any partially generated files"""
-        # 清理部分生成的无效文件，避免影响后续修复
+    def _cleanup_partial_files(self, expected_files: List[Dict[str, str]]):
+        """Clean up partially generated files of the code being fixed"""
+        # 只清理当前代码单元的输出文件，避免影响并行执行的其他问题
         try:
-            for file in path_config.GRAPHS_DIR.glob('*.png'):
-                file.unlink()
-            
-            for file in path_config.STATS_DIR.glob('*_stats.json'):
-                file.unlink()
+            for file_pair in expected_files:
+                for file_path in (file_pair['graph'], file_pair['stats']):
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
             
             logger.info("Cleaned up partial execution files")
         except Exception as e:
             logger.error(f"Error cleaning up files: {str(e)}")
 
     @log_execution
-    def fix_code(self, code_path: Path = None, error_msg: str = None, max_attempts: int = 3) -> Dict[str, Any]:
+    def fix_code(
+        self,
+        code_path: Path = None,
+        error_msg: str = None,
+        max_attempts: int = 3,
+        outcome: Optional[ExecutionOutcome] = None
+    ) -> Dict[str, Any]:
         """Fix code with retries"""
         # 自动修复代码，支持多次重试
         if code_path is None:
-            code_path = path_config.CODE_DIR / "generated_analysis_code.py"
+            code_path = self.context.code_path
+        error_msg = error_msg or "Code execution failed"
+        if outcome in LIMIT_FIX_HINTS:
+            error_msg = f"{LIMIT_FIX_HINTS[outcome]}\n\n{error_msg}"
 
         attempt = 0
         while attempt < max_attempts:
@@ -128,14 +151,15 @@ class CodeFixer:
                 expected_files = self._get_expected_files(code)
                 
                 if attempt > 0:
-                    self._cleanup_partial_files()
+                    self._cleanup_partial_files(expected_files)
                 
                 # 调用大模型生成修复后的代码
-                response = self.chain.invoke({
-                    "code": code,
-                    "error": error_msg or "Code execution failed",
-                    "expected_files": expected_files
-                })
+                messages = self.fix_prompt.format_messages(
+                    code=code,
+                    error=error_msg,
+                    expected_files=expected_files
+                )
+                response = self.gateway.invoke(messages, operation="code_fix")
                 
                 fixed_code = self._clean_code_formatting(response.content)
                 
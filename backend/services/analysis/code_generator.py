@@ -1,41 +1,62 @@
 import re
 import os
-import pandas as pd
-from typing import List, Dict, Any
-from langchain_google_genai import ChatGoogleGenerativeAI
+import json
+import asyncio
+from pathlib import Path
+from typing import List, Dict, Any, Optional
 from langchain_core.prompts import ChatPromptTemplate
 from .utils import load_schema
+from .code_cache import get_code_cache, request_paths
 from core.config.settings import get_settings
 from core.config.paths import path_config
+from core.request_context import RequestContext
+from services.data.dataset_profiler import load_or_create_profile
+from services.llm.gateway import get_llm_gateway
 from core.logging.logger import get_logger, log_execution
 from domain.exceptions.custom import CodeGenerationError
 
 logger = get_logger(__name__)
 
+# 提示模板版本：修改代码生成提示后需递增，使旧的缓存代码失效
+PROMPT_TEMPLATE_VERSION = "1"
+
+# 已带问题序号前缀的输出文件名（如缓存中的代码），重新加前缀前先去掉
+UNIT_PREFIX_PATTERN = re.compile(r'^q\d+_')
+
+
+def unit_output_prefix(index: int) -> str:
+    """Prefix of every output file of a question, so questions never overwrite each other's files"""
+    return f"q{index:02d}_"
+
+
+def unit_header(index: int, question: str, filename: str) -> str:
+    """Comment lines that open the code block of a question"""
+    return f"# Question {index}: {question}\n# Output: {filename}\n"
+
+
 # 代码生成器：用于自动生成数据分析和可视化代码
 class CodeGenerator:
-    def __init__(self):
+    def __init__(self, context: RequestContext):
         # 获取全局配置
         settings = get_settings()
+        # 本次请求的上下文（目录和数据路径）
+        self.context = context
         # 响应目录路径
         self.response_dir = path_config.RESPONSE_DIR
         # 统计结果目录路径
-        self.stats_dir = path_config.STATS_DIR
+        self.stats_dir = context.stats_dir
         # 图表目录路径
-        self.graphs_dir = path_config.GRAPHS_DIR
+        self.graphs_dir = context.graphs_dir
         # 加载数据schema
         self.schema= load_schema()
-        
-        # 显式设置Google API密钥，供大模型调用
-        os.environ["GOOGLE_API_KEY"] = settings.GOOGLE_API_KEY
-        
-        # 初始化大模型（如Gemini）
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL_NAME,
-            google_api_key=settings.GOOGLE_API_KEY,
-            convert_system_message_to_human=True,
-            **settings.MODEL_SETTINGS
-        )
+        # 数据集画像的采样行数（画像缺失时重新生成）
+        self.profile_sample_rows = settings.PROFILE_SAMPLE_ROWS
+        # 同时在途的大模型请求数上限
+        self.concurrency = max(1, settings.CODEGEN_CONCURRENCY)
+        # 代码缓存（相同schema和问题直接复用已生成的代码）
+        self.code_cache = get_code_cache()
+        # 进程级共享的大模型网关（统一的客户端、限流、重试和熔断）
+        self.gateway = get_llm_gateway()
         # 设置提示模板
         self._setup_prompt_template()
     
@@ -108,8 +129,6 @@ Remember to close plots and clear memory when done."""),
             Path: {data_path}
             """)
         ])
-        # 组合提示模板和大模型，形成链式调用
-        self.chain = self.code_prompt | self.llm
 
     @log_execution
     def remove_code_block_formatting(self, code: str) -> str:
@@ -126,42 +145,95 @@ Remember to close plots and clear memory when done."""),
             # 捕获异常并抛出自定义异常
             raise CodeGenerationError(str(e))
 
+    def _postprocess_response(self, content: str, question: str) -> tuple[str, str]:
+        """Clean the LLM response and derive the output graph filename"""
+        # 清理代码格式
+        base_code = self.remove_code_block_formatting(content)
+        
+        # 用正则提取base_name变量，确定图表文件名
+        filename_match = re.search(r'base_name\s*=\s*["\']([^"\']+)["\']', base_code)
+        if not filename_match:
+            # 如果未找到，抛出异常
+            raise CodeGenerationError("Could not find base_name in generated code")
+        
+        filename = f"{filename_match.group(1)}.png"
+        
+        # 保证统计JSON中包含问题内容，替换json.dump的写法
+        stats_save_pattern = r'json\.dump\((.*?),\s*f,\s*default=convert_to_serializable,\s*indent=4\)'
+        modified_code = re.sub(
+            stats_save_pattern,
+            rf'json.dump({{\n    "question": """{question}""",\n    "analysis": \1}}, f, default=convert_to_serializable, indent=4)',
+            base_code
+        )
+        
+        # 返回生成的代码和图表文件名
+        return modified_code, filename
+
+    def cache_key(self, question: str, columns: List[str], d_types) -> Optional[str]:
+        """Code cache key of a question, or None when the cache is disabled"""
+        if self.code_cache is None:
+            return None
+        return self.code_cache.make_key(PROMPT_TEMPLATE_VERSION, columns, d_types, question)
+
+    def _lookup_cached_code(self, question: str, columns: List[str], d_types) -> Optional[tuple[str, str]]:
+        """Return the post-processed cached code of a question, if any"""
+        cache_key = self.cache_key(question, columns, d_types)
+        if cache_key is None:
+            return None
+        cached_code = self.code_cache.get(cache_key, request_paths(self.context))
+        if cached_code is None:
+            return None
+        logger.info(f"Code cache hit for question: {question}")
+        return self._postprocess_response(cached_code, question)
+
     @log_execution
-    def generate_code_for_question(self, question: str, columns: List[str], head_data: pd.DataFrame, data_path: str,d_types, schema) -> tuple[str, str]:
+    def generate_code_for_question(self, question: str, columns: List[str], head_data: str, data_path: str,d_types, schema) -> tuple[str, str]:
         """Generate code with schema example"""
         # 针对单个分析问题，生成数据分析和可视化代码
         try:   
-            # 调用大模型生成代码
-            response = self.chain.invoke({
-                "columns": columns,
-                "head_data": head_data,
-                "question": question,
-                "data_path": data_path,
-                "data_type": d_types,
-                "schema": schema
-            })
-            
-            # 清理代码格式
-            base_code = self.remove_code_block_formatting(response.content)
-            
-            # 用正则提取base_name变量，确定图表文件名
-            filename_match = re.search(r'base_name\s*=\s*["\']([^"\']+)["\']', base_code)
-            if not filename_match:
-                # 如果未找到，抛出异常
-                raise CodeGenerationError("Could not find base_name in generated code")
+            # 先查缓存，命中则跳过大模型调用
+            cached = self._lookup_cached_code(question, columns, d_types)
+            if cached is not None:
+                return cached
             
-            filename = f"{filename_match.group(1)}.png"
-            
-            # 保证统计JSON中包含问题内容，替换json.dump的写法
-            stats_save_pattern = r'json\.dump\((.*?),\s*f,\s*default=convert_to_serializable,\s*indent=4\)'
-            modified_code = re.sub(
-                stats_save_pattern,
-                rf'json.dump({{\n    "question": """{question}""",\n    "analysis": \1}}, f, default=convert_to_serializable, indent=4)',
-                base_code
+            # 调用大模型生成代码
+            messages = self.code_prompt.format_messages(
+                columns=columns,
+                head_data=head_data,
+                question=question,
+                data_path=data_path,
+                data_type=d_types,
+                schema=schema
             )
+            response = self.gateway.invoke(messages, operation="code_generation")
+            # 代码只有在执行成功后才写入缓存（见CodeExecutor）
+            return self._postprocess_response(response.content, question)
+        except Exception as e:
+            # 捕获异常并抛出自定义异常
+            raise CodeGenerationError(f"Failed to generate code: {str(e)}")
+
+    @log_execution
+    async def agenerate_code_for_question(self, question: str, columns: List[str], head_data: str, data_path: str, d_types, schema) -> tuple[str, str]:
+        """Async variant of generate_code_for_question, bounded by the concurrency limit"""
+        # 异步调用大模型，信号量限制同时在途的请求数
+        try:
+            # 先查缓存，命中则跳过大模型调用
+            cached = self._lookup_cached_code(question, columns, d_types)
+            if cached is not None:
+                return cached
             
-            # 返回生成的代码和图表文件名
-            return modified_code, filename
+            messages = self.code_prompt.format_messages(
+                columns=columns,
+                head_data=head_data,
+                question=question,
+                data_path=data_path,
+                data_type=d_types,
+                schema=schema
+            )
+            async with self._semaphore:
+                response = await self.gateway.ainvoke(messages, operation="code_generation")
+            # 代码只有在执行成功后才写入缓存（见CodeExecutor）
+            return self._postprocess_response(response.content, question)
         except Exception as e:
             # 捕获异常并抛出自定义异常
             raise CodeGenerationError(f"Failed to generate code: {str(e)}")
@@ -173,7 +245,7 @@ Remember to close plots and clear memory when done."""),
         # 保存生成的分析代码到文件
         try:
             # 目标代码文件路径
-            code_path = path_config.CODE_DIR / "generated_analysis_code.py"
+            code_path = self.context.code_path
             # 写入文件
             with open(code_path, 'w') as f:
                 f.write(code)
@@ -183,43 +255,132 @@ Remember to close plots and clear memory when done."""),
             # 捕获异常并抛出自定义异常
             raise CodeGenerationError(f"Failed to save code: {str(e)}")
 
+    def save_unit_code(self, unit: Dict[str, Any]) -> Path:
+        """Write one question's code file, so it can run before the other questions are generated"""
+        try:
+            code_file = self.context.code_dir / unit["code_file"]
+            with open(code_file, 'w') as f:
+                f.write(unit["code"])
+            return code_file
+        except Exception as e:
+            # 捕获异常并抛出自定义异常
+            raise CodeGenerationError(f"Failed to save code unit: {str(e)}")
+
+    @log_execution
+    def save_units_index(self, units: List[Dict[str, Any]]) -> str:
+        """Save the combined script and the index of all code units"""
+        # 完整脚本便于追溯；索引中不含代码本身（代码已单独写入各单元文件，修复后可能已改动）
+        try:
+            ordered = sorted(units, key=lambda u: u["index"])
+            code_path = self.save_generated_code("".join(unit["code"] for unit in ordered))
+            with open(self.context.units_path, 'w') as f:
+                json.dump(
+                    [{key: value for key, value in unit.items() if key != "code"} for unit in ordered],
+                    f, indent=2, ensure_ascii=False
+                )
+            return code_path
+        except CodeGenerationError:
+            raise
+        except Exception as e:
+            # 捕获异常并抛出自定义异常
+            raise CodeGenerationError(f"Failed to save code units: {str(e)}")
+
+    @log_execution
+    def save_code_units(self, units: List[Dict[str, Any]]) -> str:
+        """Save each question's code as its own file plus an index of all units"""
+        # 每个问题单独保存为一个代码文件，便于独立执行、失败后单独修复
+        for unit in units:
+            self.save_unit_code(unit)
+        return self.save_units_index(units)
+
+    def prepare_inputs(self) -> Dict[str, Any]:
+        """Prompt inputs shared by every question of this request"""
+        # 检查请求上下文中是否有数据文件路径（由上传接口写入）
+        if not self.context.data_path:
+            raise ValueError("No data file path provided")
+        # 读取上传时生成的数据集画像（只基于采样，不读取整个文件）
+        profile = load_or_create_profile(self.context, self.profile_sample_rows)
+        # 信号量需在当前事件循环中创建
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return {
+            "columns": profile["columns"],      # 所有列名
+            "head_data": profile["head_text"],  # 前5行数据样例，便于大模型理解数据结构
+            "data_path": str(self.context.data_path),
+            "d_types": profile["dtypes"],       # 每列数据类型
+            "schema": self.schema               # 预定义的数据结构约束
+        }
+
+    def _prefix_outputs(self, index: int, code: str, filename: str) -> tuple[str, str]:
+        """Rename the graph and stats files of a question's code to start with its index"""
+        # 文件名由大模型给出的base_name决定，不同问题（如追加的问题）可能重名
+        old_base = os.path.splitext(filename)[0]
+        new_base = unit_output_prefix(index) + UNIT_PREFIX_PATTERN.sub('', old_base)
+        code = re.sub(
+            rf'(base_name\s*=\s*["\']){re.escape(old_base)}(["\'])',
+            lambda m: f"{m.group(1)}{new_base}{m.group(2)}",
+            code, count=1
+        )
+        # 代码中直接写死的图表和统计文件名
+        code = re.sub(
+            rf'(["\'/]){re.escape(old_base)}(?=(?:\.png|_stats\.json)["\'])',
+            lambda m: f"{m.group(1)}{new_base}",
+            code
+        )
+        return code, f"{new_base}.png"
+
+    def build_unit(self, index: int, question: str, code: str, filename: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Code unit of one question: its code block and the files it is expected to write"""
+        code, filename = self._prefix_outputs(index, code, filename)
+        # 拼接注释、代码和文件名，便于后续追溯
+        return {
+            "index": index,
+            "question": question,
+            "code_file": f"question_{index:02d}.py",
+            "graph_file": filename,
+            "stats_file": f"{os.path.splitext(filename)[0]}_stats.json",
+            # 执行成功后按此键缓存代码，执行失败则删除
+            "cache_key": self.cache_key(question, inputs["columns"], inputs["d_types"]),
+            "code": f"{unit_header(index, question, filename)}{code}\n\n"
+        }
+
+    async def agenerate_unit(self, index: int, question: str, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate and save the code unit of one question (call ``prepare_inputs`` first)"""
+        code, filename = await self.agenerate_code_for_question(question, **inputs)
+        unit = self.build_unit(index, question, code, filename, inputs)
+        self.save_unit_code(unit)
+        return unit
+
     @log_execution
     def generate(self, provided_questions: List[str] = None) -> Dict[str, Any]:
         """Main generation method"""
-        # 主入口：根据用户提供的问题批量生成分析代码
+        # 主入口：在独立事件循环中并发生成所有问题的分析代码（在后台任务线程中调用）
+        return asyncio.run(self.agenerate(provided_questions))
+
+    @log_execution
+    async def agenerate(self, provided_questions: List[str] = None) -> Dict[str, Any]:
+        """Generate code for all questions concurrently and assemble it in question order"""
+        # 根据用户提供的问题并发生成分析代码，结果按问题顺序拼接
         try:
-            # 检查环境变量中是否有数据文件路径
-            # 数据文件路径由前端上传数据后，后端设置到环境变量DATA_FILE_PATH中
-            if not os.environ.get("DATA_FILE_PATH"):
-                raise ValueError("No data file path provided")
-
-            # 获取数据文件路径（如 /g:/Documents/PedroReports-LLM-Powered-Report-Tool/backend/user_uploads/diabetes.csv）
-            data_path = os.environ["DATA_FILE_PATH"]
-            # 读取数据文件，生成DataFrame对象
-            df = pd.read_csv(data_path) 
-            # 获取所有列名，便于后续生成代码时参考
-            columns = df.columns.tolist()
-            # 获取前5行数据样例，便于大模型理解数据结构
-            head_data = df.head()
-            # 获取每列数据类型，转为字符串，便于大模型判断分析方法
-            d_types = df.dtypes.apply(lambda x: str(x)).to_dict()
-            # 获取schema（预定义的数据结构约束）
-            schema= self.schema
+            inputs = self.prepare_inputs()
+            questions = provided_questions or []
+            logger.info(f"Generating code for {len(questions)} question(s) with concurrency {self.concurrency}")
             
-            generated_code = ""  # 用于存放所有生成的代码
-            filenames = []        # 用于存放所有生成的图表文件名
-            
-            # 遍历每个分析问题，逐一生成代码和图表文件名
-            for i, question in enumerate(provided_questions or []):
-                code, filename = self.generate_code_for_question(
-                    question, columns, head_data, data_path, d_types, schema
-                )
-                # 拼接注释、代码和文件名，便于后续追溯
-                generated_code += f"# Question {i}: {question}\n# Output: {filename}\n{code}\n\n"
-                filenames.append(filename)
+            # 并发生成每个问题的代码和图表文件名，gather保证结果顺序与问题顺序一致
+            results = await asyncio.gather(*[
+                self.agenerate_code_for_question(question, **inputs)
+                for question in questions
+            ])
+            units = [
+                self.build_unit(i, question, code, filename, inputs)
+                for i, (question, (code, filename)) in enumerate(zip(questions, results))
+            ]
+            generated_code = "".join(unit["code"] for unit in units)  # 所有问题的完整代码
+            filenames = [unit["graph_file"] for unit in units]        # 每个问题生成的图表文件名
                 
-            # 保存所有生成的代码到本地文件，供后续自动执行
-            code_path = self.save_generated_code(generated_code)
+            # 保存所有生成的代码到本地文件（完整脚本便于追溯，单元文件供独立执行）
+            code_path = self.save_code_units(units)
+            for unit in units:
+                unit.pop("code")
         
             # 返回结果字典，供后续执行和报告生成使用
             # code: 所有自动生成的分析和可视化Python代码（字符串形式），包含每个问题的代码段
@@ -230,9 +391,10 @@ Remember to close plots and clear memory when done."""),
                 "code": generated_code,      # 所有问题的完整Python代码
                 "filenames": filenames,      # 每个问题生成的图表文件名
                 "code_path": code_path,      # 代码文件的保存路径
+                "units": units,              # 每个问题的代码单元信息
                 "status": "success"          # 状态标记
             }
         except Exception as e:
             # 记录错误日志并抛出自定义异常
             logger.error(f"Code generation failed: {str(e)}")
-            raise CodeGenerationError(str(e))
\ No newline at end of file
+            raise CodeGenerationError(str(e))
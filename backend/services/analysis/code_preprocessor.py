@@ -58,6 +58,10 @@ def process_generated_code(code_path: str) -> str:
         with open(code_path, 'r') as f:
             original_code = f.read()
         
+        # 已处理过的代码（如恢复运行时重新执行）不再重复处理
+        if 'class NumpyJSONEncoder(json.JSONEncoder)' in original_code:
+            return code_path
+        
         # 添加类型转换处理
         modified_code = add_type_conversion_handling(original_code)
         
@@ -0,0 +1,62 @@
+# services/analysis/description_cache.py
+import hashlib
+import json
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from core.cache import SQLiteLRUCache, hash_key
+from core.config.paths import path_config
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+
+logger = get_logger(__name__)
+
+
+def canonical_stats(stats_data: Dict[str, Any]) -> str:
+    """Serialize stats so that equal content always produces the same string"""
+    return json.dumps(stats_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# 图表解读缓存：按模型、模板版本、图片字节和统计数据寻址，相同图表直接复用解读
+class DescriptionCache:
+    """Content-addressed cache of generated chart description sections"""
+
+    def __init__(self, store: SQLiteLRUCache, model_name: str):
+        self.store = store
+        self.model_name = model_name
+
+    def make_key(self, template_version: str, image_data: bytes, stats_data: Dict[str, Any]) -> str:
+        """Hash of model, template version, image bytes and canonical stats"""
+        image_digest = hashlib.sha256(image_data).hexdigest()
+        return hash_key(self.model_name, template_version, image_digest, canonical_stats(stats_data))
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Cached description sections, or None on a miss"""
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            self.store.delete(key)
+            return None
+
+    def set(self, key: str, sections: List[Dict[str, Any]]) -> None:
+        self.store.set(key, json.dumps(sections, ensure_ascii=False))
+
+
+@lru_cache()
+def get_description_cache() -> Optional[DescriptionCache]:
+    """Process-wide description cache, or None when disabled in settings"""
+    settings = get_settings()
+    if not settings.DESCRIPTION_CACHE_ENABLED:
+        return None
+    store = SQLiteLRUCache(
+        path_config.CACHE_DIR / "description_cache.sqlite3",
+        max_entries=settings.DESCRIPTION_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.DESCRIPTION_CACHE_TTL_SECONDS
+    )
+    metrics_registry.register("description_cache", store.stats)
+    logger.info(f"Description cache enabled at {store.db_path}")
+    return DescriptionCache(store, settings.GEMINI_MODEL_NAME)
@@ -1,45 +1,37 @@
 import json
 import re
-import time
-import io
-import os
+import asyncio
 from typing import Dict, Optional, List
-from PIL import Image
 from pathlib import Path
-from langchain_google_genai import GoogleGenerativeAI
 from langchain.schema.messages import HumanMessage
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type
-)
 
 from core.config.settings import get_settings
-from core.config.paths import path_config
+from core.request_context import RequestContext
+from services.analysis.description_cache import get_description_cache
+from services.analysis.image_renditions import get_rendition_renderer, image_mime_type
+from services.analysis.stats_compactor import compact_stats
+from services.llm.gateway import get_llm_gateway
+from services.llm.rate_limiter import estimate_tokens
+from services.analysis.output_manifest import load_manifest
 from core.logging.logger import get_logger, log_execution
 from domain.exceptions.custom import DataProcessingError
 
 logger = get_logger(__name__)
 
+# 解读提示模板版本：修改分析模板后需递增，使旧的缓存解读失效
+DESCRIPTION_TEMPLATE_VERSION = "1"
+
 # DescriptionGenerator类：自动化图表解读生成器，结合图像和统计数据，生成专业分析解读
 class DescriptionGenerator:
-    def __init__(self, batch_size: int = 1, min_delay: float = 3.0):
-        # 构造函数，初始化生成器，设置批量处理参数和API密钥
+    def __init__(self, context: RequestContext, concurrency: Optional[int] = None):
+        # 构造函数，初始化生成器，设置并发参数和API密钥
         try:
             settings = get_settings()  # 获取全局配置（如API密钥、模型名等）
-            
-            # 显式设置Google API密钥，供大模型调用
-            os.environ["GOOGLE_API_KEY"] = settings.GOOGLE_API_KEY
-            
-            # 初始化大模型（如Gemini），用于后续AI分析
-            self.llm = GoogleGenerativeAI(
-                model=settings.GEMINI_MODEL_NAME,
-                google_api_key=settings.GOOGLE_API_KEY, 
-                **settings.MODEL_SETTINGS
-            )
-            # 设置批处理参数和分析模板
-            self._setup_parameters(batch_size, min_delay)
+            self.context = context     # 本次请求的上下文（图表、统计、解读目录）
+            # 进程级共享的大模型网关（统一的客户端、限流、重试和熔断）
+            self.gateway = get_llm_gateway()
+            # 设置并发参数和分析模板
+            self._setup_parameters(concurrency or settings.DESCRIPTION_CONCURRENCY)
             self._setup_analysis_template()
             
             logger.info("DescriptionGenerator initialized successfully")
@@ -48,17 +40,22 @@ class DescriptionGenerator:
             # 初始化失败时抛出自定义异常
             raise DataProcessingError(str(e))
     
-    def _setup_parameters(self, batch_size: int, min_delay: float):
+    def _setup_parameters(self, concurrency: int):
         """Set up processing parameters"""
-        # 设置批量处理相关参数
-        self.batch_size = batch_size  # 每批处理的图表数量
-        self.min_delay = min_delay    # 每次API调用之间的最小延迟（秒）
-        self.last_api_call = 0        # 上一次API调用的时间戳
-        
-        # 图像优化参数，控制图片大小和质量，避免API超限
-        self.max_image_size = (500, 500)  # 图片最大宽高（像素）
-        self.image_quality = 50           # 图片初始压缩质量（0-100）
-        self.max_image_size_kb = 100      # 图片最大体积（KB）
+        # 设置并发处理相关参数
+        self.concurrency = max(1, concurrency)  # 同时在途的解读请求数
+        # 缩略图生成器，仅在清单中缺少缩略图时使用
+        self.renderer = get_rendition_renderer()
+        # 批量解读：每次请求最多打包的图表数和提示token预算
+        settings = get_settings()
+        self.max_batch_size = max(1, settings.DESCRIPTION_MAX_BATCH_SIZE)
+        self.batch_token_budget = settings.DESCRIPTION_BATCH_TOKEN_BUDGET
+        # 提示中统计数据的压缩参数
+        self.stats_token_budget = settings.STATS_PROMPT_TOKEN_BUDGET
+        self.stats_significant_digits = settings.STATS_SIGNIFICANT_DIGITS
+        self.stats_max_group_items = settings.STATS_MAX_GROUP_ITEMS
+        # 解读缓存（相同图片和统计数据直接复用解读）
+        self.description_cache = get_description_cache()
     
     def _setup_analysis_template(self):
         """Set up the analysis template"""
@@ -116,47 +113,27 @@ Format your response in the following JSON structure:
         }
     ]
 }"""
+        # 批量模式：一次请求解读多张图表，返回以key标识的JSON数组，每个元素沿用单图的结构
+        self.batch_template = self.analysis_template.replace(
+            "Analyze this visualization and statistical data",
+            "Analyze EACH visualization below together with its own statistical data",
+            1
+        ).replace(
+            "Format your response in the following JSON structure:",
+            "Return ONLY a JSON array with exactly one element per visualization, in the form\n"
+            '[{"key": "<visualization key>", "sections": [...]}, ...]\n'
+            'where the "sections" of each element follow this JSON structure:',
+            1
+        )
     
-    def _optimize_image(self, image_data: bytes) -> bytes:
-        """Optimize image for processing"""
-        # 图像优化，压缩图片以便大模型处理，避免超出API限制
-        try:
-            image = Image.open(io.BytesIO(image_data))  # 从二进制数据读取图片
-            
-            # 如果图片有透明通道（RGBA），转为白底RGB
-            if image.mode == 'RGBA':
-                background = Image.new('RGB', image.size, (255, 255, 255))
-                background.paste(image, mask=image.split()[3])
-                image = background
-            
-            width, height = image.size
-            # 如果图片尺寸超限，缩放到最大尺寸
-            if width > self.max_image_size[0] or height > self.max_image_size[1]:
-                image.thumbnail(self.max_image_size, Image.Resampling.LANCZOS)
-            
-            quality = self.image_quality
-            # 循环降低图片质量，直到体积小于最大限制
-            while quality >= 40:
-                output_buffer = io.BytesIO()
-                image.save(output_buffer, 
-                         format='JPEG', 
-                         quality=quality, 
-                         optimize=True)
-                size_kb = len(output_buffer.getvalue()) / 1024
-                
-                if size_kb <= self.max_image_size_kb:
-                    break
-                    
-                quality -= 5
-            
-            optimized_data = output_buffer.getvalue()  # 得到优化后的图片二进制数据
-            logger.info(f"Image optimized from {len(image_data)/1024:.1f}KB to {len(optimized_data)/1024:.1f}KB")
-            
-            return optimized_data
-        except Exception as e:
-            logger.error(f"Image optimization failed: {str(e)}")
-            # 优化失败时返回原始图片数据，保证流程不中断
-            return image_data
+    def _load_llm_image(self, graph_path: Path, image_path: Optional[Path]) -> bytes:
+        """Read the LLM-sized rendition written at execution time"""
+        # 执行阶段已生成缩略图，直接读取字节；缺失时（旧请求）现场生成
+        if image_path is not None and image_path.exists():
+            with open(image_path, "rb") as f:
+                return f.read()
+        with open(graph_path, "rb") as f:
+            return self.renderer.render(f.read())
 
     def _clean_json_string(self, text: str) -> Optional[str]:
         """Clean and validate JSON string"""
@@ -177,35 +154,11 @@ Format your response in the following JSON structure:
             logger.error(f"Failed to clean JSON string: {str(e)}")
             raise DataProcessingError(str(e))
 
-    def _rate_limit_api_call(self):
-        """Implement rate limiting for API calls"""
-        # 控制API调用频率，防止超限或被封禁
-        current_time = time.time()  # 当前时间戳
-        time_since_last_call = current_time - self.last_api_call  # 距离上次调用的间隔
-        
-        if time_since_last_call < self.min_delay:
-            sleep_time = self.min_delay - time_since_last_call
-            time.sleep(sleep_time)  # 如果间隔太短则等待
-        
-        self.last_api_call = time.time()  # 更新上次调用时间
-
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=2, min=4, max=30),
-        retry=retry_if_exception_type((Exception,))
-    )
-    def _make_api_call(self, message: HumanMessage) -> str:
-        """Make API call with retry logic"""
-        # 调用大模型API，自动重试机制，防止偶发性网络或服务错误
-        self._rate_limit_api_call()  # 先做频率控制
-        try:
-            return self.llm.invoke([message])  # 实际调用大模型API
-        except Exception as e:
-            logger.error(f"API call failed: {str(e)}")
-            # 如果遇到超时等问题，适当增加延迟
-            if "deadline" in str(e).lower():
-                self.min_delay += 1
-            raise
+    async def _make_api_call(self, message: HumanMessage) -> str:
+        """Send a multimodal request through the shared LLM gateway"""
+        # 限流、重试和熔断由网关统一处理
+        response = await self.gateway.ainvoke([message], operation="description")
+        return response.content
 
     def _load_stats_data(self, stats_path: Path) -> Dict:
         """Load and validate stats data from file"""
@@ -223,22 +176,110 @@ Format your response in the following JSON structure:
             logger.error(f"Failed to load stats data from {stats_path}: {str(e)}")
             raise DataProcessingError(f"Failed to load stats data: {str(e)}")
 
+    def _prepare_item(self, entry: Dict) -> Dict:
+        """Load the image bytes and stats of one manifest entry"""
+        graph_path = Path(entry["graph_path"])
+        stats_data = self._load_stats_data(Path(entry["stats_path"]))
+        image_data = self._load_llm_image(
+            graph_path,
+            Path(entry["llm_image_path"]) if entry.get("llm_image_path") else None
+        )
+        cache_key = None
+        if self.description_cache is not None:
+            cache_key = self.description_cache.make_key(DESCRIPTION_TEMPLATE_VERSION, image_data, stats_data)
+        return {
+            "key": f"graph_{entry.get('index', graph_path.stem)}_{graph_path.stem}",
+            "index": entry.get("index"),
+            "graph_path": graph_path,
+            "stats_path": Path(entry["stats_path"]),
+            "stats_data": stats_data,
+            # 压缩后的统计数据（去除空白、取整、截断长分组表）
+            "stats_text": compact_stats(
+                stats_data,
+                self.stats_token_budget,
+                significant_digits=self.stats_significant_digits,
+                max_items=self.stats_max_group_items
+            ).text,
+            "image_data": image_data,
+            "cache_key": cache_key,
+        }
+
+    def _save_description(self, item: Dict, sections: List, cache: bool = True) -> Dict:
+        """Write the description file of one graph and return its result record"""
+        if cache and item.get("cache_key") is not None:
+            self.description_cache.set(item["cache_key"], sections)
+        graph_path, stats_path = item["graph_path"], item["stats_path"]
+        output_data = {
+            "index": item["index"],         # 问题序号（与输出清单一致）
+            "graph_name": graph_path.name,  # 图表文件名
+            "question": item["stats_data"].get('question', 'Analyze the visualization'),  # 分析问题
+            "stats_file": stats_path.name,  # 统计数据文件名
+            "sections": sections            # 结构化分析内容
+        }
+        
+        # 保存分析结果到json文件，便于后续报告生成
+        json_path = self.context.description_dir / f"{graph_path.stem}.json"
+        with open(json_path, "w", encoding='utf-8') as f:
+            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        
+        logger.info(f"Generated description for {graph_path}")
+        # 返回本次分析的所有关键信息
+        return {
+            "graph_path": str(graph_path),   # 图表路径
+            "stats_path": str(stats_path),   # 统计数据路径
+            "json_path": str(json_path),     # 生成的解读json路径
+            "content": output_data           # 结构化分析内容
+        }
+
+    def _item_tokens(self, item: Dict) -> int:
+        """Prompt tokens one graph adds to a request"""
+        return estimate_tokens(item["stats_text"], images=1)
+
+    def _plan_batches(self, items: List[Dict]) -> List[List[Dict]]:
+        """Group graphs into requests that fit the token budget and the batch size limit"""
+        # 按清单顺序贪心打包：指令只计一次，每张图表加上统计数据和图片的token
+        batches: List[List[Dict]] = []
+        template_tokens = estimate_tokens(self.batch_template)
+        current: List[Dict] = []
+        current_tokens = template_tokens
+        for item in items:
+            tokens = self._item_tokens(item)
+            if current and (len(current) >= self.max_batch_size
+                            or current_tokens + tokens > self.batch_token_budget):
+                batches.append(current)
+                current, current_tokens = [], template_tokens
+            current.append(item)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _parse_batch_response(self, text: str) -> Dict[str, List]:
+        """Map each key in a batched JSON array response to its sections"""
+        # 提取第一个方括号包裹的JSON数组，单个元素解析失败不影响其他图表
+        match = re.search(r'\[[\s\S]*\]', re.sub(r'```(?:json)?', '', text))
+        if not match:
+            return {}
+        try:
+            elements = json.loads(re.sub(r',\s*([}\]])', r'\1', match.group(0)))
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse batched description response: {str(e)}")
+            return {}
+        
+        parsed = {}
+        for element in elements if isinstance(elements, list) else []:
+            if isinstance(element, dict) and isinstance(element.get("sections"), list) and element["sections"]:
+                parsed[str(element.get("key"))] = element["sections"]
+        return parsed
+
     @log_execution
-    def _process_single_graph(self, graph_path: Path, stats_path: Path) -> Dict:
+    async def _process_single_graph(self, item: Dict) -> Dict:
         """Process a single graph with error handling"""
         # 处理单个图表，生成AI解读，返回结构化结果
         try:
-            # 读取并优化图片，准备传给大模型
-            with open(graph_path, "rb") as img_file:
-                image_data = img_file.read()
-            optimized_image_data = self._optimize_image(image_data)
-            
-            # 读取并校验统计数据，准备传给大模型
-            stats_data = self._load_stats_data(stats_path)
-            
             # 构建大模型输入prompt，包含统计数据和分析模板
             prompt = f"""Statistical Data:
-    {json.dumps(stats_data, indent=2)}
+    {item["stats_text"]}
 
     {self.analysis_template}"""
 
@@ -249,87 +290,114 @@ Format your response in the following JSON structure:
                     "text": prompt
                 },
                 {
-                    "type": "image",
-                    "image_data": optimized_image_data
+                    "type": "media",
+                    "mime_type": image_mime_type(item["image_data"]),
+                    "data": item["image_data"]
                 }
             ])
 
             # 调用大模型并处理返回，得到AI分析结果
-            response = self._make_api_call(message)
+            response = await self._make_api_call(message)
             cleaned_json = self._clean_json_string(response)
             
             if not cleaned_json:
                 # 如果AI返回内容无法解析为JSON，抛出异常
                 raise DataProcessingError("Failed to generate valid analysis")
-                
-            output_data = {
-                "graph_name": graph_path.name,  # 图表文件名
-                "question": stats_data.get('question', 'Analyze the visualization'),  # 分析问题
-                "stats_file": stats_path.name,  # 统计数据文件名
-                "sections": json.loads(cleaned_json).get("sections", [])  # 结构化分析内容
-            }
-            
-            # 保存分析结果到json文件，便于后续报告生成
-            json_path = path_config.DESCRIPTION_DIR / f"{graph_path.stem}.json"
-            with open(json_path, "w", encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
             
-            logger.info(f"Generated description for {graph_path}")
-            # 返回本次分析的所有关键信息
-            return {
-                "graph_path": str(graph_path),   # 图表路径
-                "stats_path": str(stats_path),   # 统计数据路径
-                "json_path": str(json_path),     # 生成的解读json路径
-                "content": output_data           # 结构化分析内容
-            }
+            return self._save_description(item, json.loads(cleaned_json).get("sections", []))
                 
         except Exception as e:
-            logger.error(f"Failed to process graph {graph_path}: {str(e)}")
+            logger.error(f"Failed to process graph {item['graph_path']}: {str(e)}")
             # 发生异常时返回错误信息和图表路径
-            return {"error": str(e), "graph_path": str(graph_path)}
+            return {"error": str(e), "graph_path": str(item["graph_path"])}
 
     @log_execution
-    def generate_description(self, graph_paths: List[str]) -> List[Dict]:
-        """Generate descriptions for multiple graphs"""
-        # 批量处理多个图表，生成AI解读，返回所有成功的结果
+    async def _process_batch(self, batch: List[Dict]) -> tuple[List[Dict], List[Dict]]:
+        """Describe several graphs in one multimodal request; returns (results, items to retry singly)"""
+        # 一次请求包含多张图表及其统计数据，指令只发送一次
+        content = [{"type": "text", "text": self.batch_template}]
+        for item in batch:
+            content.append({
+                "type": "text",
+                "text": f"Visualization key: {item['key']}\nStatistical Data:\n{item['stats_text']}"
+            })
+            content.append({"type": "media", "mime_type": image_mime_type(item["image_data"]), "data": item["image_data"]})
         try:
-            results = []  # 用于收集所有结果
-            # 分批处理，支持大批量任务，防止API超限
-            for i in range(0, len(graph_paths), self.batch_size):
-                batch = graph_paths[i:i + self.batch_size]  # 当前批次的图表路径
-                batch_results = []
-                
-                for graph_path in batch:
-                    graph_path = Path(graph_path)
-                    graph_base = graph_path.stem
-                    
-                    # 查找匹配的统计文件，通常以图表名为前缀
-                    analysis_prefix = '_'.join(graph_base.split('_')[:-1])
-                    matching_stats = list(path_config.STATS_DIR.glob(
-                        f"{analysis_prefix}*_stats.json"
-                    ))
-                    
-                    if not matching_stats:
-                        logger.error(f"No matching stats file found for graph {graph_path.name}")
-                        continue
-                    
-                    # 按创建时间排序，取最新的统计文件，保证分析和图表一一对应
-                    stats_path = sorted(
-                        matching_stats,
-                        key=lambda x: x.stat().st_ctime
-                    )[-1]
-                    
-                    # 处理单个图表，生成AI解读
-                    result = self._process_single_graph(graph_path, stats_path)
-                    batch_results.append(result)
-                    time.sleep(self.min_delay)  # 控制API调用频率
-                
+            response = await self._make_api_call(HumanMessage(content=content))
+            sections_by_key = self._parse_batch_response(response)
+        except Exception as e:
+            logger.error(f"Batched description request failed: {str(e)}")
+            sections_by_key = {}
+        
+        results, retry_items = [], []
+        for item in batch:
+            sections = sections_by_key.get(item["key"])
+            if sections is None:
+                retry_items.append(item)
+                continue
+            try:
+                results.append(self._save_description(item, sections))
+            except Exception as e:
+                logger.error(f"Failed to save description for {item['graph_path']}: {str(e)}")
+                retry_items.append(item)
+        if retry_items:
+            logger.warning(f"{len(retry_items)} of {len(batch)} graph(s) missing from batched response; retrying individually")
+        return results, retry_items
+
+    @log_execution
+    def generate_description(self, entries: List[Dict]) -> List[Dict]:
+        """Generate descriptions for the graph/stats pairs listed in the output manifest"""
+        # 同步入口：在独立事件循环中并发生成所有解读
+        return asyncio.run(self.agenerate_description(entries))
+
+    @log_execution
+    async def agenerate_description(self, entries: List[Dict], semaphore: Optional[asyncio.Semaphore] = None) -> List[Dict]:
+        """Generate descriptions in token-budgeted batches, falling back to single-graph calls"""
+        # 按输出清单顺序打包图表并发请求，解析失败的图表单独重试
+        # semaphore：多次调用共享的并发上限（流式流水线中每个问题单独调用一次）
+        try:
+            semaphore = semaphore or asyncio.Semaphore(self.concurrency)
+            results: List[Dict] = []
+            items: List[Dict] = []
+            for entry in entries:
+                try:
+                    items.append(self._prepare_item(entry))
+                except Exception as e:
+                    results.append({"error": str(e), "graph_path": entry["graph_path"]})
+
+            async def process_batch(batch: List[Dict]) -> tuple[List[Dict], List[Dict]]:
+                async with semaphore:
+                    if len(batch) == 1:
+                        return [await self._process_single_graph(batch[0])], []
+                    return await self._process_batch(batch)
+
+            async def process_single(item: Dict) -> Dict:
+                async with semaphore:
+                    return await self._process_single_graph(item)
+
+            # 先查缓存，命中的图表无需调用大模型
+            pending: List[Dict] = []
+            for item in items:
+                cached = self.description_cache.get(item["cache_key"]) if item["cache_key"] else None
+                if cached is None:
+                    pending.append(item)
+                else:
+                    logger.info(f"Description cache hit for {item['graph_path'].name}")
+                    results.append(self._save_description(item, cached, cache=False))
+            
+            batches = self._plan_batches(pending)
+            logger.info(f"Describing {len(pending)} graph(s) in {len(batches)} request(s), {len(items) - len(pending)} cached")
+            retry_items: List[Dict] = []
+            for batch_results, batch_retries in await asyncio.gather(*(process_batch(b) for b in batches)):
                 results.extend(batch_results)
-                
-                # 批次间延迟，进一步防止API限流
-                if i + self.batch_size < len(graph_paths):
-                    logger.info("Adding delay between batches")
-                    time.sleep(self.min_delay * 2)
+                retry_items.extend(batch_retries)
+            
+            # 批量响应中缺失或解析失败的图表回退为单图请求
+            results.extend(await asyncio.gather(*(process_single(item) for item in retry_items)))
+            
+            # 按问题顺序排列结果
+            order = {str(item["graph_path"]): position for position, item in enumerate(items)}
+            results.sort(key=lambda r: order.get(r["graph_path"], len(order)))
             
             # 过滤出成功和失败的结果，便于后续处理
             successful_results = [r for r in results if 'error' not in r]
@@ -339,7 +407,7 @@ Format your response in the following JSON structure:
             for error in errors:
                 logger.error(f"Failed to process {error['graph_path']}: {error['error']}")
             
-            logger.info(f"Successfully processed {len(successful_results)} out of {len(graph_paths)} graphs")
+            logger.info(f"Successfully processed {len(successful_results)} out of {len(entries)} graphs")
             # 返回所有成功的结构化分析结果
             return successful_results
                 
@@ -349,22 +417,22 @@ Format your response in the following JSON structure:
 
 # 入口函数：批量生成所有图表的AI解读
 
-def generate_descriptions() -> List[Dict]:
+def generate_descriptions(context: RequestContext) -> List[Dict]:
     """Main function to generate descriptions"""
     # 该函数为整个流程的入口，自动处理所有图表，生成AI解读
     try:
         logger.info("Starting graph analysis...")
-        generator = DescriptionGenerator(batch_size=1, min_delay=3.0)  # 实例化生成器
+        generator = DescriptionGenerator(context)  # 实例化生成器
         
-        # 获取所有图表文件路径，通常为png图片
-        graph_paths = list(path_config.GRAPHS_DIR.glob('*.png'))
+        # 从代码执行生成的输出清单中读取图表和统计文件
+        entries = load_manifest(context)["entries"]
         
-        if not graph_paths:
+        if not entries:
             logger.error("No graphs found for analysis")
             return []
         
         # 批量生成所有图表的AI解读
-        results = generator.generate_description([str(p) for p in graph_paths])
+        results = generator.generate_description(entries)
         logger.info(f"Completed processing {len(results)} graphs successfully")
         return results
         
@@ -0,0 +1,163 @@
+# services/analysis/image_renditions.py
+import hashlib
+import io
+import threading
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from core.cache import SQLiteLRUCache, hash_key
+from core.config.paths import path_config
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+
+logger = get_logger(__name__)
+
+# 渲染算法版本，修改缩放或编码方式时递增，使旧缓存失效
+RENDITION_VERSION = 2
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    """Target size and byte budget of the image sent to the LLM"""
+    max_pixels: int
+    max_bytes: int
+    min_quality: int
+    max_quality: int
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def image_mime_type(data: bytes) -> str:
+    """MIME type of a rendition (PNG or JPEG)"""
+    return "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+
+
+def render_llm_image(image_data: bytes, spec: RenditionSpec) -> bytes:
+    """Downscale a chart and encode it as the smaller of a budgeted JPEG and a PNG"""
+    image = Image.open(io.BytesIO(image_data))
+
+    # 透明通道转为白底RGB
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[3])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    image.thumbnail((spec.max_pixels, spec.max_pixels), Image.Resampling.LANCZOS)
+
+    # 二分查找不超过体积上限的最高JPEG质量
+    low, high = spec.min_quality, spec.max_quality
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _encode_jpeg(image, quality)
+        if len(data) <= spec.max_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    # 最低质量仍超限时使用最低质量的结果
+    if best is None:
+        best = _encode_jpeg(image, spec.min_quality)
+
+    # 色块为主的简单图表用PNG往往更小，且没有压缩失真
+    png = _encode_png(image)
+    return png if len(png) < len(best) else best
+
+
+# 图表缩略图生成器：按图片内容哈希缓存，相同图表无需重复编码
+class RenditionRenderer:
+    """Creates LLM-sized renditions of graphs, cached by image hash"""
+
+    def __init__(self, spec: RenditionSpec, store: Optional[SQLiteLRUCache] = None):
+        self.spec = spec
+        self.store = store
+        # 原图与缩略图的累计字节数，缩略图反而更大时可在指标中发现
+        self._lock = threading.Lock()
+        self.renditions = 0
+        self.source_bytes = 0
+        self.rendition_bytes = 0
+
+    def _cache_key(self, image_data: bytes) -> str:
+        digest = hashlib.sha256(image_data).hexdigest()
+        return hash_key("llm_rendition", RENDITION_VERSION, digest, asdict(self.spec))
+
+    def _track(self, source_size: int, rendition_size: int) -> None:
+        with self._lock:
+            self.renditions += 1
+            self.source_bytes += source_size
+            self.rendition_bytes += rendition_size
+        if rendition_size > source_size:
+            logger.warning(
+                f"LLM rendition is larger than its source: {source_size/1024:.1f}KB -> {rendition_size/1024:.1f}KB"
+            )
+
+    def render(self, image_data: bytes) -> bytes:
+        """Rendition bytes for an image, from the cache when possible"""
+        key = self._cache_key(image_data)
+        data = self.store.get_bytes(key) if self.store is not None else None
+        if data is None:
+            data = render_llm_image(image_data, self.spec)
+            if self.store is not None:
+                self.store.set_bytes(key, data)
+        self._track(len(image_data), len(data))
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "renditions": self.renditions,
+                "source_bytes": self.source_bytes,
+                "rendition_bytes": self.rendition_bytes,
+                "ratio": round(self.rendition_bytes / self.source_bytes, 3) if self.source_bytes else None,
+            }
+
+    def render_file(self, graph_path: Path, output_path: Path) -> Path:
+        """Write the rendition of a graph file; the suffix follows the chosen format"""
+        with open(graph_path, "rb") as f:
+            image_data = f.read()
+        data = self.render(image_data)
+        output_path = output_path.with_suffix(".png" if image_mime_type(data) == "image/png" else ".jpg")
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(data)
+        logger.info(f"Rendered {graph_path.name} for LLM input: {len(image_data)/1024:.1f}KB -> {len(data)/1024:.1f}KB")
+        return output_path
+
+
+@lru_cache()
+def get_rendition_renderer() -> RenditionRenderer:
+    """Process-wide renderer configured from settings"""
+    settings = get_settings()
+    spec = RenditionSpec(
+        max_pixels=settings.LLM_IMAGE_MAX_PIXELS,
+        max_bytes=settings.LLM_IMAGE_MAX_KB * 1024,
+        min_quality=settings.LLM_IMAGE_MIN_QUALITY,
+        max_quality=settings.LLM_IMAGE_MAX_QUALITY
+    )
+    store = SQLiteLRUCache(
+        path_config.CACHE_DIR / "renditions.sqlite3",
+        max_entries=settings.RENDITION_CACHE_MAX_ENTRIES
+    )
+    metrics_registry.register("rendition_cache", store.stats)
+    renderer = RenditionRenderer(spec, store)
+    metrics_registry.register("llm_renditions", renderer.stats)
+    return renderer
@@ -0,0 +1,81 @@
+# services/analysis/output_manifest.py
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+from core.logging.logger import get_logger
+from core.request_context import RequestContext
+from domain.exceptions.custom import DataProcessingError
+
+logger = get_logger(__name__)
+
+# manifest.json结构版本，字段变化时递增
+MANIFEST_VERSION = 1
+
+
+def pair_outputs(outputs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Pair recorded graphs with stats files in the order the code wrote them"""
+    # 生成代码按“先保存图表、再保存统计”的顺序执行，按写入顺序一一配对
+    graphs = [o for o in outputs if o["kind"] == "graph" and Path(o["path"]).exists()]
+    stats = [o for o in outputs if o["kind"] == "stats" and Path(o["path"]).exists()]
+    if len(graphs) != len(stats):
+        logger.warning(f"Recorded {len(graphs)} graph(s) but {len(stats)} stats file(s); unpaired outputs are ignored")
+
+    return [
+        {
+            "graph_path": graph["path"],
+            "graph_bytes": Path(graph["path"]).stat().st_size,
+            "graph_written_at": graph["written_at"],
+            "stats_path": stat["path"],
+            "stats_bytes": Path(stat["path"]).stat().st_size,
+            "stats_written_at": stat["written_at"],
+        }
+        for graph, stat in zip(graphs, stats)
+    ]
+
+
+def manifest_entries(units: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Graph/stats entries of the successful units, ordered by question"""
+    entries = []
+    for unit in sorted(units, key=lambda u: u["index"]):
+        if unit["status"] != "success":
+            continue
+        for pair in unit["outputs"]:
+            entries.append({
+                "index": unit["index"],
+                "question": unit.get("question"),
+                "code_file": unit["code_file"],
+                "duration": unit["duration"],
+                **pair
+            })
+    return entries
+
+
+def write_manifest(context: RequestContext, units: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Persist the outputs of every executed code unit, ordered by question"""
+    entries = manifest_entries(units)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "request_id": context.request_id,
+        "created_at": datetime.now().isoformat(),
+        "entries": entries,
+        "units": [
+            {key: value for key, value in unit.items() if key not in ("outputs", "output")}
+            for unit in sorted(units, key=lambda u: u["index"])
+        ],
+    }
+    with open(context.manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def load_manifest(context: RequestContext) -> Dict[str, Any]:
+    """Load the manifest written by the code executor"""
+    if not context.manifest_path.exists():
+        raise DataProcessingError(f"Output manifest not found: {context.manifest_path}")
+    with open(context.manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise DataProcessingError(f"Unsupported manifest version: {manifest.get('version')}")
+    return manifest
@@ -0,0 +1,121 @@
+# services/analysis/stats_compactor.py
+import json
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from core.logging.logger import get_logger
+from services.llm.rate_limiter import CHARS_PER_TOKEN, estimate_tokens
+
+logger = get_logger(__name__)
+
+# 排序分组时优先使用的数值字段
+RANKING_KEYS = ("count", "value", "total", "sum", "mean", "frequency", "percentage")
+
+# 这些顶层字段原样保留，不参与截断
+PRESERVED_KEYS = ("question",)
+
+
+@dataclass
+class CompactStats:
+    """Prompt-ready stats text with its token estimates"""
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+def _round_float(value: float, digits: int) -> float:
+    if not math.isfinite(value) or value == 0:
+        return value
+    return float(f"{value:.{digits}g}")
+
+
+def _rank_value(item: Any) -> Optional[float]:
+    """Magnitude used to pick the top entries of a group table"""
+    if isinstance(item, bool):
+        return None
+    if isinstance(item, (int, float)):
+        return abs(item)
+    if isinstance(item, dict):
+        for key in RANKING_KEYS:
+            value = item.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return abs(value)
+    return None
+
+
+def _compact(value: Any, digits: int, max_items: int, depth: int = 0) -> Any:
+    """Round floats and keep only the top entries of long lists and group tables"""
+    if isinstance(value, float):
+        return _round_float(value, digits)
+
+    if isinstance(value, list):
+        items = value
+        if len(items) > max_items:
+            ranks = [_rank_value(item) for item in items]
+            if all(rank is not None for rank in ranks):
+                # 按数值大小保留前K项，保持原有相对顺序
+                keep = sorted(range(len(items)), key=lambda i: ranks[i], reverse=True)[:max_items]
+                items = [items[i] for i in sorted(keep)]
+            else:
+                items = items[:max_items]
+            compacted = [_compact(item, digits, max_items, depth + 1) for item in items]
+            return {"top": compacted, "omitted": len(value) - len(items), "total_items": len(value)}
+        return [_compact(item, digits, max_items, depth + 1) for item in items]
+
+    if isinstance(value, dict):
+        keys = list(value.keys())
+        # 顶层字段是统计结构本身，只截断嵌套的分组表
+        if depth > 0 and len(keys) > max_items:
+            ranks = {key: _rank_value(value[key]) for key in keys}
+            if all(rank is not None for rank in ranks.values()):
+                kept = sorted(keys, key=lambda k: ranks[k], reverse=True)[:max_items]
+                kept = [key for key in keys if key in kept]
+            else:
+                kept = keys[:max_items]
+            compacted = {key: _compact(value[key], digits, max_items, depth + 1) for key in kept}
+            compacted["_omitted_groups"] = len(keys) - len(kept)
+            return compacted
+        return {
+            key: item if key in PRESERVED_KEYS and depth == 0 else _compact(item, digits, max_items, depth + 1)
+            for key, item in value.items()
+        }
+
+    return value
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+# 统计数据压缩：去除空白、按有效数字取整、截断长分组表，并控制在token预算内
+def compact_stats(
+    stats_data: Dict[str, Any],
+    token_budget: int,
+    significant_digits: int = 4,
+    max_items: int = 10
+) -> CompactStats:
+    """Serialize stats for a prompt within a token budget"""
+    tokens_before = estimate_tokens(json.dumps(stats_data, indent=2, default=str))
+
+    # 超出预算时逐步减少保留的分组数和有效数字
+    digits, items = significant_digits, max_items
+    while True:
+        text = _dumps(_compact(stats_data, digits, items))
+        if estimate_tokens(text) <= token_budget or (items <= 1 and digits <= 2):
+            break
+        if items > 1:
+            items = max(1, items // 2)
+        else:
+            digits -= 1
+
+    if estimate_tokens(text) > token_budget:
+        # 最后手段：直接截断文本
+        text = text[:token_budget * CHARS_PER_TOKEN] + "...(truncated)"
+
+    result = CompactStats(text=text, tokens_before=tokens_before, tokens_after=estimate_tokens(text))
+    logger.info(
+        f"Compacted stats from ~{result.tokens_before} to ~{result.tokens_after} tokens "
+        f"(top {items} groups, {digits} significant digits)"
+    )
+    return result
@@ -0,0 +1,538 @@
+# services/analysis/worker_pool.py
+import errno
+import io
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+import warnings
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from typing import Any, Dict, List, Optional
+
+from core.config.constants import ExecutionOutcome
+from core.config.paths import path_config
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of running one piece of generated code in a worker"""
+    returncode: int
+    stdout: str
+    stderr: str
+    duration: float
+    worker_pid: Optional[int] = None
+    rss_bytes: int = 0
+    outcome: ExecutionOutcome = ExecutionOutcome.OK
+    output_truncated: bool = False
+    # 运行时钩子记录的输出文件：kind（graph/stats）、绝对路径、相对执行开始的写入时间
+    outputs: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def success(self) -> bool:
+        return self.returncode == 0
+
+
+@dataclass(frozen=True)
+class ExecutionLimits:
+    """Per-run resource limits enforced inside a worker"""
+    cpu_seconds: Optional[int] = None
+    memory_bytes: Optional[int] = None
+    max_file_bytes: Optional[int] = None
+    max_output_chars: int = 64 * 1024
+
+
+def _statm_bytes(index: int) -> Optional[int]:
+    """Read a field of /proc/self/statm (0 = virtual size, 1 = resident) in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[index]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _current_rss_bytes() -> int:
+    """Resident set size of the current process"""
+    rss = _statm_bytes(1)
+    if rss is not None:
+        return rss
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _CPULimitExceeded(BaseException):
+    """Raised inside a worker when a run uses up its CPU time budget"""
+
+
+class _BoundedOutput(io.StringIO):
+    """StringIO that keeps at most ``limit`` characters and drops the rest"""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.truncated = False
+
+    def write(self, s: str) -> int:
+        remaining = self.limit - self.tell()
+        if len(s) > remaining:
+            self.truncated = True
+            if remaining > 0:
+                super().write(s[:remaining])
+            return len(s)
+        return super().write(s)
+
+
+# 标记当前是否正在执行任务，CPU超限信号只在执行生成代码期间生效
+_job_running = False
+
+
+def _on_cpu_limit(signum, frame) -> None:
+    if _job_running:
+        raise _CPULimitExceeded()
+
+
+def _set_soft_limit(which: int, value: int) -> None:
+    """Lower a soft rlimit, never above the hard limit"""
+    import resource
+    try:
+        soft, hard = resource.getrlimit(which)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(which, (value, hard))
+    except (ValueError, OSError):
+        # 部分平台不支持某些限制（如macOS上的RLIMIT_AS）
+        pass
+
+
+def _apply_process_limits(limits: ExecutionLimits) -> None:
+    """Install the memory and file-size limits of a warm worker"""
+    try:
+        import resource
+    except ImportError:
+        return
+
+    if limits.max_file_bytes:
+        # 超过文件大小限制时让写入抛出EFBIG，而不是直接杀死工作进程
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        _set_soft_limit(resource.RLIMIT_FSIZE, limits.max_file_bytes)
+    if limits.memory_bytes:
+        # 地址空间上限 = 预热后的基线 + 单次执行允许的增量
+        baseline = _statm_bytes(0)
+        if baseline is not None:
+            _set_soft_limit(resource.RLIMIT_AS, baseline + limits.memory_bytes)
+    if limits.cpu_seconds:
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+
+def _arm_cpu_limit(cpu_seconds: Optional[int]) -> None:
+    """Give the next run ``cpu_seconds`` of CPU time on top of what the worker used so far"""
+    if not cpu_seconds:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _set_soft_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds)
+
+
+def _is_file_size_error(exc: BaseException) -> bool:
+    """Whether an exception (or its cause) is a write rejected by RLIMIT_FSIZE"""
+    while exc is not None:
+        if isinstance(exc, OSError) and exc.errno == errno.EFBIG:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+# 当前任务写出的图表和统计文件，由运行时钩子记录
+_job_outputs: List[Dict[str, Any]] = []
+_job_started = 0.0
+
+
+def _record_output(kind: str, target: Any) -> None:
+    if not _job_running or not isinstance(target, (str, os.PathLike)):
+        return
+    path = os.path.abspath(os.fspath(target))
+    # 同一文件被重复写入时只保留最后一次
+    _job_outputs[:] = [o for o in _job_outputs if o["path"] != path]
+    _job_outputs.append({
+        "kind": kind,
+        "path": path,
+        "written_at": round(time.perf_counter() - _job_started, 4),
+    })
+
+
+def _install_output_hooks() -> None:
+    """Record every figure saved and every JSON file dumped by generated code"""
+    import json
+    from matplotlib.figure import Figure
+
+    original_savefig = Figure.savefig
+    original_dump = json.dump
+
+    @wraps(original_savefig)
+    def savefig(self, fname, *args, **kwargs):
+        result = original_savefig(self, fname, *args, **kwargs)
+        _record_output("graph", fname)
+        return result
+
+    @wraps(original_dump)
+    def dump(obj, fp, *args, **kwargs):
+        result = original_dump(obj, fp, *args, **kwargs)
+        _record_output("stats", getattr(fp, "name", None))
+        return result
+
+    Figure.savefig = savefig
+    json.dump = dump
+
+
+def _collect_outputs(namespace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Outputs recorded by the hooks, falling back to the graph_file/stats_file variables"""
+    outputs = list(_job_outputs)
+    # 生成代码约定定义graph_file和stats_file，钩子未捕获时（如用f.write写JSON）以其为准
+    for kind, name in (("graph", "graph_file"), ("stats", "stats_file")):
+        value = namespace.get(name)
+        if not any(o["kind"] == kind for o in outputs) and isinstance(value, (str, os.PathLike)):
+            outputs.append({
+                "kind": kind,
+                "path": os.path.abspath(os.fspath(value)),
+                "written_at": round(time.perf_counter() - _job_started, 4),
+            })
+    return outputs
+
+
+# 工作进程主函数：预先导入科学计算库，然后循环执行收到的代码
+def _worker_main(conn, cwd: str, limits: ExecutionLimits) -> None:
+    """Entry point of a pre-warmed worker process"""
+    global _job_running, _job_started
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import numpy
+    import pandas
+    import seaborn  # noqa: F401
+
+    os.chdir(cwd)
+    _apply_process_limits(limits)
+    _install_output_hooks()
+    # 任务结束后恢复到的进程级状态
+    base_sys_path = list(sys.path)
+    base_warning_filters = list(warnings.filters)
+    conn.send({"type": "ready", "pid": os.getpid()})
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        stdout = _BoundedOutput(limits.max_output_chars)
+        stderr = _BoundedOutput(limits.max_output_chars)
+        error_trace = ""
+        returncode = 0
+        outcome = ExecutionOutcome.OK
+        outputs: List[Dict[str, Any]] = []
+        start = _job_started = time.perf_counter()
+        _job_outputs.clear()
+        # 每次执行使用全新的命名空间，并重置matplotlib状态，避免任务间相互影响
+        namespace: Dict[str, Any] = {"__name__": "__main__", "__file__": job["filename"]}
+        matplotlib.rcdefaults()
+        _arm_cpu_limit(limits.cpu_seconds)
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                _job_running = True
+                try:
+                    exec(compile(job["code"], job["filename"], "exec"), namespace)
+                finally:
+                    _job_running = False
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if returncode:
+                outcome = ExecutionOutcome.ERROR
+        except _CPULimitExceeded:
+            returncode = 1
+            outcome = ExecutionOutcome.CPU_LIMIT
+            error_trace = f"CPU time limit of {limits.cpu_seconds}s exceeded\n"
+        except MemoryError:
+            returncode = 1
+            outcome = ExecutionOutcome.MEMORY_LIMIT
+            error_trace = traceback.format_exc()
+        except BaseException as e:
+            returncode = 1
+            outcome = ExecutionOutcome.OUTPUT_LIMIT if _is_file_size_error(e) else ExecutionOutcome.ERROR
+            error_trace = traceback.format_exc()
+        finally:
+            plt.close("all")
+            outputs = _collect_outputs(namespace)
+            namespace.clear()
+            # 撤销生成代码对工作目录、导入路径、警告过滤器和库配置的修改
+            os.chdir(cwd)
+            sys.path[:] = base_sys_path
+            warnings.filters[:] = base_warning_filters
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                pandas.reset_option("all")
+            numpy.random.seed()
+
+        # 异常堆栈不受输出截断影响，保证修复器能拿到完整错误信息
+        conn.send({
+            "type": "result",
+            "returncode": returncode,
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue() + error_trace,
+            "duration": time.perf_counter() - start,
+            "rss_bytes": _current_rss_bytes(),
+            "outcome": outcome.value,
+            "output_truncated": stdout.truncated or stderr.truncated,
+            "outputs": outputs,
+        })
+
+
+class _Worker:
+    """Handle on a single worker process"""
+
+    def __init__(self, ctx, cwd: str, limits: ExecutionLimits):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, cwd, limits), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_run = 0
+        self.ready = False
+
+    def wait_ready(self, timeout: float) -> None:
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            raise RuntimeError("Worker process did not start in time")
+        message = self.conn.recv()
+        self.ready = message.get("type") == "ready"
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=2)
+        self.conn.close()
+
+
+def _crash_outcome(exitcode: Optional[int]) -> ExecutionOutcome:
+    """Best guess of why a worker died from its exit code (read before the pool stops it)"""
+    if exitcode == -signal.SIGKILL:
+        # 未经本进程池杀死的SIGKILL通常来自系统OOM killer
+        return ExecutionOutcome.MEMORY_LIMIT
+    if exitcode == -signal.SIGXCPU:
+        return ExecutionOutcome.CPU_LIMIT
+    if exitcode == -signal.SIGXFSZ:
+        return ExecutionOutcome.OUTPUT_LIMIT
+    return ExecutionOutcome.CRASHED
+
+
+# 常驻工作进程池：避免每次执行都重新启动解释器并导入pandas/matplotlib等库
+class WarmWorkerPool:
+    """Pool of long-lived Python workers with the scientific stack pre-imported"""
+
+    def __init__(
+        self,
+        size: int,
+        max_jobs_per_worker: int,
+        max_rss_bytes: int,
+        timeout: Optional[float] = None,
+        limits: Optional[ExecutionLimits] = None,
+        startup_timeout: float = 120.0
+    ):
+        self.size = max(1, size)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_bytes = max_rss_bytes
+        self.timeout = timeout
+        self.limits = limits or ExecutionLimits()
+        self.startup_timeout = startup_timeout
+        self.cwd = str(path_config.BASE_DIR)
+
+        # 使用spawn启动，避免在多线程的服务进程中fork
+        self._ctx = multiprocessing.get_context("spawn")
+        # 空位（None）表示补充工作进程失败，由下一次run()重新启动
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.jobs_completed = 0
+        self.workers_recycled = 0
+        self.limit_hits: Dict[str, int] = {}
+
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        logger.info(f"Started warm worker pool with {self.size} worker(s)")
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self.cwd, self.limits)
+
+    def _replace(self, worker: _Worker, reason: str, kill: bool = False) -> Optional[_Worker]:
+        """Stop a worker and start a fresh one in its place (None if the new one failed to start)"""
+        logger.info(f"Recycling worker {worker.process.pid}: {reason}")
+        worker.stop(kill=kill)
+        with self._lock:
+            self.workers_recycled += 1
+        try:
+            return self._spawn()
+        except Exception as e:
+            # 保留空位，避免进程池永久缩小
+            logger.error(f"Failed to start replacement worker, will retry on next run: {str(e)}")
+            return None
+
+    def _acquire(self) -> _Worker:
+        """Take an idle worker, starting one in place of an empty slot"""
+        worker = self._idle.get()
+        if worker is not None:
+            return worker
+        try:
+            return self._spawn()
+        except Exception as e:
+            self._idle.put(None)
+            raise RuntimeError(f"Could not start a worker process: {str(e)}") from e
+
+    def _record(self, outcome: ExecutionOutcome) -> None:
+        with self._lock:
+            self.jobs_completed += 1
+            if outcome not in (ExecutionOutcome.OK, ExecutionOutcome.ERROR):
+                self.limit_hits[outcome.value] = self.limit_hits.get(outcome.value, 0) + 1
+
+    def run(self, code: str, filename: str = "<generated>", timeout: Optional[float] = None) -> ExecutionResult:
+        """Execute code in an idle worker, blocking until a worker is free"""
+        if self._closed:
+            raise RuntimeError("Worker pool has been shut down")
+
+        timeout = timeout if timeout is not None else self.timeout
+        worker = self._acquire()
+        pid = worker.process.pid
+        start = time.perf_counter()
+        started = False
+        try:
+            worker.wait_ready(self.startup_timeout)
+            started = True
+            start = time.perf_counter()
+            worker.conn.send({"code": code, "filename": filename})
+            if timeout is not None and not worker.conn.poll(timeout):
+                # 超时：直接杀死工作进程并补充新的进程
+                self._idle.put(self._replace(worker, f"timed out after {timeout:.0f}s", kill=True))
+                self._record(ExecutionOutcome.TIMEOUT)
+                return ExecutionResult(
+                    returncode=-signal.SIGKILL,
+                    stdout="",
+                    stderr=f"Execution timed out after {timeout:.0f}s and was killed",
+                    duration=time.perf_counter() - start,
+                    worker_pid=pid,
+                    outcome=ExecutionOutcome.TIMEOUT
+                )
+            message = worker.conn.recv()
+        except (EOFError, OSError, RuntimeError) as e:
+            # 工作进程异常退出（如被系统杀死），替换后返回失败结果；
+            # 退出码须在本进程池停止它之前读取，否则会把自己发出的SIGKILL误判为OOM
+            if started:
+                worker.process.join(timeout=1)
+                exitcode = worker.process.exitcode
+                outcome = _crash_outcome(exitcode)
+            else:
+                # 启动失败时代码从未执行，不能归因于资源超限
+                exitcode = None
+                outcome = ExecutionOutcome.CRASHED
+            self._idle.put(self._replace(worker, f"crashed ({e})", kill=not started))
+            self._record(outcome)
+            return ExecutionResult(
+                returncode=exitcode if exitcode not in (None, 0) else 1,
+                stdout="",
+                stderr=f"Worker process terminated unexpectedly (exit code {exitcode}): {e}",
+                duration=time.perf_counter() - start,
+                worker_pid=pid,
+                outcome=outcome
+            )
+
+        worker.jobs_run += 1
+        result = ExecutionResult(
+            returncode=message["returncode"],
+            stdout=message["stdout"],
+            stderr=message["stderr"],
+            duration=message["duration"],
+            worker_pid=pid,
+            rss_bytes=message["rss_bytes"],
+            outcome=ExecutionOutcome(message["outcome"]),
+            output_truncated=message["output_truncated"],
+            outputs=message["outputs"]
+        )
+        self._record(result.outcome)
+
+        # 执行次数、内存增长超限或触发资源限制时回收工作进程
+        if result.outcome in (ExecutionOutcome.MEMORY_LIMIT, ExecutionOutcome.CPU_LIMIT):
+            worker = self._replace(worker, f"hit {result.outcome.value}")
+        elif worker.jobs_run >= self.max_jobs_per_worker:
+            worker = self._replace(worker, f"reached {worker.jobs_run} jobs")
+        elif result.rss_bytes > self.max_rss_bytes:
+            worker = self._replace(worker, f"RSS {result.rss_bytes / (1024 * 1024):.0f}MB over limit")
+        self._idle.put(worker)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            limit_hits = dict(self.limit_hits)
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "jobs_completed": self.jobs_completed,
+            "workers_recycled": self.workers_recycled,
+            "limit_hits": limit_hits,
+        }
+
+    def shutdown(self) -> None:
+        """Stop all idle workers"""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+
+@lru_cache()
+def get_worker_pool() -> WarmWorkerPool:
+    """Process-wide warm worker pool, started on first use"""
+    settings = get_settings()
+    pool = WarmWorkerPool(
+        size=settings.EXECUTOR_POOL_SIZE,
+        max_jobs_per_worker=settings.EXECUTOR_MAX_JOBS_PER_WORKER,
+        max_rss_bytes=settings.EXECUTOR_MAX_WORKER_RSS_MB * 1024 * 1024,
+        timeout=settings.EXECUTOR_TIMEOUT_SECONDS,
+        limits=ExecutionLimits(
+            cpu_seconds=settings.EXECUTOR_CPU_LIMIT_SECONDS,
+            memory_bytes=settings.EXECUTOR_MEMORY_LIMIT_MB * 1024 * 1024,
+            max_file_bytes=settings.EXECUTOR_MAX_FILE_MB * 1024 * 1024,
+            max_output_chars=settings.EXECUTOR_MAX_OUTPUT_CHARS
+        )
+    )
+    metrics_registry.register("worker_pool", pool.stats)
+    return pool
+
+
+def shutdown_worker_pool() -> None:
+    """Stop the worker pool if it was started"""
+    if get_worker_pool.cache_info().currsize:
+        get_worker_pool().shutdown()
@@ -0,0 +1,101 @@
+# services/data/dataset_profiler.py
+import json
+import warnings
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+from core.logging.logger import get_logger, log_execution
+from core.request_context import RequestContext
+from domain.exceptions.custom import DataProcessingError
+from services.data.dataset_upload import load_upload_info
+
+logger = get_logger(__name__)
+
+# profile.json结构版本，字段变化时递增
+PROFILE_VERSION = 1
+
+# 布尔列可识别的取值
+BOOLEAN_VALUES = {"true", "false", "yes", "no", "t", "f", "y", "n"}
+
+
+def _infer_column_dtype(series: pd.Series) -> str:
+    """Infer a dtype for a sampled column, looking past pandas' generic object dtype"""
+    if series.dtype != object:
+        return str(series.dtype)
+
+    values = series.dropna().astype(str).str.strip()
+    if values.empty:
+        return "object"
+
+    # 布尔值（true/false、yes/no等）
+    if values.str.lower().isin(BOOLEAN_VALUES).all():
+        return "bool"
+
+    # 数值（允许少量脏数据）
+    numeric = pd.to_numeric(values.str.replace(",", "", regex=False), errors="coerce")
+    if numeric.notna().mean() >= 0.95:
+        return "int64" if (numeric.dropna() % 1 == 0).all() else "float64"
+
+    # 日期时间
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+    if parsed.notna().mean() >= 0.95:
+        return "datetime64[ns]"
+
+    return "object"
+
+
+# 数据集画像：只读取有限行样本，生成代码生成提示所需的列名、样例数据和类型
+@log_execution
+def profile_dataset(data_path: Path, sample_rows: int, total_rows: Optional[int] = None) -> Dict[str, Any]:
+    """Build a prompt-ready profile of a CSV from a bounded sample"""
+    try:
+        sample = pd.read_csv(data_path, nrows=sample_rows, low_memory=False)
+        if not len(sample.columns):
+            raise DataProcessingError("Dataset has no columns")
+
+        d_types = {column: _infer_column_dtype(sample[column]) for column in sample.columns}
+        return {
+            "version": PROFILE_VERSION,
+            "data_path": str(data_path),
+            "columns": sample.columns.tolist(),
+            "dtypes": d_types,
+            # 与原先 str(df.head()) 的提示格式保持一致
+            "head_text": str(sample.head()),
+            "sample_rows": len(sample),
+            "total_rows": total_rows if total_rows is not None else len(sample),
+            "null_counts": {column: int(count) for column, count in sample.isna().sum().items()},
+        }
+    except DataProcessingError:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to profile dataset {data_path}: {str(e)}")
+        raise DataProcessingError(f"Failed to profile dataset: {str(e)}")
+
+
+def save_profile(context: RequestContext, profile: Dict[str, Any]) -> None:
+    """Persist the dataset profile in the request directory"""
+    with open(context.profile_path, "w") as f:
+        json.dump(profile, f, indent=2, default=str)
+
+
+def load_or_create_profile(context: RequestContext, sample_rows: int) -> Dict[str, Any]:
+    """Load the stored profile, rebuilding it if missing or stale"""
+    if context.profile_path.exists():
+        with open(context.profile_path, "r") as f:
+            profile = json.load(f)
+        if profile.get("version") == PROFILE_VERSION \
+                and profile.get("data_path") == str(context.data_path):
+            return profile
+
+    upload_info = load_upload_info(context.upload_info_path)
+    profile = profile_dataset(
+        context.data_path,
+        sample_rows,
+        total_rows=upload_info.rows if upload_info else None
+    )
+    save_profile(context, profile)
+    return profile
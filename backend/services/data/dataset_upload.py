@@ -0,0 +1,246 @@
+# services/data/dataset_upload.py
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import aiofiles
+from fastapi import Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from core.logging.logger import get_logger
+from domain.exceptions.custom import FileTooLargeError, ValidationError
+
+logger = get_logger(__name__)
+
+# multipart边界和各部分头信息的额外开销上限，用于Content-Length预检查
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+@dataclass
+class UploadResult:
+    """Summary of a dataset that was streamed to disk"""
+    filename: str
+    path: str
+    size_bytes: int
+    sha256: str
+    rows: int
+
+
+# CSV行计数器：按块统计换行符，忽略引号内的换行
+class CSVRowCounter:
+    """Counts CSV records incrementally, ignoring newlines inside quoted fields"""
+
+    def __init__(self):
+        self._newlines = 0
+        self._in_quotes = False
+        self._last_byte = b""
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        if b'"' not in chunk:
+            # 快速路径：没有引号时直接统计
+            if not self._in_quotes:
+                self._newlines += chunk.count(b"\n")
+        else:
+            # 以引号切分，偶数段（相对当前状态）位于引号外
+            for i, segment in enumerate(chunk.split(b'"')):
+                if i > 0:
+                    self._in_quotes = not self._in_quotes
+                if not self._in_quotes:
+                    self._newlines += segment.count(b"\n")
+        self._last_byte = chunk[-1:]
+
+    @property
+    def rows(self) -> int:
+        """Number of data rows, excluding the header line"""
+        records = self._newlines
+        if self._last_byte and self._last_byte != b"\n":
+            records += 1  # 最后一行没有换行符
+        return max(records - 1, 0)
+
+
+# 流式上传接收器：边接收边写盘，超过大小限制立即中止
+class DatasetUploadStream:
+    """Streams a multipart dataset upload to disk in fixed-size chunks"""
+
+    def __init__(
+        self,
+        destination_dir: Path,
+        max_size: int,
+        allowed_extensions: List[str],
+        chunk_size: int,
+        field_name: str = "file"
+    ):
+        self.destination_dir = destination_dir
+        self.max_size = max_size
+        self.allowed_extensions = [ext.lower() for ext in allowed_extensions]
+        self.chunk_size = chunk_size
+        self.field_name = field_name
+
+        # multipart解析状态（由同步回调更新）
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._in_target_part = False
+        self._pending: List[bytes] = []
+        self._filename: Optional[str] = None
+        self._part_finished = False
+
+        # 写盘状态
+        self._file = None
+        self._path: Optional[Path] = None
+        self._buffer = bytearray()
+        self._size = 0
+        self._hasher = hashlib.sha256()
+        self._rows = CSVRowCounter()
+
+    # ---- multipart回调（同步，只记录状态，真正的写盘在receive中异步完成） ----
+    def _on_part_begin(self) -> None:
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        self._in_target_part = (
+            name == self.field_name and b"filename" in options and self._filename is None
+        )
+        if self._in_target_part:
+            self._filename = options[b"filename"].decode("utf-8", errors="replace")
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_target_part:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._in_target_part:
+            self._part_finished = True
+            self._in_target_part = False
+
+    # ---- 异步处理 ----
+    def _validate_filename(self, filename: str) -> str:
+        """Strip directories and check the extension of the uploaded file name"""
+        safe_name = Path(filename).name
+        if not safe_name:
+            raise ValidationError("Uploaded file has no name")
+        if Path(safe_name).suffix.lower() not in self.allowed_extensions:
+            raise ValidationError(
+                f"Unsupported file type '{Path(safe_name).suffix}'. "
+                f"Allowed: {', '.join(self.allowed_extensions)}"
+            )
+        return safe_name
+
+    async def _flush(self, force: bool = False) -> None:
+        """Write buffered bytes to disk once a full chunk is available"""
+        while len(self._buffer) >= self.chunk_size or (force and self._buffer):
+            chunk = bytes(self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+            await self._file.write(chunk)
+
+    async def _consume_pending(self) -> None:
+        """Hash, count and buffer the data collected by the parser callbacks"""
+        if self._filename is not None and self._file is None:
+            self._path = self.destination_dir / self._validate_filename(self._filename)
+            self._file = await aiofiles.open(self._path, "wb")
+
+        for data in self._pending:
+            self._size += len(data)
+            if self._size > self.max_size:
+                raise FileTooLargeError(
+                    f"Upload exceeds the maximum size of {self.max_size / (1024 * 1024):.1f}MB"
+                )
+            self._hasher.update(data)
+            self._rows.feed(data)
+            self._buffer.extend(data)
+        self._pending.clear()
+        await self._flush()
+
+    async def receive(self, request: Request) -> UploadResult:
+        """Consume the request body and return the stored file summary"""
+        content_type = request.headers.get("content-type", "")
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValidationError("Expected a multipart/form-data upload")
+
+        # 预检查：Content-Length明显超限时，不读取请求体直接拒绝
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() \
+                and int(content_length) > self.max_size + MULTIPART_OVERHEAD:
+            raise FileTooLargeError(
+                f"Upload exceeds the maximum size of {self.max_size / (1024 * 1024):.1f}MB"
+            )
+
+        parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                await self._consume_pending()
+            parser.finalize()
+            await self._consume_pending()
+
+            if self._file is None or not self._part_finished:
+                raise ValidationError(f"No file provided in form field '{self.field_name}'")
+            await self._flush(force=True)
+        except Exception:
+            # 中止时删除已写入的部分文件
+            await self._close()
+            if self._path and self._path.exists():
+                self._path.unlink()
+            raise
+        await self._close()
+
+        result = UploadResult(
+            filename=self._path.name,
+            path=str(self._path),
+            size_bytes=self._size,
+            sha256=self._hasher.hexdigest(),
+            rows=self._rows.rows,
+        )
+        logger.info(
+            f"Stored upload {result.filename}: {result.size_bytes} bytes, "
+            f"{result.rows} rows, sha256={result.sha256[:12]}"
+        )
+        return result
+
+    async def _close(self) -> None:
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+
+def write_upload_info(info_path: Path, result: UploadResult) -> None:
+    """Persist the upload summary next to the request data"""
+    with open(info_path, "w") as f:
+        json.dump(asdict(result), f, indent=2)
+
+
+def load_upload_info(info_path: Path) -> Optional[UploadResult]:
+    """Load a previously stored upload summary, if any"""
+    if not info_path.exists():
+        return None
+    with open(info_path, "r") as f:
+        return UploadResult(**json.load(f))
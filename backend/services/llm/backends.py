@@ -0,0 +1,286 @@
+# services/llm/backends.py
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from core.config.constants import LLMBackend
+from core.config.paths import path_config
+from core.config.settings import Settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+from services.llm.fake_server import start_fake_server
+from services.llm.rate_limiter import estimate_tokens
+from services.llm.synthetic import LatencyDistribution, synthesize_response
+
+logger = get_logger(__name__)
+
+# 提示中与单次请求相关的部分，计算录制键前替换为占位符，回放时再换回当前请求的值
+REQUEST_ID_PATTERN = re.compile(r"request_\d{8}_\d{6}_[0-9a-f]{8}")
+RESPONSE_DIR_PLACEHOLDER = "{{RESPONSE_DIR}}"
+REQUEST_ID_PLACEHOLDER = "{{REQUEST_ID}}"
+
+# 录制文件格式版本
+CASSETTE_VERSION = 1
+
+
+class CassetteMissError(LookupError):
+    """Replay found no recorded response for a prompt"""
+
+
+def _normalize(text: str) -> str:
+    text = text.replace(str(path_config.RESPONSE_DIR), RESPONSE_DIR_PLACEHOLDER)
+    return REQUEST_ID_PATTERN.sub(REQUEST_ID_PLACEHOLDER, text)
+
+
+def _denormalize(text: str, request_id: Optional[str]) -> str:
+    text = text.replace(RESPONSE_DIR_PLACEHOLDER, str(path_config.RESPONSE_DIR))
+    return text.replace(REQUEST_ID_PLACEHOLDER, request_id) if request_id else text
+
+
+def _message_parts(messages: List[BaseMessage]) -> Tuple[List[str], List[bytes]]:
+    """Text parts and image payloads of a chat request"""
+    texts, images = [], []
+    for message in messages:
+        parts = [message.content] if isinstance(message.content, str) else message.content
+        for part in parts:
+            if isinstance(part, str):
+                texts.append(part)
+            elif part.get("type") == "text":
+                texts.append(part["text"])
+            else:
+                data = part.get("data", b"")
+                images.append(data if isinstance(data, bytes) else str(data).encode("utf-8"))
+    return texts, images
+
+
+def prompt_key(model_name: str, messages: List[BaseMessage]) -> Tuple[str, Optional[str]]:
+    """Cassette key of a prompt, and the request ID it mentions (if any)"""
+    texts, images = _message_parts(messages)
+    request_ids = REQUEST_ID_PATTERN.findall("\n".join(texts))
+    canonical = json.dumps({
+        "model": model_name,
+        "roles": [message.type for message in messages],
+        "texts": [_normalize(text) for text in texts],
+        "images": [hashlib.sha256(image).hexdigest() for image in images],
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), (request_ids[0] if request_ids else None)
+
+
+# 录制文件存储：每个提示哈希一个JSON文件，按哈希前两位分目录
+class CassetteStore:
+    """Recorded LLM responses on disk, keyed by prompt hash"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.path_for(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable cassette {path.name}: {str(e)}")
+            return None
+
+    def append(self, key: str, entry: Dict[str, Any], preview: str) -> None:
+        """Add a recorded response; repeated prompts keep every response for round-robin replay"""
+        with self._lock:
+            cassette = self.load(key) or {"version": CASSETTE_VERSION, "key": key, "preview": preview, "responses": []}
+            cassette["responses"].append(entry)
+            path = self.path_for(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # 先写临时文件再替换，避免中断时留下半个文件
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cassette, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+
+    def count(self) -> int:
+        return sum(1 for _ in self.directory.glob("*/*.json"))
+
+
+# 录制模式：调用真实模型，并把响应保存为录制文件
+class RecordingLLM:
+    """Wraps a live chat model and saves each response to a cassette"""
+
+    def __init__(self, llm: Any, store: CassetteStore, model_name: str):
+        self.llm = llm
+        self.store = store
+        self.model_name = model_name
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        key, _ = prompt_key(self.model_name, messages)
+        start = time.perf_counter()
+        response = self.llm.invoke(messages)
+        latency = time.perf_counter() - start
+        texts, _ = _message_parts(messages)
+        self.store.append(key, {
+            "content": _normalize(response.content) if isinstance(response.content, str) else response.content,
+            "usage_metadata": dict(response.usage_metadata or {}),
+            "latency": round(latency, 4),
+            "recorded_at": datetime.now().isoformat(),
+        }, preview=_normalize("\n".join(texts))[:500])
+        with self._lock:
+            self.recorded += 1
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": LLMBackend.RECORD.value, "recorded": self.recorded, "cassette_dir": str(self.store.directory)}
+
+
+# 回放模式：只读录制文件，不访问网络；按配置的分布模拟响应延迟
+class ReplayLLM:
+    """Serves recorded responses with synthetic latency"""
+
+    def __init__(
+        self,
+        store: CassetteStore,
+        model_name: str,
+        latency: LatencyDistribution,
+        synthesize_misses: bool = True,
+        seed: Optional[int] = None
+    ):
+        self.store = store
+        self.model_name = model_name
+        self.latency = latency
+        self.synthesize_misses = synthesize_misses
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cursor: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.simulated_latency = 0.0
+
+    def _next_entry(self, key: str) -> Optional[Dict[str, Any]]:
+        cassette = self.store.load(key)
+        if not cassette or not cassette.get("responses"):
+            return None
+        with self._lock:
+            # 同一提示录制了多个响应时依次轮流返回
+            position = self._cursor.get(key, 0)
+            self._cursor[key] = position + 1
+        responses = cassette["responses"]
+        return responses[position % len(responses)]
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        key, request_id = prompt_key(self.model_name, messages)
+        entry = self._next_entry(key)
+        if entry is None:
+            if not self.synthesize_misses:
+                raise CassetteMissError(f"No recorded response for prompt {key[:12]}")
+            # 未录制的提示（如合成数据集）生成结构合法的替代响应
+            texts, images = _message_parts(messages)
+            content = synthesize_response(texts)
+            prompt_tokens = estimate_tokens("".join(texts), images=len(images))
+            entry = {
+                "content": content,
+                "usage_metadata": {
+                    "input_tokens": prompt_tokens,
+                    "output_tokens": estimate_tokens(content),
+                    "total_tokens": prompt_tokens + estimate_tokens(content)
+                },
+                "latency": None,
+            }
+            hit = False
+        else:
+            hit = True
+
+        with self._lock:
+            delay = self.latency.sample(self._rng, recorded=entry.get("latency"))
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.simulated_latency += delay
+        if delay > 0:
+            time.sleep(delay)
+
+        content = entry["content"]
+        if isinstance(content, str):
+            content = _denormalize(content, request_id)
+        return AIMessage(content=content, usage_metadata=entry.get("usage_metadata") or None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": LLMBackend.REPLAY.value,
+                "hits": self.hits,
+                "misses": self.misses,
+                "simulated_latency_seconds": round(self.simulated_latency, 3),
+                "latency": self.latency.kind,
+            }
+
+
+def build_live_client(settings: Settings, endpoint: Optional[str] = None, api_key: Optional[str] = None) -> ChatGoogleGenerativeAI:
+    """Gemini chat client; retries are left to the gateway"""
+    # 注意：langchain-google-genai的同步调用路径内部固定再重试一次，max_retries无法关闭
+    model_settings = {key: value for key, value in settings.MODEL_SETTINGS.items() if key != "max_retries"}
+    options = {}
+    if endpoint:
+        # 指向本地假服务时使用REST传输（gRPC客户端不支持http地址）
+        options = {"transport": "rest", "client_options": {"api_endpoint": endpoint}}
+    return ChatGoogleGenerativeAI(
+        model=settings.GEMINI_MODEL_NAME,
+        google_api_key=api_key or settings.GOOGLE_API_KEY,
+        convert_system_message_to_human=True,
+        max_retries=1,
+        **options,
+        **model_settings
+    )
+
+
+def _cassette_store(settings: Settings) -> CassetteStore:
+    return CassetteStore(Path(settings.LLM_CASSETTE_DIR) if settings.LLM_CASSETTE_DIR else path_config.CACHE_DIR / "cassettes")
+
+
+# 按配置选择大模型后端：真实调用、录制、回放或本地假服务
+def build_chat_backend(settings: Settings) -> Any:
+    """Chat model used by the gateway; anything with ``invoke(messages) -> AIMessage`` works"""
+    backend = LLMBackend(settings.LLM_BACKEND)
+    if backend == LLMBackend.LIVE:
+        return build_live_client(settings)
+
+    latency = LatencyDistribution.parse(settings.LLM_SYNTHETIC_LATENCY)
+    if backend == LLMBackend.RECORD:
+        store = _cassette_store(settings)
+        logger.info(f"Recording LLM responses to {store.directory}")
+        llm = RecordingLLM(build_live_client(settings), store, settings.GEMINI_MODEL_NAME)
+    elif backend == LLMBackend.REPLAY:
+        store = _cassette_store(settings)
+        logger.info(f"Replaying LLM responses from {store.directory} ({store.count()} cassette(s))")
+        llm = ReplayLLM(
+            store,
+            settings.GEMINI_MODEL_NAME,
+            latency,
+            synthesize_misses=settings.LLM_REPLAY_ON_MISS == "synthesize"
+        )
+    else:
+        endpoint = settings.LLM_FAKE_SERVER_URL
+        if not endpoint:
+            server = start_fake_server(latency, error_rate=settings.LLM_FAKE_ERROR_RATE)
+            metrics_registry.register("llm_fake_server", server.stats)
+            endpoint = server.url
+        logger.info(f"Using fake Gemini server at {endpoint}")
+        return build_live_client(settings, endpoint=endpoint, api_key=settings.GOOGLE_API_KEY or "fake")
+
+    metrics_registry.register("llm_backend", llm.stats)
+    return llm
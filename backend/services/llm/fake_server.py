@@ -0,0 +1,174 @@
+# services/llm/fake_server.py
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from core.logging.logger import get_logger
+from services.llm.rate_limiter import estimate_tokens
+from services.llm.synthetic import LatencyDistribution, synthesize_response
+
+logger = get_logger(__name__)
+
+# 注入错误时返回的状态码和Gemini风格的错误状态
+INJECTED_ERRORS = ((429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota)."),
+                   (503, "UNAVAILABLE", "The service is currently unavailable."))
+
+
+def _read_parts(body: Dict[str, Any]) -> Tuple[List[str], int]:
+    """Text parts and image count of a generateContent request body"""
+    texts, images = [], 0
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+            elif "inlineData" in part or "inline_data" in part:
+                images += 1
+    return texts, images
+
+
+class _GeminiHandler(BaseHTTPRequestHandler):
+    """Answers ``POST /v1beta/models/<model>:generateContent`` like the Gemini REST API"""
+    # 保持长连接，与真实客户端的连接复用行为一致
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        if not urlsplit(self.path).path.endswith(":generateContent"):
+            self._send_json(404, {"error": {"code": 404, "message": f"Unsupported path {self.path}", "status": "NOT_FOUND"}})
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON body", "status": "INVALID_ARGUMENT"}})
+            return
+
+        server: FakeGeminiServer = self.server
+        error = server.next_error()
+        time.sleep(server.next_latency())
+        if error is not None:
+            code, status, message = error
+            self._send_json(code, {"error": {"code": code, "message": message, "status": status}})
+            return
+
+        texts, images = _read_parts(body)
+        text = synthesize_response(texts)
+        prompt_tokens = estimate_tokens("".join(texts), images=images)
+        output_tokens = estimate_tokens(text)
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"parts": [{"text": text}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }],
+            "usageMetadata": {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": output_tokens,
+                "totalTokenCount": prompt_tokens + output_tokens
+            }
+        })
+
+    def log_message(self, format, *args):
+        logger.debug(f"Fake Gemini server: {format % args}")
+
+
+# 本地假Gemini服务：使用真实客户端（REST传输）访问，用于无网络环境下的压测
+class FakeGeminiServer(ThreadingHTTPServer):
+    """Threaded HTTP server speaking the subset of the Gemini REST API the backend uses"""
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        latency: LatencyDistribution,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None
+    ):
+        super().__init__(address, _GeminiHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.injected_errors = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_latency(self) -> float:
+        with self._lock:
+            return self.latency.sample(self._rng)
+
+    def next_error(self) -> Optional[Tuple[int, str, str]]:
+        """Error to inject into this request, if any"""
+        with self._lock:
+            self.requests += 1
+            if self.error_rate <= 0 or self._rng.random() >= self.error_rate:
+                return None
+            self.injected_errors += 1
+            return self._rng.choice(INJECTED_ERRORS)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "url": self.url,
+                "requests": self.requests,
+                "injected_errors": self.injected_errors,
+            }
+
+
+def start_fake_server(
+    latency: LatencyDistribution,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    error_rate: float = 0.0,
+    seed: Optional[int] = None
+) -> FakeGeminiServer:
+    """Start a fake server on a daemon thread; port 0 picks a free port"""
+    server = FakeGeminiServer((host, port), latency, error_rate=error_rate, seed=seed)
+    threading.Thread(target=server.serve_forever, name="fake-gemini-server", daemon=True).start()
+    logger.info(f"Fake Gemini server listening on {server.url}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Gemini responses for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="none", help="e.g. none, fixed:0.5, uniform:0.2,1.0, lognormal:1.2,0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 429/503")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(
+        (args.host, args.port),
+        LatencyDistribution.parse(args.latency),
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    print(f"Fake Gemini server listening on {server.url} (set LLM_BACKEND=fake_server LLM_FAKE_SERVER_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
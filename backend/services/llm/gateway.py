@@ -0,0 +1,269 @@
+# services/llm/gateway.py
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+from domain.exceptions.custom import LLMServiceError
+from services.llm.backends import build_chat_backend
+from services.llm.rate_limiter import (
+    AdaptiveRateLimiter,
+    estimate_tokens,
+    get_rate_limiter,
+    is_rate_limit_error
+)
+
+logger = get_logger(__name__)
+
+# 可重试的瞬时错误（超时、服务不可用等）
+RETRYABLE_MARKERS = ("timeout", "timed out", "deadline", "unavailable", "503", "500", "internal", "connection reset")
+
+# 每个操作保留的最近延迟样本数，用于计算分位数
+LATENCY_SAMPLES = 500
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Whether a failed call is worth retrying"""
+    if is_rate_limit_error(error):
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in RETRYABLE_MARKERS)
+
+
+def estimate_message_tokens(messages: List[BaseMessage]) -> int:
+    """Estimated prompt tokens of a chat request, counting each image part"""
+    text, images = "", 0
+    for message in messages:
+        if isinstance(message.content, str):
+            text += message.content
+            continue
+        for part in message.content:
+            if isinstance(part, str):
+                text += part
+            elif part.get("type") == "text":
+                text += part["text"]
+            else:
+                images += 1
+    return estimate_tokens(text, images=images)
+
+
+# 熔断器：连续失败达到阈值后在冷却期内直接拒绝调用，冷却结束后放行一次试探请求
+class CircuitBreaker:
+    """Closed / open / half-open breaker around the LLM provider"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        # 半开状态下是否已有一个试探调用在途
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise if the breaker is open; let exactly one trial call through once it cools down"""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    raise LLMServiceError("circuit breaker is open after repeated provider failures")
+                self.state = "half_open"
+            elif self.state != "half_open":
+                return
+            # 试探调用结束前，其余调用继续被拒绝
+            if self.trial_in_flight:
+                raise LLMServiceError("circuit breaker is half-open and a trial call is in progress")
+            self.trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.error(f"LLM circuit breaker opened after {self.failures} failure(s)")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_inconclusive(self) -> None:
+        """A call ended without telling whether the provider recovered (e.g. it was throttled)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class _OperationStats:
+    """Latency and token counters of one kind of LLM call"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+
+# 大模型网关：进程内共享一个客户端（长连接复用），统一处理限流、超时、带抖动的重试、熔断和指标
+class LLMGateway:
+    """Single entry point for every LLM call made by the backend"""
+
+    def __init__(
+        self,
+        llm: Any,
+        rate_limiter: AdaptiveRateLimiter,
+        breaker: CircuitBreaker,
+        max_retries: int,
+        retry_base_delay: float,
+        retry_max_delay: float
+    ):
+        self.llm = llm
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        self.max_retries = max(1, max_retries)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._stats: Dict[str, _OperationStats] = {}
+        self._lock = threading.Lock()
+
+    def _operation(self, name: str) -> _OperationStats:
+        with self._lock:
+            return self._stats.setdefault(name, _OperationStats())
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    def _record_usage(self, stats: _OperationStats, response: Any, latency: float) -> None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        with self._lock:
+            stats.calls += 1
+            stats.latencies.append(latency)
+            stats.input_tokens += usage.get("input_tokens", 0)
+            stats.output_tokens += usage.get("output_tokens", 0)
+
+    def _call_once(self, messages: List[BaseMessage], stats: _OperationStats) -> AIMessage:
+        self.breaker.before_call()
+        start = time.perf_counter()
+        try:
+            response = self.llm.invoke(messages)
+        except Exception as e:
+            with self._lock:
+                stats.errors += 1
+            if is_rate_limit_error(e):
+                self.rate_limiter.record_throttle()
+                self.breaker.record_inconclusive()
+            elif is_retryable_error(e):
+                # 限流不代表服务故障，只有超时和服务端错误计入熔断
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_inconclusive()
+            raise
+        self._record_usage(stats, response, time.perf_counter() - start)
+        self.breaker.record_success()
+        self.rate_limiter.record_success()
+        return response
+
+    def invoke(self, messages: List[BaseMessage], operation: str = "default") -> AIMessage:
+        """Send a chat request, blocking; retries transient failures with jitter"""
+        stats = self._operation(operation)
+        tokens = estimate_message_tokens(messages)
+        for attempt in range(self.max_retries):
+            self.rate_limiter.acquire_sync(tokens)
+            try:
+                return self._call_once(messages, stats)
+            except LLMServiceError:
+                raise
+            except Exception as e:
+                if attempt + 1 >= self.max_retries or not is_retryable_error(e):
+                    raise
+                with self._lock:
+                    stats.retries += 1
+                delay = self._backoff(attempt)
+                logger.warning(f"LLM call '{operation}' failed ({str(e)[:200]}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    async def ainvoke(self, messages: List[BaseMessage], operation: str = "default") -> AIMessage:
+        """Async variant of invoke"""
+        # 共享的同步客户端可在任意事件循环中使用（每个后台任务都有自己的事件循环），
+        # 阻塞调用放到线程中执行，避免占用事件循环
+        stats = self._operation(operation)
+        tokens = estimate_message_tokens(messages)
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire(tokens)
+            try:
+                return await asyncio.to_thread(self._call_once, messages, stats)
+            except LLMServiceError:
+                raise
+            except Exception as e:
+                if attempt + 1 >= self.max_retries or not is_retryable_error(e):
+                    raise
+                with self._lock:
+                    stats.retries += 1
+                delay = self._backoff(attempt)
+                logger.warning(f"LLM call '{operation}' failed ({str(e)[:200]}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = {name: stats.snapshot() for name, stats in self._stats.items()}
+        return {
+            "circuit_breaker": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "times_opened": self.breaker.times_opened,
+            },
+            "operations": operations,
+        }
+
+
+@lru_cache()
+def get_llm_gateway() -> LLMGateway:
+    """Process-wide LLM gateway, created on first use"""
+    settings = get_settings()
+    gateway = LLMGateway(
+        llm=build_chat_backend(settings),
+        rate_limiter=get_rate_limiter(),
+        breaker=CircuitBreaker(
+            failure_threshold=settings.LLM_BREAKER_FAILURE_THRESHOLD,
+            reset_seconds=settings.LLM_BREAKER_RESET_SECONDS
+        ),
+        max_retries=settings.MODEL_SETTINGS.get("max_retries", 3),
+        retry_base_delay=settings.LLM_RETRY_BASE_DELAY,
+        retry_max_delay=settings.LLM_RETRY_MAX_DELAY
+    )
+    metrics_registry.register("llm_gateway", gateway.stats)
+    return gateway
@@ -0,0 +1,147 @@
+# services/llm/rate_limiter.py
+import asyncio
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+
+logger = get_logger(__name__)
+
+# 粗略估算：英文文本约4个字符一个token，Gemini每张图片按固定token计费
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(text: str = "", images: int = 0) -> int:
+    """Rough token count of a prompt, used for rate limiting and budgeting"""
+    return len(text) // CHARS_PER_TOKEN + 1 + images * IMAGE_TOKENS
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Whether a provider error means the quota was exceeded (HTTP 429)"""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in ("429", "resource exhausted", "resource_exhausted", "quota", "rate limit"))
+
+
+class _TokenBucket:
+    """Token bucket that may go into debt, so callers wait for a reservation instead of polling"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float, rate_scale: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate * rate_scale)
+        self.updated = now
+
+    def reserve(self, amount: float, rate_scale: float) -> float:
+        """Take ``amount`` tokens and return how long the caller must wait before using them"""
+        # 单次请求超过桶容量时按容量计，避免永远无法满足
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / (self.rate * rate_scale)
+
+
+# 令牌桶限流器：同时按每分钟请求数和每分钟token数限流，遇到429时AIMD自适应降速
+class AdaptiveRateLimiter:
+    """Process-wide RPM/TPM limiter with additive-increase, multiplicative-decrease backoff"""
+
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        min_rate_scale: float = 0.1,
+        increase_step: float = 0.05,
+        decrease_factor: float = 0.5
+    ):
+        self.requests = _TokenBucket(requests_per_minute)
+        self.tokens = _TokenBucket(tokens_per_minute)
+        self.min_rate_scale = min_rate_scale
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        # 当前速率相对配置额度的比例，429时乘性下降，成功后加性恢复
+        self.rate_scale = 1.0
+
+        # 使用线程锁而不是asyncio锁：每个后台任务运行在自己的事件循环中
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve one request and ``tokens`` tokens, returning the delay before sending"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refill(now, self.rate_scale)
+            self.tokens.refill(now, self.rate_scale)
+            delay = max(
+                self.requests.reserve(1, self.rate_scale),
+                self.tokens.reserve(tokens, self.rate_scale)
+            )
+            self.acquired += 1
+            self.total_wait += delay
+        return delay
+
+    async def acquire(self, tokens: int) -> float:
+        """Wait until a request of ``tokens`` tokens fits in the budget"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def acquire_sync(self, tokens: int) -> float:
+        """Blocking variant of acquire for synchronous callers"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def record_success(self) -> None:
+        """Additive increase back towards the configured quota"""
+        with self._lock:
+            self.rate_scale = min(1.0, self.rate_scale + self.increase_step)
+
+    def record_throttle(self, retry_after: Optional[float] = None) -> None:
+        """Multiplicative decrease after a 429, and drain the buckets so queued calls pause"""
+        with self._lock:
+            self.rate_scale = max(self.min_rate_scale, self.rate_scale * self.decrease_factor)
+            self.throttled += 1
+            self.requests.tokens = min(self.requests.tokens, 0.0)
+            self.tokens.tokens = min(self.tokens.tokens, 0.0)
+            if retry_after:
+                # 服务端给出重试时间时，按该时间预扣请求额度
+                self.requests.tokens -= retry_after * self.requests.rate * self.rate_scale
+        logger.warning(f"Rate limited by provider; request rate scaled down to {self.rate_scale:.2f}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_scale": round(self.rate_scale, 3),
+                "requests_per_minute": round(self.requests.capacity * self.rate_scale, 2),
+                "tokens_per_minute": round(self.tokens.capacity * self.rate_scale, 2),
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "total_wait_seconds": round(self.total_wait, 3),
+            }
+
+
+@lru_cache()
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Limiter shared by every LLM call in this process"""
+    settings = get_settings()
+    limiter = AdaptiveRateLimiter(
+        requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE
+    )
+    metrics_registry.register("llm_rate_limiter", limiter.stats)
+    return limiter
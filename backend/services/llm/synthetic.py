@@ -0,0 +1,196 @@
+# services/llm/synthetic.py
+import ast
+import hashlib
+import json
+import math
+import random
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# 合成延迟分布支持的类型
+LATENCY_KINDS = ("none", "recorded", "fixed", "uniform", "normal", "lognormal")
+
+# 合成解读中最多列出的统计指标数
+MAX_SYNTHETIC_METRICS = 5
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """Synthetic response latency, parsed from specs like ``lognormal:1.2,0.4``"""
+    kind: str = "none"
+    a: float = 0.0
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, _, params = (spec or "none").strip().lower().partition(":")
+        if kind not in LATENCY_KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}', expected one of {', '.join(LATENCY_KINDS)}")
+        values = [float(value) for value in params.split(",") if value.strip()]
+        return cls(kind, *values[:2])
+
+    def sample(self, rng: random.Random, recorded: Optional[float] = None) -> float:
+        """Seconds to wait before answering; ``recorded`` is the latency captured with the response"""
+        if self.kind == "recorded":
+            return max(0.0, recorded or 0.0)
+        if self.kind == "fixed":
+            return self.a
+        if self.kind == "uniform":
+            return rng.uniform(self.a, self.b)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(self.a, self.b))
+        if self.kind == "lognormal":
+            # a为中位数，b为对数标准差
+            return rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        return 0.0
+
+
+def _search(pattern: str, text: str, default: str = "") -> str:
+    match = re.search(pattern, text)
+    return match.group(1).strip() if match else default
+
+
+def _numeric_leaves(value: Any, path: str = "") -> List[Tuple[str, Any]]:
+    """(dotted name, value) of every number in a stats structure"""
+    if isinstance(value, bool):
+        return []
+    if isinstance(value, (int, float)):
+        return [(path or "value", value)]
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = ((str(i), item) for i, item in enumerate(value))
+    else:
+        return []
+    leaves = []
+    for key, item in items:
+        leaves.extend(_numeric_leaves(item, f"{path}.{key}" if path else str(key)))
+    return leaves
+
+
+def _synthesize_sections(stats_text: str) -> List[Dict[str, Any]]:
+    """Description sections in the structure the describer asks for, built from the stats"""
+    try:
+        stats = json.loads(stats_text)
+    except (json.JSONDecodeError, TypeError):
+        stats = {}
+    question = stats.get("question", "the analysis question") if isinstance(stats, dict) else "the analysis question"
+    metrics = _numeric_leaves(stats)[:MAX_SYNTHETIC_METRICS]
+    return [
+        {
+            "title": f"Analysis of {question}"[:120],
+            "heading": "Analysis Overview",
+            "content": f"Synthetic overview of {question} based on {len(metrics)} reported statistic(s).",
+            "data_points": [
+                {"metric": name, "value": str(value), "significance": "Synthetic value for offline runs"}
+                for name, value in metrics
+            ]
+        },
+        {
+            "heading": "Statistical Evidence",
+            "content": "Synthetic interpretation of the reported statistics.",
+            "calculations": [
+                {"name": name, "value": str(value), "interpretation": f"{name} equals {value}"}
+                for name, value in metrics
+            ]
+        },
+        {
+            "heading": "Conclusions and Recommendations",
+            "content": "Synthetic conclusions; generated without a language model.",
+            "key_conclusions": [
+                {"finding": "Synthetic finding", "impact": "None", "recommendation": "Re-run against the live model"}
+            ],
+            "limitations": ["Generated by the offline LLM stand-in"],
+            "next_steps": ["Re-run against the live model"]
+        }
+    ]
+
+
+def _synthesize_batch(texts: List[str]) -> str:
+    elements = []
+    for text in texts:
+        key = _search(r"Visualization key:\s*(\S+)", text)
+        if key:
+            stats_text = _search(r"Statistical Data:\s*\n\s*(.*)", text, "{}")
+            elements.append({"key": key, "sections": _synthesize_sections(stats_text)})
+    return json.dumps(elements)
+
+
+def _synthesize_code(text: str) -> str:
+    """Analysis script for a code generation prompt: one chart and one stats file for the question"""
+    question = _search(r"Task:\s*(.*)", text, "analysis")
+    try:
+        columns = ast.literal_eval(_search(r"Columns:\s*(.*)", text, "[]"))
+    except (ValueError, SyntaxError):
+        columns = []
+    # 问题中提到的列优先，其余数值列作为回退
+    mentioned = [column for column in columns if str(column).lower() in question.lower()]
+    slug = re.sub(r"[^a-z0-9]+", "_", question.lower()).strip("_")[:40] or "analysis"
+    base_name = f"{slug}_{hashlib.sha256(question.encode()).hexdigest()[:6]}"
+    graphs_dir = _search(r'GRAPHS_DIR = r"(.*?)"', text)
+    stats_dir = _search(r'STATS_DIR = r"(.*?)"', text)
+    data_path = _search(r"Path:\s*(.*)", text)
+    return f'''import os, json, pandas as pd, numpy as np, matplotlib.pyplot as plt
+plt.ioff()
+
+GRAPHS_DIR = r"{graphs_dir}"
+STATS_DIR = r"{stats_dir}"
+data_path = r"{data_path}"
+
+base_name = "{base_name}"
+graph_file = os.path.join(GRAPHS_DIR, base_name + ".png")
+stats_file = os.path.join(STATS_DIR, base_name + "_stats.json")
+
+df = pd.read_csv(data_path)
+if df.empty:
+    raise ValueError("Empty dataframe")
+
+numeric = df.select_dtypes(include="number")
+numeric_columns = [c for c in {mentioned!r} if c in numeric.columns] or list(numeric.columns)
+stats = {{"question": {question!r}}}
+fig, ax = plt.subplots(figsize=(8, 5))
+if numeric_columns:
+    column = numeric_columns[0]
+    values = numeric[column].dropna()
+    ax.hist(values, bins=30)
+    stats["column"] = column
+    stats["summary"] = {{
+        "count": int(values.count()),
+        "mean": round(float(values.mean()), 4),
+        "median": round(float(values.median()), 4),
+        "std": round(float(values.std()), 4),
+        "min": round(float(values.min()), 4),
+        "max": round(float(values.max()), 4),
+    }}
+else:
+    column = df.columns[0]
+    counts = df[column].astype(str).value_counts().head(20)
+    counts.plot(kind="bar", ax=ax)
+    stats["column"] = column
+    stats["summary"] = {{"distinct": int(df[column].nunique()), "top": {{k: int(v) for k, v in counts.items()}}}}
+ax.set_title(str(column))
+ax.grid(True)
+fig.savefig(graph_file)
+plt.close(fig)
+
+with open(stats_file, "w") as f:
+    json.dump(stats, f, indent=4)
+'''
+
+
+# 离线替身的应答：根据提示内容识别调用类型，生成结构上合法的响应
+def synthesize_response(texts: List[str]) -> str:
+    """Plausible response to a pipeline prompt, without calling a model"""
+    text = "\n".join(texts)
+    if "Visualization key:" in text:
+        return _synthesize_batch(texts)
+    if "Statistical Data:" in text:
+        stats_text = _search(r"Statistical Data:\s*\n\s*(.*)", text, "{}")
+        return json.dumps({"sections": _synthesize_sections(stats_text)})
+    if "Original code:" in text and "Error message:" in text:
+        # 修复请求：原样返回代码
+        return _search(r"Original code:\s*\n([\s\S]*?)\n\s*Error message:", text)
+    if "Create visualization code for" in text:
+        return _synthesize_code(text)
+    return "OK"
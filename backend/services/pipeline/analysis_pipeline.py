@@ -0,0 +1,462 @@
+# services/pipeline/analysis_pipeline.py
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config.constants import ExecutionOutcome, JobStage, PipelineMode
+from core.config.settings import get_settings
+from core.job_manager import ProgressCallback
+from core.logging.logger import get_logger, log_execution
+from core.request_context import RequestContext
+from domain.exceptions.custom import ValidationError
+from services.analysis.code_generator import CodeGenerator
+from services.analysis.code_executor import CodeExecutor
+from services.analysis.description_generator import DescriptionGenerator, generate_descriptions
+from services.analysis.output_manifest import manifest_entries
+from services.pipeline.report_cache import get_report_cache
+from services.pipeline.stage_ledger import UNIT_STAGES, StageLedger
+from services.report.pdf_generator import generate_pdf
+
+logger = get_logger(__name__)
+
+# 分析结果中返回的每个问题执行摘要字段
+UNIT_SUMMARY_FIELDS = ("index", "question", "status", "outcome", "duration", "attempts", "error")
+
+# 解读结果中记入台账的字段（解读内容本身在解读json文件中）
+DESCRIPTION_RECORD_FIELDS = ("graph_path", "stats_path", "json_path")
+
+
+def _noop_progress(stage: JobStage, progress: float, message: str) -> None:
+    """Default progress callback when the pipeline runs outside the job manager"""
+
+
+def _record_execution(ledger: StageLedger, context: RequestContext, unit_result: Dict[str, Any]) -> None:
+    """Record a successfully executed unit and the graphs, stats and renditions it wrote"""
+    if unit_result["status"] != "success":
+        # 执行失败的问题不记入台账，恢复运行时会重新执行
+        return
+    code_file = context.code_dir / unit_result["code_file"]
+    unit = {key: value for key, value in unit_result.items()
+            if key not in ("status", "outcome", "attempts", "duration", "output", "output_truncated", "outputs", "error")}
+    # 修复器可能改写了代码文件，同时更新生成阶段记录的哈希
+    ledger.complete_unit(unit_result["index"], "generate", [code_file], unit)
+    files = [code_file]
+    for pair in unit_result["outputs"]:
+        files += [Path(pair["graph_path"]), Path(pair["stats_path"])]
+        if pair.get("llm_image_path"):
+            files.append(Path(pair["llm_image_path"]))
+    ledger.complete_unit(
+        unit_result["index"],
+        "execute",
+        files,
+        {key: value for key, value in unit_result.items() if key != "output"}
+    )
+
+
+def _record_descriptions(ledger: StageLedger, index: int, entries: List[Dict], descriptions: List[Dict]) -> None:
+    """Record a unit's descriptions once every one of its graphs has been described"""
+    if not entries or len(descriptions) < len(entries):
+        return
+    ledger.complete_unit(
+        index,
+        "describe",
+        [Path(description["json_path"]) for description in descriptions],
+        {"descriptions": [{key: d[key] for key in DESCRIPTION_RECORD_FIELDS} for d in descriptions]}
+    )
+
+
+def _load_recorded_descriptions(ledger: StageLedger, index: int) -> List[Dict]:
+    """Description results of a unit described by an earlier run"""
+    descriptions = []
+    for record in ledger.unit_result(index, "describe")["descriptions"]:
+        with open(record["json_path"], "r", encoding="utf-8") as f:
+            descriptions.append({**record, "content": json.load(f)})
+    return descriptions
+
+
+def _run_staged(
+    questions: List[str],
+    context: RequestContext,
+    progress: ProgressCallback,
+    ledger: StageLedger
+) -> Tuple[Dict[str, Any], List[Dict]]:
+    """Run each stage for every question before the next stage starts"""
+    # 步骤1：自动生成可视化分析代码
+    progress(JobStage.GENERATING_CODE, 0.05, f"Generating code for {len(questions)} question(s)")
+    generator = CodeGenerator(context)
+    code_result = generator.generate(questions)
+    if code_result["status"] != "success":
+        logger.error(f"Code generation failed: {code_result.get('message')}")
+        raise ValidationError(code_result.get("message"))
+    for unit in code_result["units"]:
+        ledger.complete_unit(unit["index"], "generate", [context.code_dir / unit["code_file"]], unit)
+
+    # 步骤2：执行自动生成的分析代码，生成图表和统计结果
+    progress(JobStage.EXECUTING_CODE, 0.35, "Executing generated analysis code")
+    executor = CodeExecutor(context)
+    execution_result = executor.execute_code()
+    if execution_result["status"] != "success":
+        logger.error(f"Code execution failed: {execution_result.get('message')}")
+        raise ValidationError(execution_result.get("message"))
+    for unit_result in execution_result["units"]:
+        _record_execution(ledger, context, unit_result)
+
+    # 步骤3：自动生成图表解读（AI分析）
+    progress(JobStage.GENERATING_DESCRIPTIONS, 0.6, "Generating chart descriptions")
+    description_results = generate_descriptions(context)
+    for unit_result in execution_result["units"]:
+        _record_descriptions(
+            ledger,
+            unit_result["index"],
+            manifest_entries([unit_result]),
+            [d for d in description_results if d["content"]["index"] == unit_result["index"]]
+        )
+    return execution_result, description_results
+
+
+class _StepCounter:
+    """Reports pipeline progress as questions finish their individual steps"""
+
+    def __init__(self, progress: ProgressCallback, questions: int):
+        self.progress = progress
+        self.total = max(1, questions * len(UNIT_STAGES))
+        self.done = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def step(self, stage: JobStage, message: str, reused: bool = False) -> None:
+        with self._lock:
+            self.done += 1
+            self.reused += int(reused)
+            value = 0.05 + 0.85 * self.done / self.total
+        self.progress(stage, value, message)
+
+
+# 解读批处理：把同一时段完成执行的多个问题的图表合并到同一批解读请求中
+class _DescriptionBatcher:
+    """Groups the graphs of questions that finish executing close together into shared description requests"""
+
+    def __init__(self, describer: DescriptionGenerator, semaphore: asyncio.Semaphore, questions: int, max_wait: float):
+        self.describer = describer
+        self.semaphore = semaphore
+        # 仍可能提交图表的问题数；为0时没有必要继续等待
+        self.waiting = questions
+        self.max_wait = max_wait
+        self._queue: List[Tuple[List[Dict], asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    def skip(self) -> None:
+        """A question will not submit graphs (its descriptions were reused, or it failed)"""
+        self.waiting -= 1
+        self._flush_if_ready()
+
+    async def describe(self, entries: List[Dict]) -> List[Dict]:
+        """Descriptions of one question's graphs, possibly requested together with other questions"""
+        self.waiting -= 1
+        if not entries:
+            self._flush_if_ready()
+            return []
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((entries, future))
+        self._flush_if_ready()
+        if self._queue and self._timer is None:
+            # 等待时间有上限，先完成的问题不会被慢问题一直拖住
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush_if_ready(self) -> None:
+        queued = sum(len(entries) for entries, _ in self._queue)
+        if self._queue and (queued >= self.describer.max_batch_size or self.waiting <= 0):
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        queue, self._queue = self._queue, []
+        if queue:
+            task = asyncio.ensure_future(self._run(queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, queue: List[Tuple[List[Dict], asyncio.Future]]) -> None:
+        try:
+            results = await self.describer.agenerate_description(
+                [entry for entries, _ in queue for entry in entries],
+                semaphore=self.semaphore
+            )
+        except Exception as e:
+            # 解读失败不影响已执行成功的问题，报告中跳过这些图表
+            logger.error(f"Failed to describe {len(queue)} question(s): {str(e)}")
+            results = []
+        # 按图表路径把结果分回各个问题
+        by_graph = {result["graph_path"]: result for result in results}
+        for entries, future in queue:
+            future.set_result([
+                by_graph[str(entry["graph_path"])] for entry in entries
+                if str(entry["graph_path"]) in by_graph
+            ])
+
+
+def _failed_unit(index: int, question: str, error: Exception) -> Dict[str, Any]:
+    """Execution result of a question that failed before its code could run"""
+    return {
+        "index": index,
+        "question": question,
+        "code_file": None,
+        "graph_file": None,
+        "stats_file": None,
+        "status": "failed",
+        "outcome": ExecutionOutcome.ERROR.value,
+        "attempts": 0,
+        "duration": 0.0,
+        "output": "",
+        "output_truncated": False,
+        "outputs": [],
+        "error": str(error)
+    }
+
+
+async def _arun_streaming(
+    questions: List[str],
+    context: RequestContext,
+    progress: ProgressCallback,
+    ledger: StageLedger,
+    resume: bool = False
+) -> Tuple[Dict[str, Any], List[Dict], int]:
+    """Move every question through generate -> execute -> describe independently.
+
+    When resuming, stages recorded in the ledger whose files still match are
+    reused and only the remaining stages of each question run. Returns the
+    execution result, the descriptions and the number of reused steps.
+    """
+    progress(JobStage.GENERATING_CODE, 0.05, f"{'Resuming' if resume else 'Generating code for'} {len(questions)} question(s)")
+    generator = CodeGenerator(context)
+    executor = CodeExecutor(context)
+    describer = DescriptionGenerator(context)
+    inputs = generator.prepare_inputs()
+    if not resume:
+        executor.cleanup_previous_files()
+
+    loop = asyncio.get_running_loop()
+    # 网关在默认线程池中调用大模型；生成和解读请求可能同时在途，按两者并发上限之和分配线程
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=generator.concurrency + describer.concurrency,
+        thread_name_prefix="llm-call"
+    ))
+    counter = _StepCounter(progress, len(questions))
+    # 解读请求的并发上限由所有问题共享；先后就绪的图表合并为批量请求
+    batcher = _DescriptionBatcher(
+        describer,
+        asyncio.Semaphore(describer.concurrency),
+        len(questions),
+        get_settings().DESCRIPTION_BATCH_WAIT_SECONDS
+    )
+    units: List[Dict[str, Any]] = []
+    # 已向批处理器提交图表的问题
+    submitted = set()
+
+    async def run_question(index: int, question: str, execution_pool: ThreadPoolExecutor) -> Tuple[Dict[str, Any], List[Dict]]:
+        # 单个问题失败（如代码生成失败）只记为该问题失败，不影响其他问题
+        try:
+            return await advance_question(index, question, execution_pool)
+        except Exception as e:
+            logger.error(f"Question {index} failed: {str(e)}")
+            return _failed_unit(index, question, e), []
+        finally:
+            if index not in submitted:
+                batcher.skip()
+
+    async def advance_question(index: int, question: str, execution_pool: ThreadPoolExecutor) -> Tuple[Dict[str, Any], List[Dict]]:
+        # 从台账中第一个缺失或文件已变化的阶段开始，之后的阶段全部重做
+        pending = ledger.pending_stage(index)
+        first = len(UNIT_STAGES) if pending is None else UNIT_STAGES.index(pending)
+        if pending is not None:
+            ledger.invalidate_unit(index, pending)
+
+        # 每个问题的产物就绪后立即进入下一步，不等待其他问题
+        if first <= UNIT_STAGES.index("generate"):
+            unit = await generator.agenerate_unit(index, question, inputs)
+            ledger.complete_unit(
+                index, "generate", [context.code_dir / unit["code_file"]],
+                {key: value for key, value in unit.items() if key != "code"}
+            )
+            counter.step(JobStage.EXECUTING_CODE, f"Question {index} generated")
+        else:
+            unit = dict(ledger.unit_result(index, "generate"))
+            with open(context.code_dir / unit["code_file"], "r") as f:
+                unit["code"] = f.read()
+            counter.step(JobStage.EXECUTING_CODE, f"Question {index} code reused", reused=True)
+        units.append(unit)
+
+        if first <= UNIT_STAGES.index("execute"):
+            unit_result = await loop.run_in_executor(
+                execution_pool,
+                executor.execute_unit,
+                {key: value for key, value in unit.items() if key != "code"}
+            )
+            _record_execution(ledger, context, unit_result)
+            counter.step(JobStage.GENERATING_DESCRIPTIONS, f"Question {index} executed ({unit_result['status']})")
+        else:
+            unit_result = {**ledger.unit_result(index, "execute"), "output": ""}
+            counter.step(JobStage.GENERATING_DESCRIPTIONS, f"Question {index} outputs reused", reused=True)
+
+        entries = manifest_entries([unit_result])
+        if first <= UNIT_STAGES.index("describe"):
+            submitted.add(index)
+            descriptions = await batcher.describe(entries)
+            _record_descriptions(ledger, index, entries, descriptions)
+            counter.step(JobStage.GENERATING_DESCRIPTIONS, f"Question {index} described")
+        else:
+            descriptions = _load_recorded_descriptions(ledger, index)
+            counter.step(JobStage.GENERATING_DESCRIPTIONS, f"Question {index} descriptions reused", reused=True)
+        return unit_result, descriptions
+
+    # 代码执行线程数与常驻工作进程数一致，避免占用大模型调用使用的默认线程池
+    max_workers = max(1, min(len(questions), executor.worker_pool.size))
+    logger.info(f"Streaming {len(questions)} question(s) through the pipeline ({max_workers} execution slot(s))")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="code-unit") as execution_pool:
+        results = await asyncio.gather(*(
+            run_question(index, question, execution_pool)
+            for index, question in enumerate(questions)
+        ))
+
+    # 所有问题结束后再写入代码索引和输出清单，供报告生成和追溯使用
+    generator.save_units_index(units)
+    execution_result = executor.finalize([unit_result for unit_result, _ in results])
+    description_results = [description for _, descriptions in results for description in descriptions]
+    return execution_result, description_results, counter.reused
+
+
+# 分析流水线：代码生成 -> 代码执行 -> 图表解读 -> PDF报告
+@log_execution
+def run_analysis_pipeline(
+    questions: List[str],
+    report_title: str,
+    context: RequestContext,
+    progress: Optional[ProgressCallback] = None,
+    mode: Optional[PipelineMode] = None
+) -> Dict[str, Any]:
+    """Run the full analysis pipeline for one uploaded dataset (mode defaults to PIPELINE_MODE)"""
+    progress = progress or _noop_progress
+    mode = PipelineMode(mode or get_settings().PIPELINE_MODE)
+    logger.info(f"Processing request ID: {context.request_id} ({mode.value} pipeline)")
+    # 新的运行重置阶段台账
+    ledger = StageLedger.start(context, questions, report_title)
+
+    # 步骤1-3：代码生成、执行和图表解读（流式模式下按问题各自推进）
+    if mode == PipelineMode.STAGED:
+        execution_result, description_results = _run_staged(questions, context, progress, ledger)
+    else:
+        execution_result, description_results, _ = asyncio.run(_arun_streaming(questions, context, progress, ledger))
+    return _build_report(context, ledger, execution_result, description_results, progress)
+
+
+# 恢复运行：跳过台账中已完成且文件哈希一致的阶段，只重做缺失的部分
+@log_execution
+def resume_analysis_pipeline(
+    context: RequestContext,
+    progress: Optional[ProgressCallback] = None
+) -> Dict[str, Any]:
+    """Finish an interrupted or failed pipeline run, reusing its verified stages"""
+    progress = progress or _noop_progress
+    ledger = StageLedger.load(context)
+    logger.info(f"Resuming request ID: {context.request_id}")
+    # 恢复运行总是按问题逐个推进，各问题从各自缺失的阶段继续
+    execution_result, description_results, reused = asyncio.run(
+        _arun_streaming(ledger.questions, context, progress, ledger, resume=True)
+    )
+    return _build_report(
+        context, ledger, execution_result, description_results, progress,
+        message=f"Analysis resumed, reusing {reused} of {len(ledger.questions) * len(UNIT_STAGES)} question stage(s)"
+    )
+
+
+# 追加问题：只生成、执行和解读新问题，已有问题的产物直接沿用，PDF按全部问题重建
+@log_execution
+def append_questions_pipeline(
+    context: RequestContext,
+    questions: List[str],
+    report_title: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None
+) -> Dict[str, Any]:
+    """Add follow-up questions to an analysed request and rebuild its report"""
+    progress = progress or _noop_progress
+    ledger = StageLedger.load(context)
+    indices = ledger.add_questions(questions, report_title)
+    logger.info(f"Adding question(s) {indices} to request ID: {context.request_id}")
+    # 新问题的序号接在已有问题之后；代码单元、图表、统计和解读文件名都以问题序号开头，互不覆盖
+    execution_result, description_results, reused = asyncio.run(
+        _arun_streaming(ledger.questions, context, progress, ledger, resume=True)
+    )
+    return _build_report(
+        context, ledger, execution_result, description_results, progress,
+        message=f"Added {len(indices)} question(s) to the analysis, reusing {reused} earlier question stage(s)"
+    )
+
+
+def _build_report(
+    context: RequestContext,
+    ledger: StageLedger,
+    execution_result: Dict[str, Any],
+    description_results: List[Dict],
+    progress: ProgressCallback,
+    message: str = "Analysis completed successfully"
+) -> Dict[str, Any]:
+    """Build (or reuse) the PDF once every question is done and assemble the analysis result"""
+
+    unit_results = execution_result.get("units", [])
+    failed_units = [u for u in unit_results if u["status"] != "success"]
+    if failed_units:
+        logger.warning(f"{len(failed_units)} of {len(unit_results)} question(s) failed to execute")
+    if not description_results:
+        logger.error("Failed to generate descriptions")
+        raise ValidationError("Failed to generate descriptions")
+
+    # 步骤4：所有问题完成后生成最终PDF报告，包含所有图表、统计和解读
+    # 所有问题的阶段都沿用且PDF未变化时直接复用
+    report = ledger.report_result()
+    if report is not None:
+        progress(JobStage.GENERATING_PDF, 0.9, "Reusing PDF report")
+        pdf_path = str(context.output_dir / report["pdf_path"])
+    else:
+        progress(JobStage.GENERATING_PDF, 0.9, "Building PDF report")
+        pdf_path = generate_pdf(context, report_title=ledger.report_title)
+        if not pdf_path:
+            logger.error("Failed to generate PDF")
+            raise ValidationError("Failed to generate PDF")
+        ledger.complete_report([Path(pdf_path)], {"pdf_path": os.path.basename(pdf_path)})
+
+    logger.info("Analysis completed successfully")
+
+    # 返回分析结果，包含状态、请求ID、时间戳、可视化文件、解读数量、PDF路径等
+    result = {
+        "status": "success",
+        "message": message,
+        "request_id": context.request_id,
+        "timestamp": datetime.now(),
+        "details": {
+            "visualizations": execution_result.get("generated_files", []),  # 生成的图表文件名列表
+            "units": [                                                      # 每个问题的执行状态和耗时
+                {key: unit.get(key) for key in UNIT_SUMMARY_FIELDS}
+                for unit in unit_results
+            ],
+            "descriptions": len(description_results),                      # 生成的解读数量
+            "pdf_path": os.path.basename(pdf_path)                         # 生成的PDF文件名
+        }
+    }
+
+    # 记入报告缓存，相同数据集、问题和标题的后续请求直接复用本次结果
+    report_cache = get_report_cache()
+    if report_cache is not None:
+        try:
+            report_cache.store_result(context, ledger.questions, ledger.report_title, result)
+        except Exception as e:
+            logger.warning(f"Failed to cache report of {context.request_id}: {str(e)}")
+    return result
@@ -0,0 +1,113 @@
+# services/pipeline/report_cache.py
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from core.cache import SQLiteLRUCache, hash_key
+from core.config.paths import path_config
+from core.config.settings import get_settings
+from core.logging.logger import get_logger
+from core.metrics import metrics_registry
+from core.request_context import RequestContext
+from domain.exceptions.custom import DataProcessingError
+from services.analysis.code_generator import PROMPT_TEMPLATE_VERSION
+from services.analysis.description_generator import DESCRIPTION_TEMPLATE_VERSION
+from services.data.dataset_upload import load_upload_info
+from services.pipeline.stage_ledger import StageLedger
+
+logger = get_logger(__name__)
+
+# 报告流水线版本：修改报告结构或PDF排版后需递增，使旧的缓存报告失效
+REPORT_PIPELINE_VERSION = "3"
+
+
+def normalize_questions(questions: List[str]) -> List[str]:
+    """Questions with surrounding and repeated whitespace removed, in their original order"""
+    return [re.sub(r"\s+", " ", question).strip() for question in questions]
+
+
+# 报告缓存：相同数据集内容、问题和标题直接返回已有请求的分析结果和PDF
+class ReportCache:
+    """Maps dataset hash, questions and title to the request that already produced the report"""
+
+    def __init__(self, store: SQLiteLRUCache, model_name: str):
+        self.store = store
+        self.model_name = model_name
+
+    def make_key(self, dataset_sha256: str, questions: List[str], report_title: str) -> str:
+        """Hash of dataset content, normalized questions, title and pipeline version"""
+        return hash_key(
+            self.model_name,
+            REPORT_PIPELINE_VERSION,
+            PROMPT_TEMPLATE_VERSION,
+            DESCRIPTION_TEMPLATE_VERSION,
+            dataset_sha256,
+            normalize_questions(questions),
+            report_title.strip()
+        )
+
+    def _dataset_sha256(self, context: RequestContext) -> Optional[str]:
+        upload_info = load_upload_info(context.upload_info_path)
+        return upload_info.sha256 if upload_info else None
+
+    def _still_valid(self, entry: Dict[str, Any], questions: List[str], report_title: str) -> bool:
+        """Whether the cached request still holds this exact report with an intact PDF"""
+        request_dir = path_config.RESPONSE_DIR / entry["request_id"]
+        if not request_dir.is_dir():
+            return False
+        try:
+            ledger = StageLedger.load(RequestContext.from_request_dir(request_dir))
+        except DataProcessingError:
+            return False
+        # 追加问题或重新分析后，该请求的报告已不再对应这组问题
+        return normalize_questions(ledger.questions) == normalize_questions(questions) \
+            and ledger.report_title.strip() == report_title.strip() \
+            and ledger.report_result() is not None
+
+    def lookup(self, context: RequestContext, questions: List[str], report_title: str) -> Optional[Dict[str, Any]]:
+        """Analysis result of an earlier request with the same dataset, questions and title"""
+        dataset_sha256 = self._dataset_sha256(context)
+        if dataset_sha256 is None:
+            return None
+        key = self.make_key(dataset_sha256, questions, report_title)
+        value = self.store.get(key)
+        if value is None:
+            return None
+        try:
+            entry = json.loads(value)
+        except json.JSONDecodeError:
+            self.store.delete(key)
+            return None
+        if not self._still_valid(entry, questions, report_title):
+            logger.info(f"Cached report of {entry['request_id']} is no longer available")
+            self.store.delete(key)
+            return None
+        logger.info(f"Report cache hit: reusing {entry['request_id']} for {context.request_id}")
+        return entry["result"]
+
+    def store_result(self, context: RequestContext, questions: List[str], report_title: str, result: Dict[str, Any]) -> None:
+        """Remember the result of a finished analysis of this request"""
+        dataset_sha256 = self._dataset_sha256(context)
+        if dataset_sha256 is None:
+            return
+        self.store.set(
+            self.make_key(dataset_sha256, questions, report_title),
+            json.dumps({"request_id": context.request_id, "result": result}, ensure_ascii=False, default=str)
+        )
+
+
+@lru_cache()
+def get_report_cache() -> Optional[ReportCache]:
+    """Process-wide report cache, or None when disabled in settings"""
+    settings = get_settings()
+    if not settings.REPORT_CACHE_ENABLED:
+        return None
+    store = SQLiteLRUCache(
+        path_config.CACHE_DIR / "report_cache.sqlite3",
+        max_entries=settings.REPORT_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.REPORT_CACHE_TTL_SECONDS or None
+    )
+    metrics_registry.register("report_cache", store.stats)
+    logger.info(f"Report cache enabled at {store.db_path}")
+    return ReportCache(store, settings.GEMINI_MODEL_NAME)
@@ -0,0 +1,156 @@
+# services/pipeline/stage_ledger.py
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from core.logging.logger import get_logger
+from core.request_context import RequestContext
+from domain.exceptions.custom import DataProcessingError
+
+logger = get_logger(__name__)
+
+# ledger.json结构版本，字段变化时递增
+LEDGER_VERSION = 1
+
+# 每个问题依次经过的阶段；前一阶段重做时，后续阶段也必须重做
+UNIT_STAGES = ("generate", "execute", "describe")
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a file, read in chunks"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# 阶段台账：记录每个问题已完成的阶段及其产物哈希，失败后可从缺失的阶段继续
+class StageLedger:
+    """Completed pipeline stages of one request and the verified files they produced"""
+
+    def __init__(self, context: RequestContext, state: Dict[str, Any]):
+        self.context = context
+        self.state = state
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, context: RequestContext, questions: List[str], report_title: str) -> 'StageLedger':
+        """Begin a fresh ledger for a new pipeline run, discarding any previous one"""
+        ledger = cls(context, {
+            "version": LEDGER_VERSION,
+            "request_id": context.request_id,
+            "questions": list(questions),
+            "report_title": report_title,
+            "created_at": datetime.now().isoformat(),
+            "units": {},
+            "report": None,
+        })
+        ledger.save()
+        return ledger
+
+    @classmethod
+    def load(cls, context: RequestContext) -> 'StageLedger':
+        """Load the ledger left by an earlier run of this request"""
+        if not context.ledger_path.exists():
+            raise DataProcessingError(f"No pipeline run recorded for {context.request_id}")
+        try:
+            with open(context.ledger_path, "r") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise DataProcessingError(f"Unreadable stage ledger: {str(e)}")
+        if state.get("version") != LEDGER_VERSION:
+            raise DataProcessingError(f"Unsupported stage ledger version: {state.get('version')}")
+        return cls(context, state)
+
+    @property
+    def questions(self) -> List[str]:
+        return self.state["questions"]
+
+    @property
+    def report_title(self) -> str:
+        return self.state["report_title"]
+
+    def add_questions(self, questions: List[str], report_title: Optional[str] = None) -> List[int]:
+        """Append follow-up questions and return their indices; the report must be rebuilt"""
+        with self._lock:
+            start = len(self.state["questions"])
+            self.state["questions"].extend(questions)
+            if report_title:
+                self.state["report_title"] = report_title
+            self.state["report"] = None
+        self.save()
+        return list(range(start, start + len(questions)))
+
+    def save(self) -> None:
+        # 先写临时文件再替换，避免中断时留下半个文件
+        with self._lock:
+            self.state["updated_at"] = datetime.now().isoformat()
+            tmp_path = self.context.ledger_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.context.ledger_path)
+
+    def _record(self, files: Iterable[Path], result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "completed_at": datetime.now().isoformat(),
+            # 路径相对于请求目录保存
+            "files": {
+                os.path.relpath(path, self.context.request_dir): file_digest(Path(path))
+                for path in files
+            },
+            "result": result,
+        }
+
+    def _verify(self, record: Optional[Dict[str, Any]]) -> bool:
+        """Whether every file of a stage record still exists with its recorded hash"""
+        if not record:
+            return False
+        for relative_path, digest in record["files"].items():
+            path = self.context.request_dir / relative_path
+            if not path.exists() or file_digest(path) != digest:
+                logger.warning(f"{relative_path} is missing or changed since it was recorded")
+                return False
+        return True
+
+    def complete_unit(self, index: int, stage: str, files: Iterable[Path], result: Dict[str, Any]) -> None:
+        """Record that a question finished a stage, with the files it produced"""
+        record = self._record(files, result)
+        with self._lock:
+            self.state["units"].setdefault(str(index), {})[stage] = record
+        self.save()
+
+    def invalidate_unit(self, index: int, stage: str) -> None:
+        """Forget a stage of a question and every stage after it, and the report built from them"""
+        with self._lock:
+            records = self.state["units"].get(str(index), {})
+            for later in UNIT_STAGES[UNIT_STAGES.index(stage):]:
+                records.pop(later, None)
+            self.state["report"] = None
+        self.save()
+
+    def unit_result(self, index: int, stage: str) -> Dict[str, Any]:
+        return self.state["units"][str(index)][stage]["result"]
+
+    def pending_stage(self, index: int) -> Optional[str]:
+        """First stage of a question that is missing or no longer matches its files"""
+        records = self.state["units"].get(str(index), {})
+        for stage in UNIT_STAGES:
+            if not self._verify(records.get(stage)):
+                return stage
+        return None
+
+    def complete_report(self, files: Iterable[Path], result: Dict[str, Any]) -> None:
+        record = self._record(files, result)
+        with self._lock:
+            self.state["report"] = record
+        self.save()
+
+    def report_result(self) -> Optional[Dict[str, Any]]:
+        """Result of the report stage if the PDF is still intact"""
+        record = self.state.get("report")
+        return record["result"] if self._verify(record) else None
@@ -4,122 +4,195 @@ from typing import List, Dict, Optional
 from reportlab.lib import colors
 import re
 from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import inch
+from reportlab.pdfgen.canvas import Canvas
 from reportlab.platypus import (
     SimpleDocTemplate, 
     Paragraph, 
     Spacer, 
     Image, 
-    PageBreak
+    PageBreak,
+    Flowable
 )
 import json
 from dataclasses import dataclass
+from functools import partial
+from xml.sax.saxutils import escape
 
-from core.config.paths import path_config
+from core.request_context import RequestContext
 from core.config.constants import PDF_CONSTANTS
 from core.logging.logger import get_logger, log_execution
 from domain.exceptions.custom import PDFGenerationError
+from services.analysis.output_manifest import load_manifest
 from .pdf_styles import get_custom_styles
 
 logger = get_logger(__name__)
 
+# 页码列宽度（TOC中右对齐的页码所占空间）
+TOC_PAGE_NUMBER_WIDTH = 36
+
+
 @dataclass
 class TOCEntry:
-    """Table of Contents entry with proper page tracking"""
+    """Table of Contents entry; the page number is recorded when its heading is placed"""
+    entry_id: str
     title: str
     level: int
+    key: str
     page_number: Optional[int] = None
     parent_id: Optional[str] = None
 
+
+class TOCLine(Flowable):
+    """One TOC line: wrapped title, dot leader, and a page number filled in after layout"""
+
+    def __init__(self, entry: TOCEntry, style: ParagraphStyle):
+        super().__init__()
+        self.entry = entry
+        self.style = style
+        self.form_name = f"toc-page-{entry.entry_id}"
+        self._title = Paragraph(escape(entry.title), style)
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        _, self.height = self._title.wrap(availWidth - TOC_PAGE_NUMBER_WIDTH, availHeight)
+        return self.width, self.height
+
+    def getSpaceBefore(self):
+        return self._title.getSpaceBefore()
+
+    def getSpaceAfter(self):
+        return self._title.getSpaceAfter()
+
+    def draw(self):
+        canvas = self.canv
+        self._title.drawOn(canvas, 0, 0)
+        # 页码与标题最后一行对齐，点线从标题末尾延伸到页码列
+        lines = self._title.blPara.lines
+        last = lines[-1]
+        extra_space = last.extraSpace if hasattr(last, 'extraSpace') else last[0]
+        text_end = self._title.width - self.style.rightIndent - extra_space
+        baseline = self.height - self.style.fontSize - (len(lines) - 1) * self.style.leading
+        leader_end = self.width - TOC_PAGE_NUMBER_WIDTH + 4
+        canvas.saveState()
+        canvas.setFillColor(self.style.textColor)
+        canvas.setStrokeColor(self.style.textColor)
+        if leader_end - text_end > 8:
+            canvas.setDash(1, 3)
+            canvas.setLineWidth(0.8)
+            canvas.line(text_end + 4, baseline, leader_end, baseline)
+        # 整行可点击，跳转到标题所在位置
+        canvas.linkRect("", self.entry.key, (0, 0, self.width, self.height), relative=1, thickness=0)
+        # 页码在整份文档排版完成后才确定，这里引用一个稍后定义的PDF表单
+        canvas.translate(self.width, baseline)
+        canvas.doForm(self.form_name)
+        canvas.restoreState()
+
+
 class DynamicTOC:
-    """Dynamic Table of Contents handler with improved page tracking"""
+    """Table of Contents whose page numbers come from where headings are actually placed"""
     def __init__(self):
-        self.entries = []
-        self._current_page = 1
+        self.entries: List[TOCEntry] = []
+        self._by_id: Dict[str, TOCEntry] = {}
+        self._lines: List[TOCLine] = []
         self._last_section_id = None
-        self._toc_pages = 0  # Track TOC pages for offset
 
-    def add_entry(self, title: str, level: int) -> None:
-        """Add a new entry to the TOC with proper page number"""
-        # Clean the title of any special characters and formatting
-        clean_title = re.sub(r'[^\w\s-]', '', title)
+    def add_entry(self, title: str, level: int) -> str:
+        """Add a new entry to the TOC and return its ID"""
+        entry_id = str(len(self.entries))
+        # 书签名只保留安全字符，显示的标题保持原样
+        clean_title = re.sub(r'[^A-Za-z0-9]+', '_', title).strip('_')
         
         entry = TOCEntry(
+            entry_id=entry_id,
             title=title,
             level=level,
-            page_number=self._current_page + self._toc_pages,
+            key=f"toc_{entry_id}_{clean_title[:40]}",
             parent_id=self._last_section_id if level > 1 else None
         )
-        
         if level == 1:
-            self._last_section_id = clean_title
-            
+            self._last_section_id = entry.entry_id
         self.entries.append(entry)
+        self._by_id[entry.entry_id] = entry
+        return entry.entry_id
 
-    def increment_page(self, count: int = 1) -> None:
-        """Increment the current page count"""
-        self._current_page += count
-
-    def set_toc_pages(self, pages: int) -> None:
-        """Set the number of pages taken by TOC for offset calculation"""
-        self._toc_pages = pages
-        # Update all existing entries to account for TOC pages
-        for entry in self.entries:
-            if entry.page_number is not None:
-                entry.page_number += self._toc_pages
+    def record_page(self, entry_id: str, page: int) -> Optional[TOCEntry]:
+        """Record the page a heading landed on; returns the entry the first time it is placed"""
+        entry = self._by_id.get(entry_id)
+        if entry is None or entry.page_number is not None:
+            return None
+        entry.page_number = page
+        return entry
 
     def create_toc_content(self, styles) -> List:
-        """Create table of contents with proper spacing and formatting"""
+        """Create table of contents lines; page numbers are drawn once layout is done"""
         elements = []
         
         # Add TOC title
         elements.append(Paragraph("Table of Contents", styles['CustomChapterTitle']))
         elements.append(Spacer(1, 0.2*inch))
         
-        for entry in self.entries:
+        level_styles = {1: styles['CustomTOCEntry'], 2: styles['CustomTOCEntry2']}
+        self._lines = [
+            TOCLine(entry, level_styles.get(entry.level, styles['CustomTOCEntry3']))
+            for entry in self.entries
             # Skip the TOC entry itself
-            if entry.title == "Table of Contents":
-                continue
-                
-            # Calculate indentation based on level
-            indent = "  " * (entry.level - 1)
-            title = f"{indent}{entry.title}"
-            
-            # Calculate dots with proper spacing
-            title_length = len(title)
-            dots_count = max(3, 70 - title_length)  # Ensure minimum 3 dots
-            dots = "." * dots_count
-            
-            # Create TOC line with proper spacing and page number
-            if entry.level == 1:
-                toc_line = f"{title}{dots}{entry.page_number}"
-                style = styles['CustomTOCEntry']
-            elif entry.level == 2:
-                toc_line = f"{title}{dots}{entry.page_number}"
-                style = styles['CustomTOCEntry2']
-            else:
-                toc_line = f"{title}{dots}{entry.page_number}"
-                style = styles['CustomTOCEntry3']
-            
-            elements.append(Paragraph(toc_line, style))
-        
+            if entry.title != "Table of Contents"
+        ]
+        elements.extend(self._lines)
         elements.append(PageBreak())
         return elements
 
-    def reset(self) -> None:
-        """Reset the TOC for reprocessing"""
-        self._current_page = 1
-        self._toc_pages = 0
-        self.entries = []
+    def draw_page_numbers(self, canvas) -> None:
+        """Define the page number form referenced by every TOC line"""
+        for line in self._lines:
+            page = line.entry.page_number
+            canvas.beginForm(line.form_name, lowerx=-TOC_PAGE_NUMBER_WIDTH, lowery=-line.style.fontSize,
+                             upperx=0, uppery=line.style.fontSize * 2)
+            canvas.setFont(line.style.fontName, line.style.fontSize)
+            canvas.setFillColor(line.style.textColor)
+            canvas.drawRightString(0, 0, str(page) if page is not None else "-")
+            canvas.endForm()
+
+
+class TOCCanvas(Canvas):
+    """Canvas that fills in the TOC page numbers just before the PDF is written"""
+
+    def __init__(self, *args, toc: DynamicTOC, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._toc = toc
+
+    def save(self):
+        self._toc.draw_page_numbers(self)
+        super().save()
+
+
+class ReportDocTemplate(SimpleDocTemplate):
+    """Document template that records the page of every TOC heading as it is placed"""
+
+    def __init__(self, filename: str, toc: DynamicTOC, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.toc = toc
+
+    def afterFlowable(self, flowable):
+        entry_id = getattr(flowable, 'toc_entry_id', None)
+        if entry_id is None:
+            return
+        entry = self.toc.record_page(entry_id, self.page)
+        if entry is not None:
+            # TOC链接的目标，同时加入PDF阅读器的书签栏
+            self.canv.bookmarkPage(entry.key)
+            self.canv.addOutlineEntry(entry.title, entry.key, level=entry.level - 1)
 
 
 class PDFGenerator:
     """PDF Report Generator with Reliable Image Handling"""
     
-    def __init__(self):
+    def __init__(self, context: RequestContext):
+        self.context = context
         self.styles = get_custom_styles()
         self.toc = DynamicTOC()
-        self.figures_list = []
         self.report_title = "Data Analysis Report"
 
     def _validate_graph_path(self, graph_path: str) -> bool:
@@ -132,7 +205,7 @@ class PDFGenerator:
             return False    
     
     def create_header_footer(self, canvas, doc):
-        """Create header and footer on each page and update TOC page numbers"""
+        """Create header and footer on each page"""
         canvas.saveState()
         
         # Header
@@ -155,24 +228,20 @@ class PDFGenerator:
                    A4[0] - PDF_CONSTANTS['MARGIN'], 
                    50)
                    
-        # Update TOC entries with actual page numbers
-        if hasattr(self, 'toc') and hasattr(self, '_processing_section'):
-            current_section = self._processing_section
-            for entry in self.toc.entries:
-                if entry.title == current_section:
-                    entry.page_number = doc.page
-                    
         canvas.restoreState()
 
+    def _heading(self, text: str, style_name: str, level: int, toc_title: Optional[str] = None) -> Paragraph:
+        """Heading paragraph registered in the TOC; its page is recorded when it is placed"""
+        heading = Paragraph(escape(text), self.styles[style_name])
+        heading.toc_entry_id = self.toc.add_entry(toc_title or text, level)
+        return heading
+
     def create_cover_page(self) -> List:
         """Create the report cover page"""
         elements = []
         elements.append(Spacer(1, 2*inch))
         
-        self.toc.add_entry("Cover", 1)
-        
-        elements.append(Paragraph(self.report_title, 
-                                self.styles['CustomMainTitle']))
+        elements.append(self._heading(self.report_title, 'CustomMainTitle', 1, toc_title="Cover"))
         elements.append(Spacer(1, inch))
         
         date_str = datetime.now().strftime("%B %d, %Y")
@@ -180,22 +249,16 @@ class PDFGenerator:
                                 self.styles['CustomHeader']))
         elements.append(Spacer(1, 2*inch))
         elements.append(PageBreak())
-        
-        self.toc.increment_page()
         return elements
 
     def create_executive_summary(self, analysis_data: List[Dict]) -> List:
         """Create executive summary section"""
         elements = []
         
-        self.toc.add_entry("Executive Summary", 1)
-        elements.append(Paragraph("Executive Summary", 
-                            self.styles['CustomChapterTitle']))
+        elements.append(self._heading("Executive Summary", 'CustomChapterTitle', 1))
         
         # Overview Section
-        self.toc.add_entry("Overview", 2)
-        elements.append(Paragraph("Overview", 
-                            self.styles['CustomSectionTitle']))
+        elements.append(self._heading("Overview", 'CustomSectionTitle', 2))
         
         overview = """This report presents a comprehensive analysis of the provided data, 
         highlighting key patterns, trends, and actionable insights derived from the analysis."""
@@ -203,9 +266,7 @@ class PDFGenerator:
                                 self.styles['CustomBodyText']))
         
         # Key Findings Section
-        self.toc.add_entry("Key Findings", 2)
-        elements.append(Paragraph("Key Findings", 
-                            self.styles['CustomSectionTitle']))
+        elements.append(self._heading("Key Findings", 'CustomSectionTitle', 2))
         
         for data in analysis_data:
             content = data.get('content', {})
@@ -217,9 +278,7 @@ class PDFGenerator:
                     ))
         
         # Key Conclusions Section
-        self.toc.add_entry("Key Conclusions", 2)
-        elements.append(Paragraph("Key Conclusions", 
-                            self.styles['CustomSectionTitle']))
+        elements.append(self._heading("Key Conclusions", 'CustomSectionTitle', 2))
         
         for data in analysis_data:
             content = data.get('content', {})
@@ -240,49 +299,13 @@ class PDFGenerator:
                         ))
         
         elements.append(PageBreak())
-        self.toc.increment_page()
-        return elements
-
-    def create_table_of_contents(self) -> List:
-        """Create table of contents with all sections and subsections"""
-        elements = []
-        elements.append(Paragraph("Table of Contents", 
-                                self.styles['CustomChapterTitle']))
-        elements.append(Spacer(1, 0.2*inch))
-        
-        for entry in self.toc.get_entries():
-            # Calculate indentation based on level
-            indent = "  " * (entry.level - 1)
-            title = f"{indent}{entry.title}"
-            
-            # Calculate dots based on level-specific spacing
-            available_space = 60 - len(title)  # Adjust total width as needed
-            dots = "." * max(available_space, 3)
-            
-            # Create TOC line with appropriate style based on level
-            toc_line = f"{title}{dots}{entry.page_number}"
-            
-            # Select style based on level
-            if entry.level == 1:
-                style = self.styles['CustomTOCEntry']
-            elif entry.level == 2:
-                style = self.styles['CustomTOCEntry2']
-            else:
-                style = self.styles['CustomTOCEntry3']
-            
-            elements.append(Paragraph(toc_line, style))
-        
-        elements.append(PageBreak())
-        self.toc.increment_page()
         return elements
 
     def create_conclusions(self, analysis_data: List[Dict]) -> List:
         """Create conclusions and next steps section"""
         elements = []
         
-        self.toc.add_entry("Limitations & Next Steps", 1)
-        elements.append(Paragraph("Limitations & Next Steps", 
-                            self.styles['CustomChapterTitle']))
+        elements.append(self._heading("Limitations & Next Steps", 'CustomChapterTitle', 1))
         
         # Collect unique limitations and next steps
         limitations = set()
@@ -297,9 +320,7 @@ class PDFGenerator:
         
         # Add Limitations
         if limitations:
-            self.toc.add_entry("Limitations", 2)
-            elements.append(Paragraph("Limitations", 
-                                    self.styles['CustomSectionTitle']))
+            elements.append(self._heading("Limitations", 'CustomSectionTitle', 2))
             for limitation in limitations:
                 elements.append(Paragraph(
                     f"• {limitation}",
@@ -309,9 +330,7 @@ class PDFGenerator:
         
         # Add Next Steps
         if next_steps:
-            self.toc.add_entry("Next Steps", 2)
-            elements.append(Paragraph("Next Steps", 
-                                    self.styles['CustomSectionTitle']))
+            elements.append(self._heading("Next Steps", 'CustomSectionTitle', 2))
             for step in next_steps:
                 elements.append(Paragraph(
                     f"• {step}",
@@ -386,11 +405,9 @@ class PDFGenerator:
                         content.get('question', f'Analysis {i}'))
                 
                 chapter_title = f"{i}. {self._format_title(title)}"
-                self.toc.add_entry(chapter_title, 1)
                 
                 # Add chapter title
-                elements.append(Paragraph(chapter_title, 
-                                        self.styles['CustomChapterTitle']))
+                elements.append(self._heading(chapter_title, 'CustomChapterTitle', 1))
                 
                 # Handle visualization with proper validation
                 graph_path = data.get('graph_path')
@@ -404,10 +421,6 @@ class PDFGenerator:
                         figure_title = f"Figure {i}: {self._format_title(title)}"
                         elements.append(Paragraph(figure_title, 
                                             self.styles['CustomCaption']))
-                        self.figures_list.append({
-                            'title': figure_title,
-                            'page': self.toc.current_page
-                        })
                     except Exception as e:
                         logger.error(f"Failed to add image for chapter {i}: {str(e)}")
                 else:
@@ -417,16 +430,11 @@ class PDFGenerator:
                 if sections := content.get('sections', []):
                     for section in sections:
                         if heading := section.get('heading'):
-                            elements.append(Paragraph(
-                                heading,
-                                self.styles['CustomSectionTitle']
-                            ))
-                            self.toc.add_entry(heading, 2)
+                            elements.append(self._heading(heading, 'CustomSectionTitle', 2))
                         
                         elements.extend(self._format_analysis_section(section))
                 
                 elements.append(PageBreak())
-                self.toc.increment_page()
                 
             except Exception as e:
                 logger.error(f"Error processing chapter {i}: {str(e)}")
@@ -443,19 +451,20 @@ class PDFGenerator:
                        for word in text.replace('_', ' ').split())
 
     def _load_analysis_data(self) -> List[Dict]:
-        """Load and validate analysis data from JSON files"""
+        """Load analysis data in question order from the output manifest"""
         analysis_data = []
-        # Update to look for .json files without _analysis suffix
-        json_files = sorted(path_config.DESCRIPTION_DIR.glob('*.json'))
-        
-        for json_file in json_files:
+        # 按输出清单中的问题顺序加载解读，图表路径直接取自清单
+        for entry in load_manifest(self.context)["entries"]:
+            graph_path = Path(entry["graph_path"])
+            json_file = self.context.description_dir / f"{graph_path.stem}.json"
             try:
+                if not json_file.exists():
+                    logger.warning(f"No description generated for {graph_path.name}")
+                    continue
+                
                 with open(json_file, 'r') as file:
                     analysis = json.load(file)
                 
-                # Construct graph path - no need to replace _analysis anymore
-                graph_path = path_config.GRAPHS_DIR / f"{json_file.stem}.png"
-                
                 if not self._validate_graph_path(str(graph_path)):
                     logger.warning(f"Graph file missing or invalid for {json_file.name}")
                     continue
@@ -467,12 +476,6 @@ class PDFGenerator:
                 
             except Exception as e:
                 logger.error(f"Error loading analysis file {json_file}: {str(e)}")
-                
-        # Sort analysis data by question number if available
-        try:
-            analysis_data.sort(key=lambda x: int(x["content"].get("question", "").split()[0]))
-        except:
-            logger.warning("Could not sort analysis data by question number")
             
         return analysis_data
 
@@ -485,11 +488,12 @@ class PDFGenerator:
             
             # Generate output filename
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = path_config.OUTPUT_DIR / f"analysis_report_{timestamp}.pdf"
+            output_path = self.context.output_dir / f"analysis_report_{timestamp}.pdf"
             
             # Initialize document
-            doc = SimpleDocTemplate(
+            doc = ReportDocTemplate(
                 str(output_path),
+                toc=self.toc,
                 pagesize=A4,
                 rightMargin=PDF_CONSTANTS['MARGIN'],
                 leftMargin=PDF_CONSTANTS['MARGIN'],
@@ -497,7 +501,7 @@ class PDFGenerator:
                 bottomMargin=PDF_CONSTANTS['MARGIN']
             )
             
-            # First pass: Generate content and collect TOC entries
+            # Generate content and collect TOC entries
             content = []
             content.extend(self.create_cover_page())  # Page 1
             
@@ -506,32 +510,24 @@ class PDFGenerator:
             if not analysis_data:
                 raise PDFGenerationError("No valid analysis data found")
             
-            # Create placeholders for TOC
-            toc_start = len(content)
-            content.extend([PageBreak()])  # TOC placeholder
-            
             # Add remaining content
-            content.extend(self.create_executive_summary(analysis_data))
-            content.extend(self.create_analysis_chapters(analysis_data))
-            content.extend(self.create_conclusions(analysis_data))
-            
-            # Calculate TOC pages (approximate)
-            toc_entries = len(self.toc.entries)
-            estimated_toc_pages = (toc_entries * 20 + 100) // 700 + 1  # Rough estimate
-            self.toc.set_toc_pages(estimated_toc_pages)
-            
-            # Create actual TOC
-            toc_content = self.toc.create_toc_content(self.styles)
+            body = []
+            body.extend(self.create_executive_summary(analysis_data))
+            body.extend(self.create_analysis_chapters(analysis_data))
+            body.extend(self.create_conclusions(analysis_data))
             
-            # Insert TOC at placeholder position
-            content[toc_start:toc_start+1] = toc_content
+            # TOC follows the cover; its lines take their real height in the same layout pass
+            content.extend(self.toc.create_toc_content(self.styles))
+            content.extend(body)
             
-            # Build PDF
+            # Build PDF: pages are recorded as headings are placed, and the
+            # TOC page numbers are filled in once when the canvas is saved
             try:
                 doc.build(
                     content,
                     onFirstPage=self.create_header_footer,
-                    onLaterPages=self.create_header_footer
+                    onLaterPages=self.create_header_footer,
+                    canvasmaker=partial(TOCCanvas, toc=self.toc)
                 )
             except Exception as e:
                 raise PDFGenerationError(f"PDF build failed: {str(e)}")
@@ -544,10 +540,10 @@ class PDFGenerator:
             raise PDFGenerationError(str(e))
 
 @log_execution
-def generate_pdf(report_title: str = "Data Analysis Report") -> str:
+def generate_pdf(context: RequestContext, report_title: str = "Data Analysis Report") -> str:
     """Main function to generate PDF report"""
     try:
-        generator = PDFGenerator()
+        generator = PDFGenerator(context)
         return generator.generate_pdf(report_title=report_title)
     except Exception as e:
         logger.error(f"PDF generation failed: {str(e)}")
@@ -72,6 +72,25 @@ const App = () => {
     setQuestions(newQuestions);
   };
 
+  // Poll a background analysis job until it finishes and return its result
+  const waitForJob = async (jobId, intervalMs = 2000) => {
+    while (true) {
+      const statusResponse = await fetch(`http://localhost:8000/api/v1/jobs/${jobId}`);
+      const statusData = await statusResponse.json();
+      if (!statusResponse.ok) {
+        throw new Error(statusData.detail || 'Failed to get job status');
+      }
+      if (statusData.status === 'failed') {
+        throw new Error(statusData.error || 'Analysis failed');
+      }
+      if (statusData.status === 'completed') {
+        const resultResponse = await fetch(`http://localhost:8000/api/v1/jobs/${jobId}/result`);
+        return resultResponse.json();
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+  };
+
   // Report generation functions
   const generateReport = async () => {
     const finalReportTitle = reportTitle.trim() || 'Data Analysis Report';
@@ -101,11 +120,17 @@ const App = () => {
         },
         body: JSON.stringify({ 
           questions: questions.filter(q => q.trim()),
-          reportTitle: finalReportTitle
+          reportTitle: finalReportTitle,
+          request_id: uploadData.request_id
         }),
       });
 
-      const analysisData = await analysisResponse.json();
+      const jobData = await analysisResponse.json();
+      if (!analysisResponse.ok || !jobData.job_id) {
+        throw new Error(jobData.detail || 'Failed to start analysis');
+      }
+
+      const analysisData = await waitForJob(jobData.job_id);
       setResult(analysisData);
     } catch (error) {
       console.error('Error:', error);
@@ -10,7 +10,10 @@ const Results = ({ result }) => {
   const handleDownload = async () => {
     try {
       setDownloadError(null);
-      const response = await fetch('http://localhost:8000/api/v1/get-pdf');
+      const pdfUrl = result.request_id
+        ? `http://localhost:8000/api/v1/get-pdf/${result.request_id}`
+        : 'http://localhost:8000/api/v1/get-pdf';
+      const response = await fetch(pdfUrl);
       
       if (!response.ok) {
         const errorData = await response.json();